@@ -0,0 +1,13 @@
+from multiple.caches import (
+    disk,
+    main,
+    memory,
+    sql,
+)
+
+__all__ = [
+    'disk',
+    'main',
+    'memory',
+    'sql',
+]
@@ -0,0 +1,215 @@
+import collections
+import hashlib
+import os
+import tempfile
+import threading
+
+from multiple.caches import main
+
+
+class DiskCache(main.CacheBase):
+    """Local cache of files on the disk, bounded in bytes.
+
+    Each entry is stored in its own file, named after the hash of its key,
+    so the cached files can be opened or mapped directly. When the cache
+    exceeds its maximum size the least recently used entries are evicted,
+    the recency is kept in the modification time of the files so it's
+    shared by the processes using the same directory.
+
+    The processes sharing the directory don't see the files written by the
+    others, the directory is scanned again once a process has written a
+    fraction of the maximum size, or thinks the cache is full, and the
+    entries are evicted from the actual usage of the directory.
+    """
+
+    MAX_SIZE = 1024 * 1024 * 1024
+    # the fraction of the maximum size written between two scans
+    SCAN_FRACTION = 16
+
+    def __init__(self, directory, max_size=MAX_SIZE):
+        """
+            Args:
+                directory (str):
+                    The directory where to store the cached files, created
+                    if it doesn't exist.
+                max_size (int):
+                    The maximum size in bytes of the cached files.
+        """
+        self.directory = directory
+        self.max_size = max_size
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._rescan()
+
+    def _scan(self):
+        """Get the size of the cached files, from the least recently used.
+
+            Returns:
+                (collections.OrderedDict(str, int))
+        """
+        files = []
+
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.startswith('tmp'):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name, stat.st_size))
+
+        return collections.OrderedDict(
+            (name, size) for _, name, size in sorted(files)
+        )
+
+    def _rescan(self):
+        self._entries = self._scan()
+        self._size = sum(self._entries.values())
+        # the bytes written since the last scan
+        self._written = 0
+
+    def _filename(self, key):
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    @property
+    def size(self):
+        return self._size
+
+    def __contains__(self, key):
+        return os.path.exists(self.path(key))
+
+    def path(self, key):
+        """Get the path of the file of an entry, cached or not."""
+        return os.path.join(self.directory, self._filename(key))
+
+    def get_path(self, key):
+        """Get the path of the file of a cached entry and mark it as recently
+            used.
+
+            Args:
+                key (str): The key of the entry.
+            Returns:
+                (str) The path or None if the entry isn't cached.
+        """
+        filename = self._filename(key)
+        path = os.path.join(self.directory, filename)
+
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self._discard(filename)
+            return None
+
+        with self._lock:
+            if filename in self._entries:
+                self._entries.move_to_end(filename)
+
+        return path
+
+    def get(self, key, default=None):
+        """Get the content of a cached entry.
+
+            Args:
+                key (str): The key of the entry.
+                default: The value returned if the entry isn't cached.
+            Returns:
+                (bytes) The content.
+        """
+        path = self.get_path(key)
+
+        if path is None:
+            return default
+
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return default
+
+    def set(self, key, value):
+        """Cache the content of an entry.
+
+            Args:
+                key (str): The key of the entry.
+                value (bytes): The content.
+            Returns:
+                (str) The path of the cached file.
+        """
+        return self.set_file(key, lambda f: f.write(value))
+
+    def set_file(self, key, write):
+        """Cache an entry written by a function.
+
+            The file is written under a temporary name and renamed once
+            complete, a cached file is never seen partially written.
+
+            Args:
+                key (str): The key of the entry.
+                write (Callable[[IO], None]): Write the content in the file.
+            Returns:
+                (str) The path of the cached file.
+        """
+        filename = self._filename(key)
+        path = os.path.join(self.directory, filename)
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='tmp')
+
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+        with self._lock:
+            self._discard(filename)
+            self._entries[filename] = size
+            self._size += size
+            self._written += size
+
+            if self._size > self.max_size \
+                    or self._written > self.max_size // self.SCAN_FRACTION:
+                self._rescan()
+                self._evict()
+
+        return path
+
+    def delete(self, key):
+        filename = self._filename(key)
+
+        try:
+            os.remove(os.path.join(self.directory, filename))
+        except FileNotFoundError:
+            pass
+
+        with self._lock:
+            self._discard(filename)
+
+    def clear(self):
+        with self._lock:
+            for filename in self._entries:
+                try:
+                    os.remove(os.path.join(self.directory, filename))
+                except FileNotFoundError:
+                    pass
+
+            self._entries.clear()
+            self._size = 0
+
+    def _discard(self, filename):
+        size = self._entries.pop(filename, None)
+
+        if size is not None:
+            self._size -= size
+
+    def _evict(self):
+        """Remove the least recently used files until the cache fits."""
+        while self._size > self.max_size and len(self._entries) > 1:
+            filename, size = self._entries.popitem(last=False)
+            self._size -= size
+
+            try:
+                os.remove(os.path.join(self.directory, filename))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,57 @@
+class CacheBase(object):
+    """
+        Expose a public interface to cache values by key.
+
+        The keys are strings and the values bytes, the caches are bounded in
+        size and evict their least recently used entries.
+    """
+
+    def get(self, key, default=None):
+        """Get the value of an entry.
+
+            Args:
+                key (str): The key of the entry.
+                default: The value returned if the entry isn't cached.
+            Returns:
+                (bytes) The value.
+        """
+        raise NotImplementedError
+
+    def set(self, key, value):
+        """Cache the value of an entry.
+
+            Args:
+                key (str): The key of the entry.
+                value (bytes): The value.
+        """
+        raise NotImplementedError
+
+    def delete(self, key):
+        """Remove an entry, if it's cached."""
+        raise NotImplementedError
+
+    def clear(self):
+        """Remove all the entries."""
+        raise NotImplementedError
+
+    @property
+    def size(self):
+        """The size in bytes of the cached values."""
+        raise NotImplementedError
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __getitem__(self, key):
+        value = self.get(key)
+
+        if value is None:
+            raise KeyError(key)
+
+        return value
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __delitem__(self, key):
+        self.delete(key)
@@ -0,0 +1,110 @@
+import collections
+import threading
+
+import dulwich.lru_cache
+
+CacheStats = collections.namedtuple(
+    'CacheStats',
+    (
+        'hits',       # the number of values found
+        'misses',     # the number of values not found
+        'evictions',  # the number of values evicted to free space
+        'size',       # the size of the values cached
+        'max_size',   # the maximum size of the values cached
+    )
+)
+
+
+class LRUSizeCache(dulwich.lru_cache.LRUSizeCache):
+    """Thread safe LRU cache bounded by the size of its values.
+
+    The dulwich cache moves its entries in a linked list on every access,
+    each access is done under a lock so the cache can be shared by the
+    threads fetching the objects concurrently.
+
+    The hits, the misses and the evictions are counted to size the cache.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._lock = threading.RLock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        super().__init__(*args, **kwargs)
+
+    @property
+    def stats(self):
+        """
+            Returns:
+                (CacheStats) The counters and the size of the cache.
+        """
+        with self._lock:
+            return CacheStats(
+                self.hits, self.misses, self.evictions, self._value_size,
+                self._max_size
+            )
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.misses = self.evictions = 0
+
+    def __contains__(self, key):
+        with self._lock:
+            return super().__contains__(key)
+
+    def __getitem__(self, key):
+        with self._lock:
+            try:
+                value = super().__getitem__(key)
+            except KeyError:
+                self.misses += 1
+                raise
+
+            self.hits += 1
+
+            return value
+
+    def __len__(self):
+        with self._lock:
+            return super().__len__()
+
+    def get(self, key, default=None):
+        with self._lock:
+            node = self._cache.get(key)
+
+            if node is None:
+                self.misses += 1
+                return default
+
+            self.hits += 1
+
+            return super().get(key, default)
+
+    def add(self, key, value, cleanup=None):
+        with self._lock:
+            super().add(key, value, cleanup=cleanup)
+
+    def keys(self):
+        with self._lock:
+            return list(super().keys())
+
+    def _remove_lru(self):
+        self.evictions += 1
+        super()._remove_lru()
+
+    def cleanup(self):
+        with self._lock:
+            super().cleanup()
+
+    def clear(self):
+        with self._lock:
+            # the entries cleared aren't evictions
+            evictions = self.evictions
+            super().clear()
+            self.evictions = evictions
+
+    def resize(self, max_size, after_cleanup_size=None):
+        with self._lock:
+            super().resize(max_size, after_cleanup_size=after_cleanup_size)
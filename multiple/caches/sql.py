@@ -0,0 +1,293 @@
+import sqlite3
+import threading
+import time
+
+from multiple.caches import main
+
+try:
+    import psycopg2
+except ImportError:  # pragma: no cover
+    psycopg2 = None
+
+
+class SqlCacheBase(main.CacheBase):
+    """Cache of values in a sql table, bounded in bytes.
+
+    The entries are stored with their size and their last access time, the
+    total size is kept in a one row table updated in the same transactions
+    as the entries. When the cache exceeds its maximum size the least
+    recently used entries are evicted.
+
+    The access time of an entry is only updated once it's older than a
+    granularity, most reads don't write, the recency of the eviction is
+    approximate within the granularity.
+
+    The queries are written with the `?` placeholders and the implementations
+    give the types of the columns and the connection.
+    """
+
+    MAX_SIZE = 1024 * 1024 * 1024
+    BINARY_TYPE = 'BLOB'
+    TIME_TYPE = 'REAL'
+    PLACEHOLDER = '?'
+    ACCESS_GRANULARITY = 60
+
+    def __init__(self, table='multiple_cache', max_size=MAX_SIZE,
+                 access_granularity=ACCESS_GRANULARITY):
+        """
+            Args:
+                table (str):
+                    The name of the table of the entries, the total size is
+                    kept in the table suffixed with `_size`.
+                max_size (int):
+                    The maximum size in bytes of the cached values.
+                access_granularity (float):
+                    The number of seconds the access time of an entry is
+                    kept before a read updates it.
+        """
+        self.table = table
+        self.max_size = max_size
+        self.access_granularity = access_granularity
+
+        self._lock = threading.Lock()
+        self._connection = self._connect()
+
+        with self._transaction() as cursor:
+            cursor.execute(self._sql(
+                'CREATE TABLE IF NOT EXISTS {table} ('
+                ' key TEXT PRIMARY KEY,'
+                ' value {binary} NOT NULL,'
+                ' size INTEGER NOT NULL,'
+                ' accessed_at {time} NOT NULL'
+                ')'
+            ))
+            cursor.execute(self._sql(
+                'CREATE INDEX IF NOT EXISTS {table}_accessed_at'
+                ' ON {table} (accessed_at)'
+            ))
+            cursor.execute(self._sql(
+                'CREATE TABLE IF NOT EXISTS {table}_size ('
+                ' id INTEGER PRIMARY KEY,'
+                ' size BIGINT NOT NULL'
+                ')'
+            ))
+            cursor.execute(self._sql(
+                'INSERT INTO {table}_size (id, size) VALUES (0, 0)'
+                ' ON CONFLICT (id) DO NOTHING'
+            ))
+
+    def _connect(self):
+        """Open the connection to the database.
+
+            Returns:
+                A DB-API 2.0 connection.
+        """
+        raise NotImplementedError
+
+    def _sql(self, query):
+        return query.format(
+            table=self.table, binary=self.BINARY_TYPE, time=self.TIME_TYPE
+        ).replace('?', self.PLACEHOLDER)
+
+    def _transaction(self):
+        return _Transaction(self._connection, self._lock)
+
+    @property
+    def size(self):
+        with self._transaction() as cursor:
+            cursor.execute(self._sql('SELECT size FROM {table}_size'))
+            return cursor.fetchone()[0]
+
+    def get(self, key, default=None):
+        now = time.time()
+
+        with self._transaction() as cursor:
+            cursor.execute(
+                self._sql(
+                    'SELECT value, accessed_at FROM {table} WHERE key = ?'
+                ),
+                (key, )
+            )
+            row = cursor.fetchone()
+
+            if row is None:
+                return default
+
+            if row[1] <= now - self.access_granularity:
+                # the clients reading the entry concurrently update it once
+                cursor.execute(
+                    self._sql(
+                        'UPDATE {table} SET accessed_at = ?'
+                        ' WHERE key = ? AND accessed_at = ?'
+                    ),
+                    (now, key, row[1])
+                )
+
+        return bytes(row[0])
+
+    def set(self, key, value):
+        value = bytes(value)
+
+        with self._transaction() as cursor:
+            self._delete(cursor, key)
+
+            cursor.execute(
+                self._sql(
+                    'INSERT INTO {table} (key, value, size, accessed_at)'
+                    ' VALUES (?, ?, ?, ?) ON CONFLICT (key) DO NOTHING'
+                ),
+                (key, self._binary(value), len(value), time.time())
+            )
+
+            # another client may have just set the entry, its value is kept
+            if cursor.rowcount:
+                self._update_size(cursor, len(value))
+                self._evict(cursor, key)
+
+    def delete(self, key):
+        with self._transaction() as cursor:
+            self._delete(cursor, key)
+
+    def clear(self):
+        with self._transaction() as cursor:
+            cursor.execute(self._sql('DELETE FROM {table}'))
+            cursor.execute(self._sql('UPDATE {table}_size SET size = 0'))
+
+    def _binary(self, value):
+        return value
+
+    def _delete(self, cursor, key):
+        """Delete an entry and get its size, 0 if it isn't cached."""
+        cursor.execute(
+            self._sql('SELECT size FROM {table} WHERE key = ?'), (key, )
+        )
+        row = cursor.fetchone()
+
+        if row is None:
+            return 0
+
+        cursor.execute(
+            self._sql('DELETE FROM {table} WHERE key = ?'), (key, )
+        )
+        self._update_size(cursor, -row[0])
+
+        return row[0]
+
+    def _update_size(self, cursor, delta):
+        if delta:
+            cursor.execute(
+                self._sql('UPDATE {table}_size SET size = size + ?'),
+                (delta, )
+            )
+
+    def _evict(self, cursor, key):
+        """Remove the least recently used entries until the cache fits, the
+            entry just set is kept.
+        """
+        cursor.execute(self._sql('SELECT size FROM {table}_size'))
+        size = cursor.fetchone()[0]
+
+        while size > self.max_size:
+            cursor.execute(
+                self._sql(
+                    'SELECT key, size FROM {table} WHERE key != ?'
+                    ' ORDER BY accessed_at LIMIT 64'
+                ),
+                (key, )
+            )
+            rows = cursor.fetchall()
+
+            if not rows:
+                break
+
+            for evicted_key, evicted_size in rows:
+                if size <= self.max_size:
+                    break
+
+                cursor.execute(
+                    self._sql('DELETE FROM {table} WHERE key = ?'),
+                    (evicted_key, )
+                )
+                self._update_size(cursor, -evicted_size)
+                size -= evicted_size
+
+    def close(self):
+        self._connection.close()
+
+
+class _Transaction(object):
+    """Run queries in a transaction, committed unless an error is raised."""
+
+    def __init__(self, connection, lock):
+        self._connection = connection
+        self._lock = lock
+        self._cursor = None
+
+    def __enter__(self):
+        self._lock.acquire()
+        self._cursor = self._connection.cursor()
+
+        return self._cursor
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if exc_type is None:
+                self._connection.commit()
+            else:
+                self._connection.rollback()
+        finally:
+            self._cursor.close()
+            self._lock.release()
+
+
+class SqliteCache(SqlCacheBase):
+    """Cache in a sqlite database, by default in memory.
+
+    It shares the implementation of the postgres cache, it stands in for it
+    when no postgres is available, e.g in the tests.
+    """
+
+    def __init__(self, path=':memory:', **kwargs):
+        """
+            Args:
+                path (str): The path of the database.
+                kwargs: The arguments of `SqlCacheBase`.
+        """
+        self.path = path
+
+        super().__init__(**kwargs)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, check_same_thread=False)
+
+
+class PostgresCache(SqlCacheBase):
+    """Cache in a postgres database, shared by all its clients.
+
+    Note:
+        Require `psycopg2`.
+    """
+
+    BINARY_TYPE = 'BYTEA'
+    TIME_TYPE = 'DOUBLE PRECISION'
+    PLACEHOLDER = '%s'
+
+    def __init__(self, dsn, **kwargs):
+        """
+            Args:
+                dsn (str): The connection string of the database, e.g
+                    `postgresql://user@localhost/multiple`.
+                kwargs: The arguments of `SqlCacheBase`.
+        """
+        if psycopg2 is None:
+            raise ImportError('PostgresCache requires psycopg2')
+
+        self.dsn = dsn
+
+        super().__init__(**kwargs)
+
+    def _connect(self):
+        return psycopg2.connect(self.dsn)
+
+    def _binary(self, value):
+        return psycopg2.Binary(value)
@@ -0,0 +1,2 @@
+class LockError(IOError):
+    """The lock is held by another owner or the lease was lost."""
@@ -1,11 +1,27 @@
 from multiple.repositories.backends.git import (
+    aio,
+    cache,
+    commit_graph,
     file,
+    lock,
+    multi_pack_index,
     object_store,
     pack,
+    path_history,
+    repack,
+    stream,
 )
 
 __all__ = [
+    'aio',
+    'cache',
+    'commit_graph',
     'file',
+    'lock',
+    'multi_pack_index',
     'object_store',
-    'pack'
+    'pack',
+    'path_history',
+    'repack',
+    'stream',
 ]
@@ -0,0 +1,298 @@
+import asyncio
+import concurrent.futures
+import functools
+import io
+
+from multiple.repositories.backends.git import file
+from multiple.repositories.backends.git import pack
+from multiple.repositories.backends.git import stream
+
+
+class Runner(object):
+    """Run the blocking calls of the git backend from an event loop.
+
+    boto3 has no asyncio interface, the s3 requests and the object
+    decompression are run in a pool of threads, the coroutines awaiting
+    them leave the event loop free. The pool bounds the number of calls in
+    flight.
+
+    Note:
+        The botocore client keeps 10 connections by default, to keep
+        hundreds of requests in flight the client of the bucket must be
+        created with a larger pool, e.g
+        `botocore.config.Config(max_pool_connections=256)`.
+    """
+
+    MAX_CONCURRENCY = 256
+
+    def __init__(self, max_concurrency=MAX_CONCURRENCY, executor=None,
+                 loop=None):
+        """
+            Args:
+                max_concurrency (int):
+                    The maximum number of blocking calls run in parallel,
+                    ignored when an executor is provided.
+                executor (concurrent.futures.Executor):
+                    The executor where to run the blocking calls.
+                loop (asyncio.AbstractEventLoop):
+                    The event loop, by default the running loop of the
+                    coroutine awaiting the call.
+        """
+        if executor is None:
+            executor = concurrent.futures.ThreadPoolExecutor(max_concurrency)
+
+        self.executor = executor
+        self.loop = loop
+
+    def run(self, func, *args, **kwargs):
+        """Run a blocking function in the executor.
+
+            Returns:
+                (asyncio.Future) The result of the function.
+        """
+        loop = self.loop or asyncio.get_running_loop()
+
+        return loop.run_in_executor(
+            self.executor, functools.partial(func, *args, **kwargs)
+        )
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+
+class AsyncAwsS3GitFile(object):
+    """asyncio interface of `file.AwsS3GitFile`.
+
+    Like any file, a file must not be used by concurrent coroutines.
+    """
+
+    def __init__(self, aws_file, runner):
+        self._file = aws_file
+        self._runner = runner
+
+    @classmethod
+    async def open(cls, filename, mode, bufsize, aws_s3_bucket, runner,
+                   **kwargs):
+        """Open a file in a s3 bucket, the lock is taken in write mode.
+
+            Args:
+                filename (str): The full key of the file in the s3 bucket.
+                mode (str): The mode of the file.
+                bufsize (int): The size of the chunks read in read mode.
+                aws_s3_bucket (s3.Bucket): The bucket used to store the file.
+                runner (Runner): The runner of the blocking calls.
+                kwargs: The other arguments of `file.AwsS3GitFile`.
+            Returns:
+                (AsyncAwsS3GitFile)
+        """
+        aws_file = await runner.run(
+            file.AwsS3GitFile, filename, mode, bufsize, aws_s3_bucket,
+            **kwargs
+        )
+
+        return cls(aws_file, runner)
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+    @property
+    def name(self):
+        return self._file.name
+
+    @property
+    def mode(self):
+        return self._file.mode
+
+    def tell(self):
+        return self._file.tell()
+
+    async def read(self, size=-1):
+        return await self._runner.run(self._file.read, size)
+
+    async def readline(self, size=-1):
+        return await self._runner.run(self._file.readline, size)
+
+    async def seek(self, offset, whence=io.SEEK_SET):
+        return await self._runner.run(self._file.seek, offset, whence)
+
+    async def write(self, data):
+        return await self._runner.run(self._file.write, data)
+
+    async def close(self):
+        await self._runner.run(self._file.close)
+
+    async def abort(self):
+        await self._runner.run(self._file.abort)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self._runner.run(
+            self._file.__exit__, exc_type, exc_val, exc_tb
+        )
+
+
+class AsyncObjectReader(object):
+    """asyncio interface of `stream.ObjectReader`.
+
+    The content is still decompressed chunk by chunk, each read is run in
+    the runner.
+    """
+
+    def __init__(self, reader, runner):
+        self._reader = reader
+        self._runner = runner
+
+    @property
+    def length(self):
+        return self._reader.length
+
+    def tell(self):
+        return self._reader.tell()
+
+    async def read(self, size=-1):
+        return await self._runner.run(self._reader.read, size)
+
+    async def seek(self, offset, whence=io.SEEK_SET):
+        return await self._runner.run(self._reader.seek, offset, whence)
+
+    def close(self):
+        self._reader.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+async def load_pack_index(path, aws_s3_bucket, runner, disk_cache=None):
+    """asyncio version of `pack.load_pack_index`.
+
+        Args:
+            path (str):
+                The key to the index file in the aws s3 bucket.
+            aws_s3_bucket (boto3.Bucket):
+                The aws s3 bucket where the file pack index is stored.
+            runner (Runner):
+                The runner of the blocking calls.
+            disk_cache (multiple.caches.disk.DiskCache):
+                The local cache of the index files.
+        Returns:
+            PackIndex: Loaded pack index file
+    """
+    return await runner.run(
+        pack.load_pack_index, path, aws_s3_bucket, disk_cache=disk_cache
+    )
+
+
+async def open_object_stream(object_store, sha, runner,
+                             chunk_size=stream.CHUNK_SIZE):
+    """asyncio version of `stream.open_object_stream`.
+
+        Returns:
+            (AsyncObjectReader) The stream on the object content.
+        Raises:
+            KeyError if the object doesn't exists.
+    """
+    reader = await runner.run(
+        stream.open_object_stream, object_store, sha, chunk_size
+    )
+
+    return AsyncObjectReader(reader, runner)
+
+
+class AsyncRepositoryGit(object):
+    """asyncio interface of `main.RepositoryGit`.
+
+    The packs of the s3 object stores are read by thread, many contents can
+    be fetched concurrently from the same repository, e.g with
+    `asyncio.gather`.
+    """
+
+    def __init__(self, repository, runner=None):
+        """
+            Args:
+                repository (main.RepositoryGit): The repository.
+                runner (Runner): The runner of the blocking calls, a new
+                    runner by default.
+        """
+        if runner is None:
+            runner = Runner()
+
+        self.repository = repository
+        self.runner = runner
+
+    async def get(self, path, reference, default=None):
+        """Get a stream on the content at the reference.
+
+            Returns:
+                (AsyncObjectReader)
+            Raises:
+                KeyError if the reference doesn't exists.
+        """
+        reader = await self.runner.run(
+            self.repository.get, path, reference, default=None
+        )
+
+        if reader is None:
+            return default
+
+        return AsyncObjectReader(reader, self.runner)
+
+    async def commit(self, index, **kwargs):
+        """Commit the index in the repository.
+
+            Args:
+                index (AsyncMemoryIndex): The index to commit.
+                kwargs: The arguments of `main.RepositoryGit.commit`.
+            Returns:
+                (bytes) The commit reference.
+        """
+        return await self.runner.run(
+            self.repository.commit, index.index, **kwargs
+        )
+
+    async def open_index_at(self, reference, **kwargs):
+        """Open a new working index at the specified reference.
+
+            Args:
+                reference (bytes): The commit reference, None for an empty
+                    index.
+                kwargs: The arguments of `main.RepositoryGit.open_index_at`.
+            Returns:
+                (AsyncMemoryIndex)
+        """
+        index = await self.runner.run(
+            self.repository.open_index_at, reference, **kwargs
+        )
+
+        return AsyncMemoryIndex(index, self.runner)
+
+
+class AsyncMemoryIndex(object):
+    """asyncio interface of `main.MemoryIndex`.
+
+    An index isn't thread safe, its operations must be awaited one by one.
+    """
+
+    def __init__(self, index, runner):
+        self.index = index
+        self.runner = runner
+
+    async def get(self, path, default=None):
+        return await self.runner.run(self.index.get, path, default)
+
+    async def add(self, contents):
+        # the contents are read in the runner too, consume an iterable of
+        # contents on the loop first
+        await self.runner.run(self.index.add, list(contents))
+
+    async def remove(self, paths):
+        await self.runner.run(self.index.remove, list(paths))
+
+    async def root_tree(self):
+        """Build the dirty trees and get the root tree."""
+        return await self.runner.run(lambda: self.index.root_tree)
@@ -0,0 +1,289 @@
+import hashlib
+
+import dulwich
+import dulwich.objects
+
+from multiple import caches
+from multiple.repositories.backends.git import stream
+
+# the kinds of the objects resolved by path
+BLOB = 'blob'
+TREE = 'tree'
+
+
+class RepositoryCache(object):
+    """Cache of the objects and of the resolved paths of a repository.
+
+    The git objects are immutable and the paths are resolved at a commit
+    sha, the entries never have to be invalidated and can be shared by all
+    the processes using the same cache, e.g a postgres cache. The commits
+    and the trees are cached with their sha, the blobs only when they are
+    small enough. The shas of the blobs and of the trees are cached with
+    their path and the commit sha.
+    """
+
+    MAX_BLOB_SIZE = 1024 * 64
+
+    def __init__(self, cache, max_blob_size=MAX_BLOB_SIZE):
+        """
+            Args:
+                cache (multiple.caches.main.CacheBase):
+                    The cache where to store the entries.
+                max_blob_size (int):
+                    The maximum size of the blobs cached.
+        """
+        self.cache = cache
+        self.max_blob_size = max_blob_size
+
+    @staticmethod
+    def _object_key(sha):
+        return 'object:{0}'.format(sha.decode('ascii'))
+
+    @staticmethod
+    def _path_key(kind, reference, path):
+        return '{0}:{1}:{2}'.format(
+            kind, reference.decode('ascii'), hashlib.sha1(path).hexdigest()
+        )
+
+    def get_object(self, sha):
+        """Get an object.
+
+            Args:
+                sha (bytes): The object sha.
+            Returns:
+                (dulwich.objects.ShaFile) The object or None if it isn't
+                cached.
+        """
+        value = self.cache.get(self._object_key(sha))
+
+        if value is None:
+            return None
+
+        return dulwich.objects.ShaFile.from_raw_string(
+            value[0], value[1:], sha=sha
+        )
+
+    def set_object(self, obj):
+        """Cache an object, the blobs larger than the maximum size are
+            ignored.
+
+            Args:
+                obj (dulwich.objects.ShaFile): The object.
+        """
+        if obj.type_num == dulwich.objects.Blob.type_num \
+                and obj.raw_length() > self.max_blob_size:
+            return
+
+        self.cache.set(
+            self._object_key(obj.id),
+            bytes((obj.type_num, )) + obj.as_raw_string()
+        )
+
+    def get_path_sha(self, kind, reference, path):
+        """Get the sha of the object at a path at a commit.
+
+            Args:
+                kind (str): The kind of the object, `BLOB` or `TREE`.
+                reference (bytes): The commit sha.
+                path (bytes): The rootless path of the object.
+            Returns:
+                (bytes) The object sha or None if it isn't cached.
+        """
+        return self.cache.get(self._path_key(kind, reference, path))
+
+    def set_path_sha(self, kind, reference, path, sha):
+        self.cache.set(self._path_key(kind, reference, path), sha)
+
+
+class ObjectCache(object):
+    """In-process LRU cache of the parsed objects, bounded in bytes.
+
+    The commits, the trees and the small blobs are kept parsed, the size of
+    an object is approximated by the length of its raw content. The cache
+    can be shared by all the repositories of a process, the objects are
+    shared with the callers and must not be modified.
+    """
+
+    MAX_SIZE = 1024 * 1024 * 64
+    MAX_BLOB_SIZE = 1024 * 64
+
+    def __init__(self, max_size=MAX_SIZE, max_blob_size=MAX_BLOB_SIZE):
+        """
+            Args:
+                max_size (int): The maximum size in bytes of the objects.
+                max_blob_size (int): The maximum size of the blobs cached.
+        """
+        self.max_blob_size = max_blob_size
+        self._objects = caches.memory.LRUSizeCache(
+            max_size, compute_size=lambda obj: obj.raw_length()
+        )
+
+    @property
+    def stats(self):
+        """
+            Returns:
+                (multiple.caches.memory.CacheStats) The counters and the
+                size of the cache.
+        """
+        return self._objects.stats
+
+    def get_object(self, sha):
+        return self._objects.get(sha)
+
+    def set_object(self, obj):
+        if obj.type_num == dulwich.objects.Blob.type_num \
+                and obj.raw_length() > self.max_blob_size:
+            return
+
+        self._objects.add(obj.id, obj)
+
+
+class PathCache(object):
+    """In-process LRU cache of the shas of the objects at the paths of the
+    commits, bounded in bytes.
+
+    The trees are resolved once for each directory of a commit, the reads
+    in the same directory skip the intermediate trees. The cache can be
+    shared by all the repositories of a process.
+    """
+
+    MAX_SIZE = 1024 * 1024 * 8
+
+    def __init__(self, max_size=MAX_SIZE):
+        """
+            Args:
+                max_size (int): The maximum size in bytes of the paths and
+                    of the shas.
+        """
+        self._shas = caches.memory.LRUSizeCache(
+            max_size, compute_size=lambda value: len(value[0]) + len(value[1])
+        )
+
+    @property
+    def stats(self):
+        """
+            Returns:
+                (multiple.caches.memory.CacheStats) The counters and the
+                size of the cache.
+        """
+        return self._shas.stats
+
+    def get_path_sha(self, kind, reference, path):
+        value = self._shas.get((kind, reference, path))
+
+        return None if value is None else value[1]
+
+    def set_path_sha(self, kind, reference, path, sha):
+        self._shas.add((kind, reference, path), (path, sha))
+
+
+def get_object(object_caches, sha):
+    """Get an object from the first cache holding it, the caches before it
+        are filled.
+
+        Args:
+            object_caches (list): The caches, `ObjectCache` or
+                `RepositoryCache`, from the fastest.
+            sha (bytes): The object sha.
+        Returns:
+            (dulwich.objects.ShaFile) The object or None if it isn't cached.
+    """
+    for n, object_cache in enumerate(object_caches):
+        obj = object_cache.get_object(sha)
+
+        if obj is not None:
+            set_object(object_caches[:n], obj)
+            return obj
+
+    return None
+
+
+def set_object(object_caches, obj):
+    for object_cache in object_caches:
+        object_cache.set_object(obj)
+
+
+def load_object(object_store, sha, object_caches):
+    """Get an object from the caches, or from the object store and cache
+        it.
+
+        Args:
+            object_store (dulwich.object_store.BaseObjectStore):
+                The object store where the object is stored.
+            sha (bytes): The object sha.
+            object_caches (list): The caches, from the fastest.
+        Returns:
+            (dulwich.objects.ShaFile)
+        Raises:
+            KeyError if the object doesn't exists.
+    """
+    obj = get_object(object_caches, sha)
+
+    if obj is None:
+        obj = object_store[sha]
+        set_object(object_caches, obj)
+
+    return obj
+
+
+def load_objects(object_store, shas, object_caches):
+    """Get many objects from the caches, or from the object store and cache
+        them.
+
+        The objects missing from the caches are loaded together, see
+        `stream.load_objects`.
+
+        Args:
+            object_store (dulwich.object_store.BaseObjectStore):
+                The object store where the objects are stored.
+            shas (Iterable[bytes]): The objects shas.
+            object_caches (list): The caches, from the fastest.
+        Returns:
+            (dict(bytes, dulwich.objects.ShaFile)) The objects by sha.
+        Raises:
+            KeyError if an object doesn't exists.
+    """
+    objects = {}
+    missing = []
+
+    for sha in shas:
+        obj = get_object(object_caches, sha)
+
+        if obj is None:
+            missing.append(sha)
+        else:
+            objects[sha] = obj
+
+    for obj in stream.load_objects(object_store, missing):
+        set_object(object_caches, obj)
+        objects[obj.id] = obj
+
+    return objects
+
+
+def get_path_sha(path_caches, kind, reference, path):
+    """Get the sha of the object at a path at a commit from the first cache
+        holding it, the caches before it are filled.
+
+        Args:
+            path_caches (list): The caches, `PathCache` or
+                `RepositoryCache`, from the fastest.
+            kind (str): The kind of the object, `BLOB` or `TREE`.
+            reference (bytes): The commit sha.
+            path (bytes): The rootless path of the object.
+        Returns:
+            (bytes) The object sha or None if it isn't cached.
+    """
+    for n, path_cache in enumerate(path_caches):
+        sha = path_cache.get_path_sha(kind, reference, path)
+
+        if sha is not None:
+            set_path_sha(path_caches[:n], kind, reference, path, sha)
+            return sha
+
+    return None
+
+
+def set_path_sha(path_caches, kind, reference, path, sha):
+    for path_cache in path_caches:
+        path_cache.set_path_sha(kind, reference, path, sha)
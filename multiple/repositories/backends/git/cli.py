@@ -0,0 +1,169 @@
+import argparse
+import sys
+
+import boto3
+import dulwich
+import dulwich.refs
+import dulwich.repo
+
+from multiple.repositories.backends import git as git_aws
+from multiple.repositories.backends.git import main as git_main
+
+
+def open_repository(args):
+    """Open the repository given by the command line arguments.
+
+        Returns:
+            (git_main.RepositoryGit)
+    """
+    path_history = None
+    if args.path_history:
+        path_history = git_aws.path_history.PathHistory(args.path_history)
+
+    if args.aws_s3_bucket:
+        object_store = git_aws.object_store.AwsS3ObjectStore(
+            boto3.resource('s3').Bucket(args.aws_s3_bucket),
+            path=args.repository
+        )
+        backend = dulwich.repo.BaseRepo(
+            object_store, dulwich.refs.DictRefsContainer({})
+        )
+    else:
+        backend = dulwich.repo.Repo(args.repository)
+
+    return git_main.RepositoryGit(backend, path_history=path_history)
+
+
+def rebuild_path_history(args):
+    repository = open_repository(args)
+    references = [
+        reference.encode('ascii') for reference in args.references
+    ] or None
+
+    repository.rebuild_path_history(references)
+
+
+def repack(args):
+    repository = open_repository(args)
+    roots = None
+
+    if args.prune:
+        roots = [reference.encode('ascii') for reference in args.references]
+
+    repacker = git_aws.repack.Repacker(
+        repository.backend.object_store,
+        small_pack_size=args.small_pack_size,
+        max_step_size=args.max_step_size,
+        budget=git_aws.repack.Budget(
+            io_rate=args.io_rate, cpu_ratio=args.cpu_ratio
+        ),
+        prune_expiry=args.prune_expiry
+    )
+
+    for step in repacker.run(roots):
+        print(
+            'merged {0} packs and {1} loose objects, pruned {2} objects'
+            .format(step.packs, step.loose_objects, step.pruned_objects)
+        )
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        prog='multiple-git',
+        description='Maintain the git repositories of multiple.'
+    )
+    parser.add_argument(
+        '--aws-s3-bucket',
+        help='The bucket of the repository, by default the repository is '
+             'a local directory.'
+    )
+    parser.add_argument(
+        '--path-history',
+        help='The path of the path history database, by default next to '
+             'the packs of a local repository.'
+    )
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    rebuild_parser = subparsers.add_parser(
+        'rebuild-path-history',
+        help='Rebuild the index of the commits changing each path.'
+    )
+    rebuild_parser.add_argument(
+        'repository',
+        help='The directory of the repository, or its key prefix in the '
+             'bucket.'
+    )
+    rebuild_parser.add_argument(
+        'references', nargs='*',
+        help='The commits to index with their ancestors, by default the '
+             'commits of the refs and of the commit graph.'
+    )
+    rebuild_parser.set_defaults(func=rebuild_path_history)
+
+    repack_parser = subparsers.add_parser(
+        'repack',
+        help='Merge the small packs and the loose objects into larger '
+             'packs.'
+    )
+    repack_parser.add_argument(
+        'repository',
+        help='The directory of the repository, or its key prefix in the '
+             'bucket.'
+    )
+    repack_parser.add_argument(
+        'references', nargs='*',
+        help='The commits to keep with their ancestors when pruning.'
+    )
+    repack_parser.add_argument(
+        '--prune', action='store_true',
+        help='Drop the objects merged which are unreachable from the '
+             'references.'
+    )
+    repack_parser.add_argument(
+        '--prune-expiry', type=float,
+        default=git_aws.repack.Repacker.PRUNE_EXPIRY,
+        help='The age in seconds under which the unreachable objects are '
+             'kept.'
+    )
+    repack_parser.add_argument(
+        '--small-pack-size', type=int,
+        default=git_aws.repack.Repacker.SMALL_PACK_SIZE,
+        help='The size in bytes under which a pack is merged.'
+    )
+    repack_parser.add_argument(
+        '--max-step-size', type=int,
+        default=git_aws.repack.Repacker.MAX_STEP_SIZE,
+        help='The maximum size in bytes of the packs merged at once.'
+    )
+    repack_parser.add_argument(
+        '--io-rate', type=float,
+        help='The maximum number of bytes read by second.'
+    )
+    repack_parser.add_argument(
+        '--cpu-ratio', type=float,
+        help='The maximum share of the cpu time, between 0 and 1.'
+    )
+    repack_parser.set_defaults(func=repack)
+
+    return parser
+
+
+def main(argv=None):
+    parser = get_parser()
+    args = parser.parse_args(argv)
+
+    if args.command == 'rebuild-path-history' and args.aws_s3_bucket \
+            and not args.path_history:
+        parser.error('--path-history is required with --aws-s3-bucket')
+
+    if args.command == 'repack' and args.prune and not args.references:
+        parser.error('the references to keep are required with --prune')
+
+    args.func(args)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
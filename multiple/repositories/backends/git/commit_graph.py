@@ -0,0 +1,530 @@
+import collections
+import fcntl
+import heapq
+import itertools
+import mmap
+import os
+import struct
+import tempfile
+
+import dulwich
+import dulwich.object_store
+import dulwich.objects
+
+MAGIC = b'MCGR'
+VERSION = 1
+
+# magic and version
+HEADER = struct.Struct('>4sI')
+# sha, root tree sha, commit time, generation, first and second parents
+RECORD = struct.Struct('>20s20sqIII')
+# parent in the extra edges list
+EDGE = struct.Struct('>I')
+
+LOOKUP_MAGIC = b'MCGL'
+# magic, version, number of records indexed
+LOOKUP_HEADER = struct.Struct('>4sII')
+# number of commits with a sha starting by a byte lower or equal to each byte
+FANOUT = struct.Struct('>256I')
+# commit sha, record position
+LOOKUP_RECORD = struct.Struct('>20sI')
+
+NO_PARENT = 0xffffffff
+# flag of the second parent of the octopus merges, the position is an index
+# in the extra edges list, the last edge of a commit is flagged too
+EXTRA_EDGES = 0x80000000
+
+CommitGraphEntry = collections.namedtuple(
+    'CommitGraphEntry',
+    (
+        'sha',          # the commit sha
+        'tree',         # the root tree sha
+        'commit_time',  # the commit time
+        'generation',   # 1 for a root commit, 1 + the parents generation
+        'parents',      # the parents shas
+    )
+)
+
+
+def default_path(object_store):
+    """Get the path of the commit graph of an object store, next to the
+        packs of the stores on the disk, or next to the local cache of the
+        stores which have one.
+
+        Returns:
+            (str) The path or None if the object store has nothing on the
+            disk.
+    """
+    if isinstance(object_store, dulwich.object_store.DiskObjectStore):
+        return os.path.join(object_store.path, 'info', 'commit-graph')
+
+    local_info_path = getattr(object_store, 'local_info_path', None)
+
+    if local_info_path is not None:
+        return local_info_path('commit-graph')
+
+    return None
+
+
+class CommitGraph(object):
+    """Append-only graph of the commits, with their generation numbers.
+
+    Each commit is stored in a fixed size record, its parents are given by
+    the positions of their records, the ancestry queries are answered
+    without reading any commit object. The generation number of a commit is
+    greater than the generation of all its ancestors, a walk looking for an
+    ancestor stops at the commits with a lower generation.
+
+    The records are appended to the file, which is mapped in memory. The
+    file can be shared by processes, the records are appended under a file
+    lock and the records appended by the other processes are mapped on
+    refresh. Without path the graph is kept in memory.
+
+    The records are found by sha in a lookup file, their positions sorted
+    by sha with a fanout table, which is searched where it's mapped. The
+    records appended since the lookup was written are indexed in memory,
+    the lookup is rewritten once they're numerous enough.
+    """
+
+    # the number of records indexed in memory before the lookup is rewritten
+    LOOKUP_THRESHOLD = 1024
+
+    def __init__(self, path=None):
+        """
+            Args:
+                path (str): The path of the graph file, created if it
+                    doesn't exist, the extra edges are stored next to it.
+        """
+        self.path = path
+
+        # position of the records not in the lookup by binary sha
+        self._positions = {}
+        self._count = 0
+        self._lookup = b''
+        self._lookup_count = 0
+        self._fanout = None
+
+        if path is None:
+            self._records = bytearray(HEADER.pack(MAGIC, VERSION))
+            self._edges = bytearray()
+        else:
+            self._records = self._edges = b''
+
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._create(path, HEADER.pack(MAGIC, VERSION))
+            self._create(self.edges_path, b'')
+
+            self.refresh()
+
+    @property
+    def edges_path(self):
+        return self.path + '-edges'
+
+    @property
+    def lookup_path(self):
+        return self.path + '-lookup'
+
+    @staticmethod
+    def _create(path, content):
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            return
+
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+
+    @staticmethod
+    def _map(path):
+        with open(path, 'rb') as f:
+            if not os.fstat(f.fileno()).st_size:
+                return b''
+
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def refresh(self):
+        """Map the records appended by the other processes."""
+        if self.path is None:
+            return
+
+        size = os.path.getsize(self.path)
+
+        if size <= HEADER.size + self._count * RECORD.size:
+            return
+
+        # the lookup is written from the records, the edges before the
+        # records referencing them
+        try:
+            self._load_lookup(self._map(self.lookup_path))
+        except FileNotFoundError:
+            pass
+
+        self._edges = self._map(self.edges_path)
+        self._records = self._map(self.path)
+
+        magic, version = HEADER.unpack_from(self._records)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('unsupported commit graph %r' % self.path)
+
+        self._index((len(self._records) - HEADER.size) // RECORD.size)
+
+    def _load_lookup(self, lookup):
+        """Use a lookup unless it indexes fewer records."""
+        if not lookup:
+            return
+
+        magic, version, count = LOOKUP_HEADER.unpack_from(lookup)
+        if magic != LOOKUP_MAGIC or version != VERSION:
+            raise ValueError('unsupported commit graph %r' % self.path)
+
+        if count <= self._lookup_count:
+            return
+
+        self._lookup = lookup
+        self._lookup_count = count
+        self._fanout = FANOUT.unpack_from(lookup, LOOKUP_HEADER.size)
+        self._positions = {
+            sha: position for sha, position in self._positions.items()
+            if position >= count
+        }
+
+    def _write_lookup(self):
+        """Write the lookup of all the records mapped."""
+        entries = sorted(
+            (self._binary_sha(position), position)
+            for position in range(self._count)
+        )
+        fanout = [0] * 256
+
+        for sha, _ in entries:
+            fanout[sha[0]] += 1
+
+        for n in range(1, 256):
+            fanout[n] += fanout[n - 1]
+
+        lookup = b''.join(itertools.chain(
+            (
+                LOOKUP_HEADER.pack(LOOKUP_MAGIC, VERSION, self._count),
+                FANOUT.pack(*fanout)
+            ),
+            (LOOKUP_RECORD.pack(sha, position) for sha, position in entries)
+        ))
+
+        if self.path is None:
+            self._load_lookup(lookup)
+            return
+
+        # written under a temporary name, a lookup is never seen partially
+        # written
+        fd, temporary_path = tempfile.mkstemp(
+            dir=os.path.dirname(self.path)
+        )
+
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(lookup)
+
+            os.replace(temporary_path, self.lookup_path)
+        except BaseException:
+            os.remove(temporary_path)
+            raise
+
+        self._load_lookup(self._map(self.lookup_path))
+
+    def _index(self, count):
+        """Index the positions of the new records."""
+        for position in range(max(self._count, self._lookup_count), count):
+            self._positions[self._binary_sha(position)] = position
+
+        self._count = count
+
+        if len(self._positions) >= self.LOOKUP_THRESHOLD:
+            self._write_lookup()
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        """Iterate over the shas of the commits, the parents first."""
+        self.refresh()
+
+        for position in range(self._count):
+            yield self._sha(position)
+
+    def __contains__(self, sha):
+        return self._find(dulwich.objects.hex_to_sha(sha)) is not None
+
+    def _find(self, binary_sha):
+        """Find the position of a record, in memory then in the lookup."""
+        position = self._positions.get(binary_sha)
+
+        if position is not None or self._fanout is None:
+            return position
+
+        start = self._fanout[binary_sha[0] - 1] if binary_sha[0] else 0
+        end = self._fanout[binary_sha[0]]
+        records_offset = LOOKUP_HEADER.size + FANOUT.size
+
+        while start < end:
+            middle = (start + end) // 2
+            sha, position = LOOKUP_RECORD.unpack_from(
+                self._lookup, records_offset + middle * LOOKUP_RECORD.size
+            )
+
+            if sha < binary_sha:
+                start = middle + 1
+            elif sha > binary_sha:
+                end = middle
+            else:
+                return position
+
+        return None
+
+    def _position(self, sha):
+        binary_sha = dulwich.objects.hex_to_sha(sha)
+        position = self._find(binary_sha)
+
+        if position is None:
+            self.refresh()
+            position = self._find(binary_sha)
+
+        if position is None:
+            raise KeyError(sha)
+
+        return position
+
+    def _record(self, position):
+        return RECORD.unpack_from(
+            self._records, HEADER.size + position * RECORD.size
+        )
+
+    def _binary_sha(self, position):
+        offset = HEADER.size + position * RECORD.size
+
+        return bytes(self._records[offset:offset + 20])
+
+    def _generation(self, position):
+        return self._record(position)[3]
+
+    def _parents(self, position):
+        """Get the positions of the parents of a commit."""
+        _, _, _, _, first, second = self._record(position)
+
+        if first == NO_PARENT:
+            return []
+
+        if second == NO_PARENT:
+            return [first]
+
+        if not second & EXTRA_EDGES:
+            return [first, second]
+
+        parents = [first]
+        offset = (second & ~EXTRA_EDGES) * EDGE.size
+
+        while True:
+            edge, = EDGE.unpack_from(self._edges, offset)
+            parents.append(edge & ~EXTRA_EDGES)
+
+            if edge & EXTRA_EDGES:
+                return parents
+
+            offset += EDGE.size
+
+    def _sha(self, position):
+        return dulwich.objects.sha_to_hex(self._record(position)[0])
+
+    def get(self, sha, default=None):
+        """Get the entry of a commit.
+
+            Args:
+                sha (bytes): The commit sha.
+                default: The value returned if the commit isn't in the
+                    graph.
+            Returns:
+                (CommitGraphEntry)
+        """
+        try:
+            position = self._position(sha)
+        except KeyError:
+            return default
+
+        binary_sha, tree, commit_time, generation, _, _ = \
+            self._record(position)
+
+        return CommitGraphEntry(
+            dulwich.objects.sha_to_hex(binary_sha),
+            dulwich.objects.sha_to_hex(tree),
+            commit_time,
+            generation,
+            [self._sha(parent) for parent in self._parents(position)]
+        )
+
+    def __getitem__(self, sha):
+        entry = self.get(sha)
+
+        if entry is None:
+            raise KeyError(sha)
+
+        return entry
+
+    def add(self, sha, tree, commit_time, parents):
+        """Add a commit to the graph, its parents must be in the graph.
+
+            Args:
+                sha (bytes): The commit sha.
+                tree (bytes): The root tree sha.
+                commit_time (int): The commit time.
+                parents (list(bytes)): The parents shas.
+            Returns:
+                (CommitGraphEntry)
+            Raises:
+                KeyError if a parent isn't in the graph.
+        """
+        if self.path is None:
+            self._add(sha, tree, commit_time, parents)
+        else:
+            with open(self.path, 'ab') as records_file:
+                fcntl.flock(records_file, fcntl.LOCK_EX)
+
+                try:
+                    self.refresh()
+                    self._add(sha, tree, commit_time, parents, records_file)
+                finally:
+                    fcntl.flock(records_file, fcntl.LOCK_UN)
+
+            self.refresh()
+
+        return self[sha]
+
+    def _add(self, sha, tree, commit_time, parents, records_file=None):
+        if sha in self:
+            return
+
+        positions = [self._position(parent) for parent in parents]
+        generation = 1 + max(
+            (self._generation(position) for position in positions),
+            default=0
+        )
+
+        first = second = NO_PARENT
+        edges = b''
+
+        if positions:
+            first = positions[0]
+
+        if len(positions) == 2:
+            second = positions[1]
+        elif len(positions) > 2:
+            second = EXTRA_EDGES | (len(self._edges) // EDGE.size)
+            edges = b''.join(
+                EDGE.pack(position) for position in positions[1:-1]
+            ) + EDGE.pack(EXTRA_EDGES | positions[-1])
+
+        record = RECORD.pack(
+            dulwich.objects.hex_to_sha(sha), dulwich.objects.hex_to_sha(tree),
+            commit_time, generation, first, second
+        )
+
+        if records_file is None:
+            self._edges.extend(edges)
+            self._records.extend(record)
+            self._index(self._count + 1)
+            return
+
+        if edges:
+            with open(self.edges_path, 'ab') as edges_file:
+                edges_file.write(edges)
+
+        records_file.write(record)
+
+    def is_ancestor(self, ancestor, sha):
+        """Check if a commit is an ancestor of another, or the same.
+
+            The commits with a generation lower than the ancestor one are
+            not walked.
+
+            Args:
+                ancestor (bytes): The sha of the supposed ancestor.
+                sha (bytes): The sha of the descendant.
+            Returns:
+                (bool)
+            Raises:
+                KeyError if a commit isn't in the graph.
+        """
+        target = self._position(ancestor)
+        generation = self._generation(target)
+
+        pending = [self._position(sha)]
+        seen = set(pending)
+
+        while pending:
+            position = pending.pop()
+
+            if position == target:
+                return True
+
+            if self._generation(position) <= generation:
+                continue
+
+            for parent in self._parents(position):
+                if parent not in seen:
+                    seen.add(parent)
+                    pending.append(parent)
+
+        return False
+
+    def merge_bases(self, sha, other_sha):
+        """Get the best common ancestors of two commits.
+
+            The commits are walked from the highest generation, a commit is
+            walked after all its descendants.
+
+            Args:
+                sha (bytes): The sha of a commit.
+                other_sha (bytes): The sha of the other commit.
+            Returns:
+                (list(bytes)) The shas of the common ancestors which aren't
+                ancestors of another common ancestor.
+            Raises:
+                KeyError if a commit isn't in the graph.
+        """
+        one, other = self._position(sha), self._position(other_sha)
+
+        if one == other:
+            return [sha]
+
+        both, stale = 0x3, 0x4
+        flags = {one: 0x1, other: 0x2}
+        pending = [
+            (-self._generation(one), one), (-self._generation(other), other)
+        ]
+        bases = []
+
+        while any(not flags[position] & stale for _, position in pending):
+            _, position = heapq.heappop(pending)
+            position_flags = flags[position]
+
+            if position_flags & both == both and not position_flags & stale:
+                bases.append(position)
+                position_flags |= stale
+                flags[position] = position_flags
+
+            for parent in self._parents(position):
+                parent_flags = flags.get(parent, 0)
+
+                if parent_flags | position_flags != parent_flags:
+                    flags[parent] = parent_flags | position_flags
+                    heapq.heappush(
+                        pending, (-self._generation(parent), parent)
+                    )
+
+        return [
+            self._sha(base)
+            for base in bases
+            if not any(
+                other_base != base
+                and self.is_ancestor(self._sha(base), self._sha(other_base))
+                for other_base in bases
+            )
+        ]
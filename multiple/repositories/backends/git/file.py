@@ -1,18 +1,162 @@
 import botocore
+import concurrent.futures
 import io
+import threading
+
+from multiple import caches
+from multiple.repositories.backends import git as git_aws
+
+
+class _PartBuffer(io.BytesIO):
+    """Buffer of the part being written in a multipart upload.
+
+    The buffer keeps the offset of the parts already uploaded, so tell and
+    seek still give positions in the whole file.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.offset = 0
+
+    def tell(self):
+        return self.offset + super().tell()
+
+    def seek(self, pos, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos -= self.offset
+
+            if pos < 0:
+                raise IOError('the parts already uploaded can not be seek')
+
+        return self.offset + super().seek(pos, whence)
+
+    def pop_parts(self, part_size):
+        """Remove the complete parts from the buffer.
+
+            Args:
+                part_size (int): The size of the parts.
+            Returns:
+                (list(bytes)) The complete parts.
+        """
+        data = self.getvalue()
+        parts_size = len(data) - len(data) % part_size
+
+        parts = [
+            data[offset:offset + part_size]
+            for offset in range(0, parts_size, part_size)
+        ]
+
+        super().seek(0)
+        self.truncate()
+        super().write(data[parts_size:])
+        self.offset += parts_size
+
+        return parts
+
+
+class _StreamingBody(io.RawIOBase):
+    """Raw stream over the body of a s3 object.
+
+    The body is read forward, a forward seek skips the content. The first
+    backward seek downloads the whole object in a memory buffer, used for
+    the rest of the reads.
+    """
+
+    def __init__(self, s3_object, get):
+        """
+            Args:
+                s3_object (dict): The response of the s3 object get.
+                get (Callable[[], dict]): Get the s3 object again.
+        """
+        super().__init__()
+
+        self._body = s3_object['Body']
+        self._length = s3_object['ContentLength']
+        self._get = get
+
+        self._position = 0
+        self._buffer = None
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        if self._buffer is not None:
+            return self._buffer.tell()
+
+        return self._position
+
+    def readinto(self, b):
+        if self._buffer is not None:
+            return self._buffer.readinto(b)
+
+        data = self._body.read(len(b))
+        b[:len(data)] = data
+        self._position += len(data)
+
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if self._buffer is not None:
+            return self._buffer.seek(offset, whence)
+
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self._length
+
+        if offset < 0:
+            raise ValueError('negative seek position %r' % offset)
+
+        if offset < self._position:
+            self._body.close()
+            self._buffer = io.BytesIO(self._get()['Body'].read())
+
+            return self._buffer.seek(offset)
+
+        while self._position < offset:
+            skipped = self._body.read(min(offset - self._position, 1 << 16))
+
+            if not skipped:
+                break
+
+            self._position += len(skipped)
+
+        return self._position
+
+    def close(self):
+        if not self.closed:
+            self._body.close()
+
+            if self._buffer is not None:
+                self._buffer.close()
+
+        super().close()
 
 
 class AwsS3GitFile(object):
     """File in a s3 bucket that follows the git locking protocol for writes.
 
+    In read mode the s3 object body is streamed and read forward chunk by
+    chunk, the content is buffered in memory only if a backward seek
+    happens.
+
+    In write mode the content is buffered until it reaches the multipart
+    threshold, it's then streamed to a multipart upload part by part. The
+    parts are uploaded in parallel by a bounded pool of threads and retried
+    individually, the memory used stays around a few parts size. The upload
+    is completed on close() and aborted on abort(), or when the block of a
+    with statement raises.
+
+    The write mode takes a lock named after the file, by default a lock
+    file on the bucket, its lease is renewed while the file is written.
 
     Note:
         You *must* call close() or abort() on a _GitFile for the lock to be
         released. Typically this will happen in a finally block.
-
-    Todo:
-        Implement the lock; using SimpleDB, a Redis lock or just writting a
-        lock file on the bucket?
     """
 
     PROXY_METHODS = {
@@ -21,7 +165,18 @@ class AwsS3GitFile(object):
         'truncate',
     }
 
-    def __init__(self, filename, mode, bufsize, aws_s3_bucket):
+    CHUNK_SIZE = 1024 * 256
+    MULTIPART_THRESHOLD = 1024 * 1024 * 16
+    PART_SIZE = 1024 * 1024 * 8
+    # the minimum size of the parts but the last one required by s3
+    MIN_PART_SIZE = 1024 * 1024 * 5
+    PART_RETRIES = 3
+    MAX_CONCURRENCY = 4
+
+    def __init__(self, filename, mode, bufsize, aws_s3_bucket,
+                 multipart_threshold=MULTIPART_THRESHOLD, part_size=PART_SIZE,
+                 part_retries=PART_RETRIES, max_concurrency=MAX_CONCURRENCY,
+                 lock_backend=None):
         """
             Args:
                 filename (str):
@@ -30,14 +185,37 @@ class AwsS3GitFile(object):
                     The mode of the file, only read/write in binary mode is
                     currently supported.
                 bufsize (int):
-                    The size of the buffer, currently ignored.
+                    The size of the chunks read from the s3 object in read
+                    mode, a default size is used if it's lower or equal to
+                    0.
                 aws_s3_bucket (s3.Bucket):
                     The bucket used to store the file.
+                multipart_threshold (int):
+                    The size from which the content written is streamed to a
+                    multipart upload.
+                part_size (int):
+                    The size of the parts of a multipart upload, at least
+                    5 MB as required by s3.
+                part_retries (int):
+                    The number of times the upload of a part is retried.
+                max_concurrency (int):
+                    The maximum number of parts uploaded in parallel.
+                lock_backend (git_aws.lock.LockBackendBase):
+                    The backend of the write lock, by default a lock file in
+                    the bucket.
             Raises:
                 IOError: If the mode isn't supported
+                ValueError: If the part size is lower than 5 MB.
+                multiple.exceptions.LockError: If the file is already
+                    locked in write mode.
         """
         self.is_supported_mode(mode, raise_exception=True)
 
+        if part_size < self.MIN_PART_SIZE:
+            raise ValueError(
+                'part size %d lower than %d' % (part_size, self.MIN_PART_SIZE)
+            )
+
         self._aws_bucket = aws_s3_bucket
         self._aws_key = None
 
@@ -49,16 +227,38 @@ class AwsS3GitFile(object):
 
         self._is_writable = None
 
+        if lock_backend is None:
+            lock_backend = git_aws.lock.AwsS3LockBackend(aws_s3_bucket)
+
+        self._lock_backend = lock_backend
+        self._lock = None
+
+        self._multipart_threshold = multipart_threshold
+        self._part_size = part_size
+        self._part_retries = part_retries
+        self._max_concurrency = max_concurrency
+
+        self._upload_id = None
+        self._upload_executor = None
+        self._upload_slots = None
+        self._uploaded_parts = []
+
         self._buffer = None
-        try:
-            s3_object = self.aws_key.get()
-        except botocore.exceptions.ClientError as e:
-            if e.response['Error']['Code'] == 'NoSuchKey' and self.is_writable:
-                self._buffer = io.BytesIO()
-            else:
-                raise IOError('no such file %r', self.name)
+        if self.is_writable:
+            self.aquire_lock()
+
+            # like a local file the write mode truncates the file
+            self._buffer = _PartBuffer()
         else:
-            self._buffer = io.BytesIO(s3_object['Body'].read())
+            try:
+                s3_object = self.aws_key.get()
+            except botocore.exceptions.ClientError:
+                raise IOError('no such file %r', self.name)
+            else:
+                self._buffer = io.BufferedReader(
+                    _StreamingBody(s3_object, self.aws_key.get),
+                    buffer_size=bufsize if bufsize > 0 else self.CHUNK_SIZE
+                )
 
         for method in self.PROXY_METHODS:
             setattr(self, method, getattr(self._buffer, method))
@@ -135,35 +335,176 @@ class AwsS3GitFile(object):
 
     def write(self, *args, **kwarg):
         if self.is_writable:
-            return self._buffer.write(*args, **kwarg)
+            written = self._buffer.write(*args, **kwarg)
+            self._upload_parts()
+
+            return written
 
         raise IOError('read-only file')
 
     def writelines(self, *args, **kwarg):
         if self.is_writable:
-            return self._buffer.writelines(*args, **kwarg)
+            self._buffer.writelines(*args, **kwarg)
+            self._upload_parts()
+
+            return
 
         raise IOError('read-only file')
 
+    @property
+    def _client(self):
+        return self._aws_bucket.meta.client
+
+    def _upload_parts(self):
+        """Upload the complete parts once the multipart threshold is
+            reached.
+        """
+        self._lock.renew_if_needed()
+
+        buffered = self._buffer.tell() - self._buffer.offset
+
+        if self._upload_id is None:
+            if buffered < self._multipart_threshold:
+                return
+
+            self._upload_id = self._client.create_multipart_upload(
+                Bucket=self._aws_bucket.name, Key=self._filename
+            )['UploadId']
+            self._upload_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self._max_concurrency
+            )
+            self._upload_slots = threading.BoundedSemaphore(
+                self._max_concurrency
+            )
+        elif buffered < self._part_size:
+            return
+
+        for part in self._buffer.pop_parts(self._part_size):
+            self._submit_part(part)
+
+    def _submit_part(self, part):
+        """Upload a part in the pool, wait for a free slot first so the parts
+            in memory stay bounded.
+        """
+        part_number = len(self._uploaded_parts) + 1
+
+        self._upload_slots.acquire()
+
+        future = self._upload_executor.submit(
+            self._upload_part, part_number, part
+        )
+        future.add_done_callback(lambda _: self._upload_slots.release())
+
+        self._uploaded_parts.append(future)
+
+    def _upload_part(self, part_number, part):
+        """Upload a part, retrying on failures.
+
+            Returns:
+                (dict) The part number and the ETag of the uploaded part.
+        """
+        attempt = 0
+
+        while True:
+            try:
+                response = self._client.upload_part(
+                    Bucket=self._aws_bucket.name, Key=self._filename,
+                    UploadId=self._upload_id, PartNumber=part_number,
+                    Body=part,
+                )
+            except (botocore.exceptions.BotoCoreError,
+                    botocore.exceptions.ClientError):
+                attempt += 1
+                if attempt > self._part_retries:
+                    raise
+            else:
+                return {'PartNumber': part_number, 'ETag': response['ETag']}
+
+    def _complete_upload(self):
+        """Upload the remaining content and complete the upload.
+
+            The lease of the lock is renewed right before the content is
+            published, a writer which lost its lock doesn't overwrite the
+            content of the new owner.
+
+            Raises:
+                multiple.exceptions.LockError if the lock was lost, the
+                upload is aborted.
+        """
+        if self._upload_id is None:
+            self._lock.renew()
+
+            self._buffer.seek(self._buffer.offset)
+            self.aws_key.put(Body=self._buffer)
+
+            return
+
+        last_part = self._buffer.getvalue()
+
+        if last_part or not self._uploaded_parts:
+            self._submit_part(last_part)
+
+        try:
+            parts = [future.result() for future in self._uploaded_parts]
+
+            self._lock.renew()
+            self._client.complete_multipart_upload(
+                Bucket=self._aws_bucket.name, Key=self._filename,
+                UploadId=self._upload_id, MultipartUpload={'Parts': parts},
+            )
+        except BaseException:
+            self._abort_upload()
+            raise
+        finally:
+            self._upload_executor.shutdown()
+
+    def _abort_upload(self):
+        if self._upload_id is None:
+            return
+
+        for future in self._uploaded_parts:
+            future.cancel()
+
+        self._upload_executor.shutdown()
+        self._client.abort_multipart_upload(
+            Bucket=self._aws_bucket.name, Key=self._filename,
+            UploadId=self._upload_id,
+        )
+        self._upload_id = None
+
     def abort(self):
-        self.close()
+        try:
+            if not self.closed and self.is_writable:
+                self._abort_upload()
+        finally:
+            self._buffer.close()
+            self.release_lock()
 
     def flush(self):
         self._buffer.flush()
+
         if self.is_writable:
-            self.seek(0)
-            self.aws_key.put(Body=self._buffer)
+            self._upload_parts()
 
     def close(self):
-        self._buffer.close()
+        if self.closed:
+            return
+
+        try:
+            if self.is_writable:
+                self._complete_upload()
+        finally:
+            self._buffer.close()
+            self.release_lock()
 
     def aquire_lock(self):
-        # TODO
-        pass
+        if self._lock is None:
+            self._lock = self._lock_backend.acquire(self.lock_name)
 
     def release_lock(self):
-        # TODO
-        pass
+        if self._lock is not None:
+            self._lock.release()
+            self._lock = None
 
     def __enter__(self):
         if self.is_writable:
@@ -172,8 +513,276 @@ class AwsS3GitFile(object):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        # the content written by a failed block is never published
+        if exc_type is not None:
+            self.abort()
+            return
+
         self.flush()
         self.close()
 
-        if self.is_writable:
-            self.release_lock()
+
+class AwsS3RangeFile(object):
+    """Read-only file in a s3 bucket read with HTTP range requests.
+
+    The file is fetched by blocks aligned on the block size, only the blocks
+    covering the bytes read are downloaded. The blocks are kept in a LRU
+    cache bounded in bytes, the cache can be shared between files.
+    """
+
+    BLOCK_SIZE = 1024 * 64
+    CACHE_SIZE = 1024 * 1024 * 16
+
+    def __init__(self, filename, aws_s3_bucket, block_size=BLOCK_SIZE,
+                 cache_size=CACHE_SIZE, block_cache=None, disk_cache=None,
+                 size=None):
+        """
+            Args:
+                filename (str):
+                    The filename, the full key of the file in the s3 bucket.
+                aws_s3_bucket (s3.Bucket):
+                    The bucket used to store the file.
+                block_size (int):
+                    The size of the blocks fetched from the bucket.
+                cache_size (int):
+                    The maximum size in bytes of the blocks kept in memory,
+                    ignored when a block cache is provided.
+                block_cache (multiple.caches.memory.LRUSizeCache):
+                    The cache where to keep the blocks, keyed by the tuple
+                    filename and block number.
+                disk_cache (multiple.caches.disk.DiskCache):
+                    The local cache where to keep the blocks, read when the
+                    blocks aren't in memory.
+                size (int):
+                    The size of the file if it's already known, avoid a
+                    request to get it.
+            Raises:
+                IOError: If the file doesn't exist
+        """
+        self._aws_bucket = aws_s3_bucket
+        self._aws_key = None
+        self._filename = filename
+
+        self._block_size = block_size
+
+        if block_cache is None:
+            block_cache = caches.memory.LRUSizeCache(
+                cache_size, compute_size=len
+            )
+
+        self._block_cache = block_cache
+        self._disk_cache = disk_cache
+
+        self._position = 0
+        self._closed = False
+
+        self._size = size
+        if self._size is None:
+            try:
+                self._size = self.aws_key.content_length
+            except botocore.exceptions.ClientError:
+                raise IOError('no such file %r', self.name)
+
+    @property
+    def closed(self):
+        return self._closed
+
+    @property
+    def mode(self):
+        return 'rb'
+
+    @property
+    def name(self):
+        return self._filename
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def aws_key(self):
+        if not self._aws_key:
+            self._aws_key = self._aws_bucket.Object(self._filename)
+
+        return self._aws_key
+
+    def copy(self):
+        """Open another file on the same key, sharing the caches.
+
+            A file has a single position, the threads reading the same key
+            concurrently must each use their own file.
+
+            Returns:
+                (AwsS3RangeFile) The new file, at the start.
+        """
+        return type(self)(
+            self._filename, self._aws_bucket, block_size=self._block_size,
+            block_cache=self._block_cache, disk_cache=self._disk_cache,
+            size=self._size
+        )
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def writable(self):
+        return False
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self._size
+
+        if offset < 0:
+            raise IOError('negative seek position %r' % offset)
+
+        self._position = offset
+
+        return self._position
+
+    def read(self, size=-1):
+        start = min(self._position, self._size)
+
+        if size is None or size < 0:
+            end = self._size
+        else:
+            end = min(start + size, self._size)
+
+        if end <= start:
+            return b''
+
+        blocks = self._get_blocks(start, end)
+        first_offset = (start // self._block_size) * self._block_size
+
+        self._position = end
+
+        return b''.join(blocks)[start - first_offset:end - first_offset]
+
+    def prefetch(self, start, end):
+        """Fetch the missing blocks covering a range of bytes.
+
+            The contiguous missing blocks are fetched with a single range
+            request.
+
+            Args:
+                start (int): The offset of the first byte.
+                end (int): The offset after the last byte.
+        """
+        self._get_blocks(start, min(end, self._size))
+
+    def prefetch_ranges(self, ranges):
+        """Fetch the missing blocks covering many ranges of bytes.
+
+            The ranges sharing or touching blocks are merged, the missing
+            blocks of a merged range are fetched with a single request.
+
+            Args:
+                ranges (Iterable[tuple(int, int)]): The offsets of the first
+                    byte and after the last byte of each range.
+        """
+        runs = []
+
+        for start, end in sorted(ranges):
+            end = min(end, self._size)
+
+            if end <= start:
+                continue
+
+            if runs and (
+                start // self._block_size
+                <= (runs[-1][1] - 1) // self._block_size + 1
+            ):
+                runs[-1][1] = max(runs[-1][1], end)
+            else:
+                runs.append([start, end])
+
+        for start, end in runs:
+            self._get_blocks(start, end)
+
+    def _get_blocks(self, start, end):
+        """Get the blocks covering a range of bytes, fetching the missing
+            ones.
+        """
+        first_block = start // self._block_size
+        last_block = (end - 1) // self._block_size
+
+        blocks = {}
+        missing = []
+
+        for block in range(first_block, last_block + 1):
+            try:
+                blocks[block] = self._block_cache[(self._filename, block)]
+            except KeyError:
+                data = self._get_disk_block(block)
+                if data is None:
+                    missing.append(block)
+                else:
+                    blocks[block] = data
+
+        # group the missing blocks in runs of contiguous blocks
+        runs = []
+        for block in missing:
+            if runs and runs[-1][1] == block - 1:
+                runs[-1][1] = block
+            else:
+                runs.append([block, block])
+
+        for run_first, run_last in runs:
+            blocks.update(self._fetch(run_first, run_last))
+
+        return [blocks[block] for block in range(first_block, last_block + 1)]
+
+    def _fetch(self, first_block, last_block):
+        """Fetch a run of contiguous blocks with a single range request."""
+        start = first_block * self._block_size
+        end = min((last_block + 1) * self._block_size, self._size) - 1
+
+        try:
+            s3_object = self.aws_key.get(
+                Range='bytes={0}-{1}'.format(start, end)
+            )
+        except botocore.exceptions.ClientError:
+            raise IOError('no such file %r', self.name)
+
+        data = s3_object['Body'].read()
+
+        blocks = {}
+        for block in range(first_block, last_block + 1):
+            offset = (block - first_block) * self._block_size
+            blocks[block] = data[offset:offset + self._block_size]
+            self._block_cache[(self._filename, block)] = blocks[block]
+
+            if self._disk_cache is not None:
+                self._disk_cache[self._disk_key(block)] = blocks[block]
+
+        return blocks
+
+    def _disk_key(self, block):
+        return '{0}:{1}:{2}'.format(self._filename, self._block_size, block)
+
+    def _get_disk_block(self, block):
+        """Get a block from the disk cache and keep it in memory."""
+        if self._disk_cache is None:
+            return None
+
+        data = self._disk_cache.get(self._disk_key(block))
+
+        if data is not None:
+            self._block_cache[(self._filename, block)] = data
+
+        return data
+
+    def close(self):
+        self._closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
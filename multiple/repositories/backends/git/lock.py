@@ -0,0 +1,450 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+
+import botocore
+
+from multiple import exceptions
+
+
+class Lock(object):
+    """A lock held with a lease, it must be renewed before it expires.
+
+    The lock is handled by its backend, the token is backend specific, e.g.
+    the ETag of the lock file on a s3 bucket.
+    """
+
+    def __init__(self, backend, name, owner, lease_duration, token=None):
+        """
+            Args:
+                backend (LockBackendBase): The backend holding the lock.
+                name (str): The name of the lock.
+                owner (str): The unique identifier of the owner.
+                lease_duration (float): The duration of a lease in seconds.
+                token: The backend specific token of the lock.
+        """
+        self.backend = backend
+        self.name = name
+        self.owner = owner
+        self.lease_duration = lease_duration
+        self.token = token
+        self.expires = None
+        self.released = False
+
+    def lease(self):
+        """Start a new lease from now.
+
+            Returns:
+                (float) The new expiry time.
+        """
+        self.expires = time.time() + self.lease_duration
+
+        return self.expires
+
+    @property
+    def expired(self):
+        return self.expires is not None and time.time() >= self.expires
+
+    @property
+    def needs_renewal(self):
+        """The lease is renewed once half of its duration is elapsed."""
+        return time.time() >= self.expires - self.lease_duration / 2
+
+    def renew(self):
+        self.backend.renew(self)
+
+    def renew_if_needed(self):
+        if self.needs_renewal:
+            self.renew()
+
+    def release(self):
+        if not self.released:
+            self.backend.release(self)
+            self.released = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+class LockBackendBase(object):
+    """
+        Interface of the lock backends, a lock is acquired with a lease that
+        expires if it isn't renewed, an expired lock can be taken over by
+        another owner.
+    """
+
+    LEASE_DURATION = 60
+
+    def __init__(self, lease_duration=LEASE_DURATION):
+        """
+            Args:
+                lease_duration (float): The duration of the leases in
+                    seconds.
+        """
+        self.lease_duration = lease_duration
+
+    def new_lock(self, name):
+        return Lock(self, name, uuid.uuid4().hex, self.lease_duration)
+
+    def acquire(self, name):
+        """Acquire a lock.
+
+            Args:
+                name (str): The name of the lock.
+            Returns:
+                (Lock) The lock acquired.
+            Raises:
+                multiple.exceptions.LockError if the lock is already held.
+        """
+        raise NotImplementedError
+
+    def renew(self, lock):
+        """Renew the lease of a lock.
+
+            Raises:
+                multiple.exceptions.LockError if the lock was lost.
+        """
+        raise NotImplementedError
+
+    def release(self, lock):
+        """Release a lock, a lock lost in the meantime is left untouched."""
+        raise NotImplementedError
+
+
+class MemoryLockBackend(LockBackendBase):
+    """Lock backend for the writers of a single process."""
+
+    def __init__(self, lease_duration=LockBackendBase.LEASE_DURATION):
+        super().__init__(lease_duration)
+
+        self._mutex = threading.Lock()
+        self._locks = {}
+
+    def acquire(self, name):
+        lock = self.new_lock(name)
+
+        with self._mutex:
+            held = self._locks.get(name)
+
+            if held is not None and not held.expired:
+                raise exceptions.LockError('%r is already locked' % name)
+
+            lock.lease()
+            self._locks[name] = lock
+
+        return lock
+
+    def renew(self, lock):
+        with self._mutex:
+            if self._locks.get(lock.name) is not lock:
+                raise exceptions.LockError('%r lock was lost' % lock.name)
+
+            lock.lease()
+
+    def release(self, lock):
+        with self._mutex:
+            if self._locks.get(lock.name) is lock:
+                del self._locks[lock.name]
+
+
+class NoLockBackend(LockBackendBase):
+    """Lock backend that doesn't lock, for the files named after their
+    content, e.g the objects and the packs.
+
+    Two writers of such a file write the same content, locking it would
+    only cost requests.
+    """
+
+    def acquire(self, name):
+        lock = self.new_lock(name)
+        lock.lease()
+
+        return lock
+
+    def renew(self, lock):
+        lock.lease()
+
+    def release(self, lock):
+        pass
+
+
+class LocalFileLockBackend(LockBackendBase):
+    """Lock backend using lock files in a local directory, for the writers
+    of a single host.
+
+    The lock file holds the owner and the expiry of its lease, it's written
+    under a temporary name then linked in place, which fails if a lock file
+    exists. To be checked and changed, a lock file is first moved to a
+    unique name, only one writer can move it, and a lock file moved by
+    mistake is linked back unless a new lock file was created in the
+    meantime, a lock file is never overwritten by another writer.
+
+    A lease which isn't about to expire can't be taken over, its lock file
+    is renewed in place by its owner and never disappears.
+    """
+
+    # the time left to a lease below which it's renewed as an expired one
+    RENEW_MARGIN = 1
+
+    def __init__(self, directory,
+                 lease_duration=LockBackendBase.LEASE_DURATION):
+        """
+            Args:
+                directory (str): The directory of the lock files.
+                lease_duration (float): The duration of the leases in
+                    seconds.
+        """
+        super().__init__(lease_duration)
+
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, name):
+        filename = hashlib.sha1(name.encode('utf-8')).hexdigest()
+
+        return os.path.join(self.directory, filename + '.lock')
+
+    def _read(self, path):
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write(self, path, lock):
+        """Write a lock file under a temporary name.
+
+            Returns:
+                (str) The temporary path.
+        """
+        tmp_path = '{0}.{1}.tmp'.format(path, uuid.uuid4().hex)
+
+        with open(tmp_path, 'w') as f:
+            json.dump({'owner': lock.owner, 'expires': lock.expires}, f)
+
+        return tmp_path
+
+    def _create(self, path, lock):
+        """Create a lock file, complete once visible.
+
+            Raises:
+                FileExistsError if the lock file exists.
+        """
+        tmp_path = self._write(path, lock)
+
+        try:
+            os.link(tmp_path, path)
+        finally:
+            os.remove(tmp_path)
+
+    def _take(self, path):
+        """Move a lock file away to check it, only one writer can move it.
+
+            Returns:
+                (tuple(dict, str)) The content of the lock file and its new
+                path, or None if there is no lock file.
+        """
+        taken_path = '{0}.{1}.taken'.format(path, uuid.uuid4().hex)
+
+        try:
+            os.rename(path, taken_path)
+        except FileNotFoundError:
+            return None
+
+        return self._read(taken_path), taken_path
+
+    def _restore(self, path, taken_path):
+        """Link back a lock file moved by mistake, unless a new lock file
+            was created in the meantime.
+        """
+        try:
+            os.link(taken_path, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(taken_path)
+
+    def acquire(self, name):
+        lock = self.new_lock(name)
+        path = self._path(name)
+
+        held = self._read(path)
+        if held is not None and held['expires'] <= time.time():
+            # take over the expired lock, checked again once moved as it
+            # may have been taken over in the meantime
+            taken = self._take(path)
+
+            if taken is not None:
+                held, taken_path = taken
+
+                if held is None or held['expires'] > time.time():
+                    self._restore(path, taken_path)
+                    raise exceptions.LockError(
+                        '%r is already locked' % name
+                    )
+
+                os.remove(taken_path)
+
+        lock.lease()
+
+        try:
+            self._create(path, lock)
+        except FileExistsError:
+            raise exceptions.LockError('%r is already locked' % name)
+
+        return lock
+
+    def renew(self, lock):
+        path = self._path(lock.name)
+        held = self._read(path)
+
+        if held is not None and held['owner'] == lock.owner \
+                and held['expires'] > time.time() + self.RENEW_MARGIN:
+            lock.lease()
+            os.replace(self._write(path, lock), path)
+            return
+
+        # the expired lease may be taken over, it's checked once moved
+        taken = self._take(path)
+
+        if taken is None:
+            raise exceptions.LockError('%r lock was lost' % lock.name)
+
+        held, taken_path = taken
+
+        if held is None or held['owner'] != lock.owner:
+            self._restore(path, taken_path)
+            raise exceptions.LockError('%r lock was lost' % lock.name)
+
+        os.remove(taken_path)
+        lock.lease()
+
+        try:
+            self._create(path, lock)
+        except FileExistsError:
+            raise exceptions.LockError('%r lock was lost' % lock.name)
+
+    def release(self, lock):
+        path = self._path(lock.name)
+        taken = self._take(path)
+
+        if taken is None:
+            return
+
+        held, taken_path = taken
+
+        if held is not None and held['owner'] == lock.owner:
+            os.remove(taken_path)
+        else:
+            self._restore(path, taken_path)
+
+
+class AwsS3LockBackend(LockBackendBase):
+    """Lock backend using lock files in a s3 bucket, for the writers of
+    many hosts.
+
+    The lock file is created with a conditional put, it fails if the file
+    already exists. The lease is renewed, an expired lock taken over and a
+    lock released with requests conditioned on the ETag of the lock file,
+    so a lock can't be changed by a writer that didn't see its last
+    version.
+    """
+
+    def __init__(self, aws_s3_bucket,
+                 lease_duration=LockBackendBase.LEASE_DURATION):
+        """
+            Args:
+                aws_s3_bucket (s3.Bucket): The bucket of the lock files.
+                lease_duration (float): The duration of the leases in
+                    seconds.
+        """
+        super().__init__(lease_duration)
+
+        self._aws_bucket = aws_s3_bucket
+
+    @property
+    def _client(self):
+        return self._aws_bucket.meta.client
+
+    def _put(self, lock, **conditions):
+        """Write the lock file if the conditions are met.
+
+            Returns:
+                (bool) True if the lock file was written.
+        """
+        body = json.dumps({'owner': lock.owner, 'expires': lock.lease()})
+
+        try:
+            response = self._client.put_object(
+                Bucket=self._aws_bucket.name, Key=lock.name,
+                Body=body.encode('utf-8'), **conditions
+            )
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] in (
+                'PreconditionFailed', 'ConditionalRequestConflict'
+            ):
+                return False
+            raise
+
+        lock.token = response['ETag']
+
+        return True
+
+    def _read(self, name):
+        """Read a lock file.
+
+            Returns:
+                (tuple(dict, str)) The lock content and its ETag, or None if
+                the lock file doesn't exist.
+        """
+        try:
+            response = self._client.get_object(
+                Bucket=self._aws_bucket.name, Key=name
+            )
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] == 'NoSuchKey':
+                return None
+            raise
+
+        return json.loads(response['Body'].read().decode('utf-8')), \
+            response['ETag']
+
+    def acquire(self, name):
+        lock = self.new_lock(name)
+
+        if self._put(lock, IfNoneMatch='*'):
+            return lock
+
+        held = self._read(name)
+
+        if held is None:
+            # released in the meantime
+            if self._put(lock, IfNoneMatch='*'):
+                return lock
+        elif held[0]['expires'] <= time.time():
+            if self._put(lock, IfMatch=held[1]):
+                return lock
+
+        raise exceptions.LockError('%r is already locked' % name)
+
+    def renew(self, lock):
+        if not self._put(lock, IfMatch=lock.token):
+            raise exceptions.LockError('%r lock was lost' % lock.name)
+
+    def release(self, lock):
+        try:
+            self._client.delete_object(
+                Bucket=self._aws_bucket.name, Key=lock.name,
+                IfMatch=lock.token
+            )
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] not in (
+                'PreconditionFailed', 'NoSuchKey'
+            ):
+                raise
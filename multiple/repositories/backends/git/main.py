@@ -1,21 +1,91 @@
 import calendar
 import collections
-import io
+import heapq
 import itertools
 import stat
 import time
 
 import dulwich
+import dulwich.diff_tree
+import dulwich.errors
 import dulwich.objects
 
 from multiple import repositories
 from multiple import utils
+from multiple.repositories.backends.git import cache as git_cache
+from multiple.repositories.backends.git import commit_graph as graph
+from multiple.repositories.backends.git import path_history as history
+from multiple.repositories.backends.git import stream
 
 
 class RepositoryGit(repositories.RepositoryBase):
 
-    def __init__(self, dulwich_repository):
+    def __init__(self, dulwich_repository, commit_graph=None,
+                 path_history=None, cache=None, object_cache=None,
+                 path_cache=None):
+        """
+            Args:
+                dulwich_repository (dulwich.repo.BaseRepo):
+                    The git repository.
+                commit_graph (graph.CommitGraph):
+                    The graph of the commits, by default the graph stored
+                    next to the packs of the repositories on the disk, or
+                    next to the local cache of the object store, kept in
+                    memory for the other repositories.
+                path_history (history.PathHistory):
+                    The index of the commits changing each path, by default
+                    stored next to the packs of the repositories on the
+                    disk, or next to the local cache of the object store,
+                    kept in memory for the other repositories.
+                cache (multiple.caches.main.CacheBase):
+                    The cache of the objects and of the resolved paths,
+                    consulted before the object store.
+                object_cache (git_cache.ObjectCache):
+                    The in-process cache of the parsed objects, consulted
+                    first, it can be shared by several repositories. By
+                    default each repository has its own.
+                path_cache (git_cache.PathCache):
+                    The in-process cache of the shas of the trees and of the
+                    blobs by path, consulted first, it can be shared by
+                    several repositories. By default each repository has its
+                    own.
+        """
         self.backend = dulwich_repository
+        self.cache = None
+
+        if cache is not None:
+            self.cache = git_cache.RepositoryCache(cache)
+
+        if object_cache is None:
+            object_cache = git_cache.ObjectCache()
+
+        if path_cache is None:
+            path_cache = git_cache.PathCache()
+
+        self.object_cache = object_cache
+        self.path_cache = path_cache
+        # the layers of caches, from the fastest
+        self._object_caches = [
+            layer for layer in (object_cache, self.cache)
+            if layer is not None
+        ]
+        self._path_caches = [
+            layer for layer in (path_cache, self.cache)
+            if layer is not None
+        ]
+
+        if commit_graph is None:
+            commit_graph = graph.CommitGraph(
+                graph.default_path(self.backend.object_store)
+            )
+
+        if path_history is None:
+            path_history = history.PathHistory(
+                history.default_path(self.backend.object_store)
+            )
+
+        self.commit_graph = commit_graph
+        self.path_history = path_history
 
     def commit(self, index, message=b'', author=None, committer=None,
                at_time=None):
@@ -26,9 +96,20 @@ class RepositoryGit(repositories.RepositoryBase):
         if not at_time:
             at_time = time.gmtime()
 
+        parents = [index.reference] if index.reference else []
+
+        # the parents are checked and in the graph before the commit is
+        # stored, a stored commit is always in the graph
+        for parent in parents:
+            if not dulwich.objects.valid_hexsha(parent):
+                raise ValueError("bad reference '%r' is not a sha" % parent)
+
+            self._graph_entry(parent)
+
         commit = dulwich.objects.Commit()
 
-        commit.tree = index.root_tree
+        commit.tree = index.root_tree.id
+        commit.parents = parents
 
         commit.author = author
         commit.committer = committer
@@ -38,16 +119,252 @@ class RepositoryGit(repositories.RepositoryBase):
 
         commit.message = message
 
-        self.backend.object_store.add_object(commit)
+        if index.pack_writer is None:
+            self.backend.object_store.add_object(commit)
+        else:
+            index.pack_writer.add_object(commit)
+            index.pack_writer.commit()
+
+        self.commit_graph.add(
+            commit.id, commit.tree, commit.commit_time, commit.parents
+        )
+        self._history_add(commit.id)
+
+        return commit.id
+
+    def _graph_add(self, commit):
+        """Add a commit and its missing ancestors to the commit graph."""
+        if not isinstance(commit, dulwich.objects.Commit):
+            raise ValueError(
+                "bad reference '%r' is not a dulwich.objects.Commit" % commit
+            )
+
+        commits = {commit.id: commit}
+        pending = [commit.id]
+
+        while pending:
+            sha = pending[-1]
+
+            if sha in self.commit_graph:
+                pending.pop()
+                continue
+
+            if sha not in commits:
+                commits[sha] = self.backend[sha]
+
+                if not isinstance(commits[sha], dulwich.objects.Commit):
+                    raise ValueError(
+                        "bad reference '%r' is not a "
+                        "dulwich.objects.Commit" % commits[sha]
+                    )
+
+            missing = [
+                parent for parent in commits[sha].parents
+                if parent not in self.commit_graph
+            ]
+
+            if missing:
+                pending.extend(missing)
+                continue
+
+            pending.pop()
+            commit = commits.pop(sha)
+            self.commit_graph.add(
+                commit.id, commit.tree, commit.commit_time, commit.parents
+            )
+
+    def _graph_entry(self, reference):
+        """Get the commit graph entry of a reference, the commits missing
+            from the graph are added on the way.
+
+            Raises:
+                KeyError if the reference doesn't exists.
+        """
+        entry = self.commit_graph.get(reference)
+
+        if entry is None:
+            self._graph_add(self.backend[reference])
+            entry = self.commit_graph[reference]
+
+        return entry
+
+    def _history_add(self, reference):
+        """Index the paths changed by a commit and by its ancestors missing
+            from the path history.
+        """
+        pending = [reference]
+
+        while pending:
+            sha = pending[-1]
+
+            if sha in self.path_history:
+                pending.pop()
+                continue
+
+            entry = self._graph_entry(sha)
+            missing = [
+                parent for parent in entry.parents
+                if parent not in self.path_history
+            ]
+
+            if missing:
+                pending.extend(missing)
+                continue
+
+            pending.pop()
+            self.path_history.add(
+                sha, entry.commit_time, entry.generation,
+                self._changed_paths(entry)
+            )
+
+    def _changed_paths(self, entry):
+        """Get the paths changed by a commit from all its parents."""
+        object_store = self.backend.object_store
+        parent_trees = [
+            self._graph_entry(parent).tree for parent in entry.parents
+        ]
+
+        if not parent_trees:
+            return set(history.changed_paths(object_store, entry.tree, None))
+
+        paths = None
+        for parent_tree in parent_trees:
+            parent_paths = set(history.changed_paths(
+                object_store, entry.tree, parent_tree
+            ))
+            paths = parent_paths if paths is None else paths & parent_paths
+
+        return paths
+
+    def history(self, path, reference=None, max_count=None):
+        """Get the references changing a path, from the path history.
+
+            The cost is bound by the number of references changing the path,
+            the trees aren't compared.
+
+            Args:
+                path (bytes): The path.
+                reference (bytes): Only get the ancestors of the reference,
+                    by default all the references indexed.
+                max_count (int): The maximum number of references.
+            Returns:
+                (list(bytes)) The references, the descendants first.
+            Raises:
+                KeyError if the reference doesn't exists.
+        """
+        path = ProcessedPath.from_path(path).rootless_path
+
+        if reference is None:
+            return self.path_history.history(path, max_count=max_count)
+
+        self._history_add(reference)
+
+        references = (
+            sha for sha in self.path_history.history(path)
+            if self.commit_graph.is_ancestor(sha, reference)
+        )
+
+        return list(itertools.islice(references, max_count))
+
+    def rebuild_path_history(self, references=None):
+        """Rebuild the path history from scratch.
+
+            Args:
+                references (Iterable[bytes]): The references to index with
+                    their ancestors, by default the commits of the refs of
+                    the repository and the commits of the commit graph, the
+                    other objects aren't read.
+        """
+        if references is None:
+            references = itertools.chain(
+                self._ref_commits(), list(self.commit_graph)
+            )
+
+        self.path_history.clear()
+
+        for reference in references:
+            self._history_add(reference)
+
+    def _ref_commits(self):
+        """Get the commits of the refs, the tags are peeled."""
+        commits = []
+
+        for name in self.backend.refs.allkeys():
+            try:
+                obj = self.backend[self.backend.refs[name]]
+            except KeyError:
+                continue
+
+            while isinstance(obj, dulwich.objects.Tag):
+                obj = self.backend[obj.object[1]]
+
+            if isinstance(obj, dulwich.objects.Commit):
+                commits.append(obj.id)
+
+        return commits
+
+    def is_ancestor(self, ancestor, reference):
+        """Check if a reference is an ancestor of another, or the same.
+
+            Args:
+                ancestor (bytes): The supposed ancestor reference.
+                reference (bytes): The descendant reference.
+            Returns:
+                (bool)
+            Raises:
+                KeyError if a reference doesn't exists.
+        """
+        self._graph_entry(ancestor)
+        self._graph_entry(reference)
+
+        return self.commit_graph.is_ancestor(ancestor, reference)
+
+    def merge_bases(self, reference, other_reference):
+        """Get the best common ancestors of two references.
 
-    def open_index_at(self, reference):
+            Returns:
+                (list(bytes)) The common ancestors references.
+            Raises:
+                KeyError if a reference doesn't exists.
+        """
+        self._graph_entry(reference)
+        self._graph_entry(other_reference)
+
+        return self.commit_graph.merge_bases(reference, other_reference)
+
+    def open_index_at(self, reference, lazy=True,
+                      chunk_size=stream.CHUNK_SIZE, prefixes=None,
+                      pack=False):
+        """
+            Open a new working index at the specified reference
+
+            Args:
+                reference (str): The commit reference where to start the, if
+                    the reference is equal to None an empty index is created.
+                lazy (bool): Load the trees only along the paths touched by
+                    the index operations instead of loading the whole tree
+                    of the reference up front.
+                chunk_size (int): The maximum size of the chunks read from
+                    the contents added to the index.
+                prefixes (Iterable[bytes]): Only load and track the
+                    contents under the paths, the other subtrees are kept
+                    by sha in the new trees.
+                pack (bool): Add the new objects of the index and its
+                    commit to the object store as a single pack, instead
+                    of adding each object.
+
+            Returns:
+                (MemoryIndex)
+        """
         root_tree = None
 
         if reference:
-            commit = self.backend[reference]
+            commit = self._get_object(reference)
 
             if isinstance(commit, dulwich.objects.Commit):
-                root_tree = self.backend[commit.tree]
+                root_tree = self._get_object(commit.tree)
+                # a reference name is resolved, the commit is the parent
+                reference = commit.id
             else:
                 raise ValueError(
                     "bad reference '%r' is not a "
@@ -56,42 +373,525 @@ class RepositoryGit(repositories.RepositoryBase):
         else:
             root_tree = dulwich.objects.Tree()
 
-        return MemoryIndex(root_tree, self.backend.object_store)
+        return MemoryIndex(
+            root_tree, self.backend.object_store, lazy=lazy,
+            chunk_size=chunk_size, reference=reference or None,
+            object_caches=self._object_caches, prefixes=prefixes, pack=pack
+        )
+
+    def _get_object(self, sha):
+        """Get an object from the caches, then from the repository.
+
+            Only the objects referenced by sha are cached, the references
+            can also be names.
+        """
+        if not dulwich.objects.valid_hexsha(sha):
+            return self.backend[sha]
+
+        return git_cache.load_object(
+            self.backend.object_store, sha, self._object_caches
+        )
 
     def get(self, path, reference, default=None):
-        result = default
-        commit = self.backend[reference]
+        """Get a stream on the content at the reference.
 
-        if isinstance(commit, dulwich.objects.Commit):
-            tree = self.backend[commit.tree]
-            blob_object = tree.lookup_path(path)
-            if isinstance(blob_object, dulwich.objects.Blob):
-                result = blob_object.data
-                if isinstance(result, str):
-                    result = io.StringIO(result)
+            The content is decompressed on demand while the stream is read,
+            it's never loaded in memory as a whole. The shas of the blob and
+            of its parent trees are cached with their path, only the tree of
+            the blob directory is loaded by the next reads in it.
+
+            Args:
+                path (bytes): The content target path.
+                reference (bytes): The commit reference.
+                default: The default values to return, None by default.
+            Returns:
+                (multiple.repositories.backends.git.stream.ObjectReader)
+            Raises:
+                KeyError if the reference doesn't exists.
+        """
+        commit = self._get_object(reference)
+
+        if not isinstance(commit, dulwich.objects.Commit):
+            return default
+
+        sha = self._lookup_blob(commit, path)
+
+        if sha is None:
+            return default
+
+        return self._open_blob(sha)
+
+    def _lookup_tree_sha(self, commit, path):
+        """Get the sha of the tree at a path of a commit, the shas of the
+            trees resolved are cached with their path.
+
+            Args:
+                commit (dulwich.objects.Commit): The commit.
+                path (bytes): The rootless path of the tree.
+            Returns:
+                (bytes) The tree sha.
+            Raises:
+                KeyError if the path doesn't exists.
+                dulwich.errors.NotTreeError if the path isn't a tree.
+        """
+        if not path:
+            return commit.tree
+
+        sha = git_cache.get_path_sha(
+            self._path_caches, git_cache.TREE, commit.id, path
+        )
+
+        if sha is None:
+            dirname, basename = utils.paths.path_split(path)
+            tree = self._get_object(self._lookup_tree_sha(commit, dirname))
+            mode, sha = tree[basename]
+
+            if not stat.S_ISDIR(mode):
+                raise dulwich.errors.NotTreeError(sha)
+
+            git_cache.set_path_sha(
+                self._path_caches, git_cache.TREE, commit.id, path, sha
+            )
+
+        return sha
+
+    def _open_blob(self, sha):
+        """Open a stream on a blob, the small blobs are cached."""
+        blob = git_cache.get_object(self._object_caches, sha)
+
+        if blob is not None:
+            return stream.ObjectReader(
+                lambda: blob.chunked, blob.raw_length()
+            )
+
+        result = stream.open_object_stream(self.backend.object_store, sha)
+        max_blob_size = max(
+            layer.max_blob_size for layer in self._object_caches
+        )
+
+        if result.length <= max_blob_size:
+            blob = dulwich.objects.Blob.from_string(result.read())
+            git_cache.set_object(self._object_caches, blob)
+
+            return stream.ObjectReader(
+                lambda: blob.chunked, blob.raw_length()
+            )
 
         return result
 
+    def walk(self, reference, paths=None, max_count=None, since=None,
+             until=None):
+        """Walk the history from a reference, the newest commits first.
+
+            The commits are read from the commit graph one by one while the
+            walk is consumed, the walk stops as soon as the limits are
+            reached. To know if a
+            commit changed a path, the shas along the path are compared
+            with the parents from the root, the trees are loaded only until
+            the shas are equal.
+
+            Args:
+                reference (bytes): The commit reference where to start.
+                paths (Iterable[bytes]): Only walk the commits changing one
+                    of the paths.
+                max_count (int): The maximum number of references.
+                since (time.struct_time): Stop at the commits older than
+                    the time.
+                until (time.struct_time): Skip the commits newer than the
+                    time.
+            Returns:
+                (Iterable[bytes]) The commit references.
+            Raises:
+                KeyError if the reference doesn't exists.
+        """
+        entry = self._graph_entry(reference)
+
+        if paths is not None:
+            paths = [
+                ProcessedPath.from_path(path).rootless_path.split(b'/')
+                for path in paths
+            ]
+
+        since = None if since is None else calendar.timegm(since)
+        until = None if until is None else calendar.timegm(until)
+
+        return self._walk(entry, paths, max_count, since, until)
+
+    def _walk(self, entry, paths, max_count, since, until):
+        # heap of the commits to walk, by commit time then discovery order
+        counter = itertools.count()
+        pending = [(-entry.commit_time, next(counter), entry)]
+        seen = {entry.sha}
+        count = 0
+
+        while pending and (max_count is None or count < max_count):
+            _, _, entry = heapq.heappop(pending)
+
+            if since is not None and entry.commit_time < since:
+                break
+
+            parents = [self._graph_entry(parent) for parent in entry.parents]
+
+            for parent in parents:
+                if parent.sha not in seen:
+                    seen.add(parent.sha)
+                    heapq.heappush(pending, (
+                        -parent.commit_time, next(counter), parent
+                    ))
+
+            if until is not None and entry.commit_time > until:
+                continue
+
+            if paths is None or self._changes_paths(entry, parents, paths):
+                count += 1
+                yield entry.sha
+
+    def _changes_paths(self, entry, parents, paths):
+        """Check if a commit changes one of the paths from all its
+            parents, a root commit changes the paths it contains.
+        """
+        if not parents:
+            return any(
+                self._lookup_sha(entry.tree, tokens) is not None
+                for tokens in paths
+            )
+
+        return any(
+            all(
+                self._path_changed(entry.tree, parent.tree, tokens)
+                for parent in parents
+            )
+            for tokens in paths
+        )
+
+    def _path_changed(self, sha, other_sha, tokens):
+        """Compare the shas at a path of two trees, from the root."""
+        for token in tokens:
+            if sha == other_sha:
+                return False
+
+            if sha is None or other_sha is None:
+                return True
+
+            sha = self._lookup_sha(sha, (token, ))
+            other_sha = self._lookup_sha(other_sha, (token, ))
+
+        return sha != other_sha
+
+    def _lookup_sha(self, sha, tokens):
+        """Get the sha at a path in a tree, None if it doesn't exists."""
+        for token in tokens:
+            tree = self._get_object(sha)
+
+            if not isinstance(tree, dulwich.objects.Tree):
+                return None
+
+            try:
+                _, sha = tree[token]
+            except KeyError:
+                return None
+
+        return sha
+
+    def get_many(self, paths, reference, default=None,
+                 max_workers=stream.MAX_WORKERS):
+        """Get streams on many contents at the reference.
+
+            The commit and the trees are loaded once for all the paths, the
+            blobs are then opened concurrently, grouped by pack, see
+            `stream.open_object_streams`.
+
+            Args:
+                paths (Iterable[bytes]): The contents target paths.
+                reference (bytes): The commit reference.
+                default: The value returned for the missing contents, None
+                    by default.
+                max_workers (int): The maximum number of threads opening
+                    the blobs.
+            Returns:
+                (Iterable[tuple(bytes, ObjectReader)]) The paths and the
+                streams on their content, as they are opened.
+            Raises:
+                KeyError if the reference doesn't exists.
+        """
+        commit = self._get_object(reference)
+        paths_by_sha = collections.OrderedDict()
+        missing = []
+
+        if isinstance(commit, dulwich.objects.Commit):
+            for path in paths:
+                sha = self._lookup_blob(commit, path)
+
+                if sha is None:
+                    missing.append(path)
+                else:
+                    paths_by_sha.setdefault(sha, []).append(path)
+        else:
+            missing.extend(paths)
+
+        return self._iter_many(paths_by_sha, missing, default, max_workers)
+
+    def diff(self, reference, other_reference, paths=None):
+        """Compare the contents of two references.
+
+            Both trees are walked together, the subtrees with the same sha
+            are skipped without being loaded, the cost of a diff depends on
+            the size of the changes. The changes are streamed while the
+            diff is consumed, a content changing of type, e.g from a file
+            to a directory, is removed then added.
+
+            Args:
+                reference (bytes): The commit reference of the old contents.
+                other_reference (bytes): The commit reference of the new
+                    contents.
+                paths (Iterable[bytes]): Only compare the contents under the
+                    paths.
+            Returns:
+                (Iterable[dulwich.diff_tree.TreeChange]) The changes of the
+                contents, with their rootless path.
+            Raises:
+                KeyError if a reference doesn't exists.
+        """
+        commit = self._get_object(reference)
+        other_commit = self._get_object(other_reference)
+
+        for commit_object in (commit, other_commit):
+            if not isinstance(commit_object, dulwich.objects.Commit):
+                raise ValueError(
+                    "bad reference '%r' is not a "
+                    "dulwich.objects.Commit" % commit_object
+                )
+
+        if paths is None:
+            roots = [b'']
+        else:
+            # the paths under a compared path are already compared
+            roots = _outermost_paths(
+                ProcessedPath.from_path(path).rootless_path for path in paths
+            )
+
+        return self._diff(commit, other_commit, roots)
+
+    def _diff(self, commit, other_commit, roots):
+        for root in roots:
+            yield from self._diff_entries(
+                self._lookup_entry(commit, root),
+                self._lookup_entry(other_commit, root)
+            )
+
+    def _lookup_entry(self, commit, path):
+        """Get the entry at a path of a commit, None if it doesn't exists."""
+        if not path:
+            return dulwich.objects.TreeEntry(b'', stat.S_IFDIR, commit.tree)
+
+        dirname, basename = utils.paths.path_split(path)
+
+        try:
+            tree = self._get_object(self._lookup_tree_sha(commit, dirname))
+            mode, sha = tree[basename]
+        except (KeyError, dulwich.errors.NotTreeError):
+            return None
+
+        return dulwich.objects.TreeEntry(path, mode, sha)
+
+    def _diff_entries(self, entry, other_entry):
+        if entry == other_entry:
+            return
+
+        entries = self._tree_entries(entry)
+        other_entries = self._tree_entries(other_entry)
+
+        if entries is None and other_entries is None:
+            if other_entry is None:
+                yield dulwich.diff_tree.TreeChange.delete(entry)
+            elif entry is None:
+                yield dulwich.diff_tree.TreeChange.add(other_entry)
+            elif stat.S_IFMT(entry.mode) != stat.S_IFMT(other_entry.mode):
+                yield dulwich.diff_tree.TreeChange.delete(entry)
+                yield dulwich.diff_tree.TreeChange.add(other_entry)
+            else:
+                yield dulwich.diff_tree.TreeChange(
+                    dulwich.diff_tree.CHANGE_MODIFY, entry, other_entry
+                )
+
+            return
+
+        # a file replaced by a directory, or the opposite
+        if entries is None and entry is not None:
+            yield dulwich.diff_tree.TreeChange.delete(entry)
+
+        for name in sorted(set(entries or ()) | set(other_entries or ())):
+            yield from self._diff_entries(
+                (entries or {}).get(name), (other_entries or {}).get(name)
+            )
+
+        if other_entries is None and other_entry is not None:
+            yield dulwich.diff_tree.TreeChange.add(other_entry)
+
+    def _tree_entries(self, entry):
+        """Get the entries of a tree by name, None if the entry isn't a
+            tree.
+        """
+        if entry is None or not stat.S_ISDIR(entry.mode):
+            return None
+
+        tree = self._get_object(entry.sha)
+
+        return {
+            tree_entry.path: tree_entry.in_path(entry.path)
+            if entry.path else tree_entry
+            for tree_entry in tree.iteritems()
+        }
+
+    def _iter_many(self, paths_by_sha, missing, default, max_workers):
+        for path in missing:
+            yield path, default
+
+        object_store = self.backend.object_store
+
+        for sha, content in stream.open_object_streams(
+            object_store, paths_by_sha, max_workers=max_workers
+        ):
+            paths = paths_by_sha[sha]
+            yield paths[0], content
+
+            # each path of a shared blob gets its own stream
+            for path in paths[1:]:
+                yield path, stream.open_object_stream(object_store, sha)
+
+    def _lookup_blob(self, commit, path):
+        """Get the sha of the blob at a path of a commit, the sha is cached
+            with its path.
+
+            Args:
+                commit (dulwich.objects.Commit): The commit.
+                path (bytes): The path of the blob.
+            Returns:
+                (bytes) The blob sha or None if there is no blob at the path.
+        """
+        processed_path = ProcessedPath.from_path(path)
+        path = processed_path.rootless_path
+        sha = git_cache.get_path_sha(
+            self._path_caches, git_cache.BLOB, commit.id, path
+        )
+
+        if sha is not None:
+            return sha
+
+        try:
+            tree = self._get_object(self._lookup_tree_sha(
+                commit, processed_path.rootless_dirname
+            ))
+            mode, sha = tree[processed_path.basename]
+        except (KeyError, dulwich.errors.NotTreeError):
+            return None
+
+        if not stat.S_ISREG(mode):
+            return None
+
+        git_cache.set_path_sha(
+            self._path_caches, git_cache.BLOB, commit.id, path, sha
+        )
+
+        return sha
+
 
 class MemoryIndex(object):
+    """
+        Index keeping in memory the objects of the tree being modified.
+
+        In lazy mode the trees are loaded only along the paths accessed by
+        `get`, `add` and `remove`, the untouched subtrees are kept as bare
+        sha references in their parent tree. The loaded trees are shared
+        with the object store until they are modified, they are copied on
+        the first write.
 
-    def __init__(self, root_tree, object_store):
+        The changes are only staged in the modified trees, the dirty trees
+        are built and stored once, from the deepest to the root, when the
+        root tree is read.
+
+        The added contents are streamed to the object store chunk by chunk,
+        the blobs are never held in memory by the index. In pack mode the
+        new objects are collected by a `stream.PackWriter` and added as a
+        single pack when the index is committed.
+
+        A sparse index only tracks the contents under some prefixes, the
+        contents outside can't be read or changed and only the trees along
+        the prefixes are loaded, e.g a commit changing a directory of a
+        large tree costs the size of the directory.
+    """
+
+    def __init__(self, root_tree, object_store, lazy=True,
+                 chunk_size=stream.CHUNK_SIZE, reference=None,
+                 object_caches=(), prefixes=None, pack=False):
         """
             Args:
                 root_tree (dulwich.objects.Tree):
                     The root tree of the index
                 object_store (dulwich.object_store.BaseObjectStore):
                     The object store where to store the objects.
+                lazy (bool):
+                    Load the objects on demand instead of loading the whole
+                    tree at the creation of the index.
+                chunk_size (int):
+                    The maximum size of the chunks read from the added
+                    contents, it bounds the memory used to add a content.
+                reference (bytes):
+                    The commit reference the index is opened at, the parent
+                    of the commit of the index.
+                object_caches (list):
+                    The caches of the objects, from the fastest, consulted
+                    before the object store.
+                prefixes (Iterable[bytes]):
+                    The paths of the contents tracked by the index, all
+                    the contents by default.
+                pack (bool):
+                    Collect the new objects to add them as a single pack.
         """
+        self.pack_writer = None
+
+        if pack:
+            self.pack_writer = stream.PackWriter(object_store)
+            object_store = self.pack_writer
+
         self.object_store = object_store
-        self._objects = dict(self._get_objects(root_tree))
+        self.reference = reference
+        self.object_caches = object_caches
+        self.lazy = lazy
+        self.chunk_size = chunk_size
+
+        # paths of the trees owned by the index, e.g. copied or created
+        self._modified = set()
+        # paths of the trees to build before the root tree can be read
+        self._dirty = set()
+
+        self.prefixes = None
+
+        if prefixes is not None:
+            self.prefixes = _outermost_paths(
+                ProcessedPath.from_path(prefix).rootless_path
+                for prefix in prefixes
+            )
+
+        if self.prefixes is None and not lazy:
+            self._objects = dict(self._get_objects(root_tree))
+        else:
+            self._objects = {b'': root_tree}
+
+            if not lazy:
+                self._load_prefixes()
 
     @property
     def root_tree(self):
+        self._build_trees()
+
         return self._objects[b''].copy()
 
     @property
     def objects(self):
+        self._build_trees()
+        self._load_prefixes()
+
         return {
             path: obj.copy()
             for path, obj in self._objects.items()
@@ -104,65 +904,233 @@ class MemoryIndex(object):
             Returns:
                 (Dict(Tuple(str, dulwich.objects.ShaFile)))
         """
-        contents = self.object_store.iter_tree_contents(start_tree.id, True)
+        yield b'', start_tree
 
-        for entry in contents:
-            yield entry.path, self.object_store[entry.sha]
+        pending = [(b'', start_tree)]
 
-    def _get_or_create_tree(self, path):
+        # the objects of a level of the tree are loaded together
+        while pending:
+            entries = [
+                (utils.paths.path_join(path, entry.path), entry.sha)
+                for path, tree in pending
+                for entry in tree.iteritems()
+            ]
+            objects = git_cache.load_objects(
+                self.object_store, (sha for _, sha in entries),
+                self.object_caches
+            )
+            pending = []
+
+            for entry_path, sha in entries:
+                obj = objects[sha]
+
+                yield entry_path, obj
+
+                if isinstance(obj, dulwich.objects.Tree):
+                    pending.append((entry_path, obj))
+
+    def _get_object(self, sha):
+        return git_cache.load_object(
+            self.object_store, sha, self.object_caches
+        )
+
+    def _load(self, path):
+        """
+            Load the object at the path, loading the missing parent trees
+            from the nearest loaded one.
+
+            Args:
+                path (bytes): The rootless path of the object.
+
+            Returns:
+                (dulwich.objects.ShaFile)
+
+            Raises:
+                KeyError if the path doesn't exists.
+        """
         try:
             return self._objects[path]
         except KeyError:
-            tree = dulwich.objects.Tree()
-            self._objects[path] = tree
+            pass
+
+        dirname, basename = utils.paths.path_split(path)
+        parent_tree = self._load(dirname)
+
+        if not isinstance(parent_tree, dulwich.objects.Tree):
+            raise KeyError(path)
+
+        _, sha = parent_tree[basename]
+
+        obj = self._get_object(sha)
+        self._objects[path] = obj
+
+        return obj
+
+    def _load_prefixes(self):
+        """Load all the objects under the prefixes of the index."""
+        for prefix in (b'', ) if self.prefixes is None else self.prefixes:
+            try:
+                self._load_all(prefix)
+            except KeyError:
+                pass
+
+    def _check_path(self, path):
+        """Check that the index tracks the rootless path.
+
+            Raises:
+                ValueError if the path is outside the prefixes of the index.
+        """
+        if self.prefixes is None:
+            return
+
+        for prefix in self.prefixes:
+            if not prefix or path == prefix \
+                    or path.startswith(prefix + b'/'):
+                return
+
+        raise ValueError(
+            "'%r' is outside the prefixes of the index" % path
+        )
+
+    def _load_all(self, path=b''):
+        """Load recursively all the objects under the path."""
+        tree = self._load(path)
+
+        if isinstance(tree, dulwich.objects.Tree):
+            for name in list(tree):
+                self._load_all(utils.paths.path_join(path, name))
+
+    def _get_or_create_tree(self, path):
+        try:
+            tree = self._load(path)
+        except KeyError:
+            tree = None
 
+        if not isinstance(tree, dulwich.objects.Tree):
+            tree = dulwich.objects.Tree()
+        elif path in self._modified:
             return tree
+        else:
+            tree = tree.copy()
+
+        self._objects[path] = tree
+        self._modified.add(path)
+
+        return tree
+
+    def _forget(self, path):
+        """Drop the loaded objects at and under the path."""
+        prefix = path + b'/'
+
+        for loaded_path in list(self._objects):
+            if loaded_path == path or loaded_path.startswith(prefix):
+                del self._objects[loaded_path]
+                self._modified.discard(loaded_path)
+                self._dirty.discard(loaded_path)
+
+    def _mark_dirty(self, processed_path):
+        """Mark the leaf tree of the path and all its parents as dirty."""
+        self._dirty.update(processed_path.intermediate_paths())
+
+    def _build_trees(self):
+        """
+            Build the dirty trees from the deepest until the root, each
+            tree is hashed and stored only once. The empty trees are removed
+            from their parent.
+        """
+        dirty_paths = sorted(
+            self._dirty, key=lambda path: path.count(b'/') + bool(path),
+            reverse=True
+        )
+
+        for path in dirty_paths:
+            tree = self._objects[path]
+
+            if path:
+                dirname, basename = utils.paths.path_split(path)
+                parent_tree = self._get_or_create_tree(dirname)
+
+                if not len(tree):
+                    # a tree created then emptied was never added
+                    if basename in parent_tree:
+                        del parent_tree[basename]
+
+                    self._forget(path)
+                    continue
+
+                parent_tree.add(basename, stat.S_IFDIR, tree.id)
+
+            self.object_store.add_object(tree)
+
+        self._dirty.clear()
 
     def get(self, path, default=None):
-        return self._objects.get(path, default)
+        path = ProcessedPath.from_path(path).rootless_path
+        self._check_path(path)
+
+        if path in self._dirty:
+            self._build_trees()
+
+        try:
+            return self._load(path)
+        except KeyError:
+            return default
+
+    def remove(self, paths):
+        for path in paths:
+            processed_path = ProcessedPath.from_path(path)
+
+            if self.get(processed_path.path) is None:
+                raise KeyError(path)
+
+            leaf_tree = self._get_or_create_tree(
+                processed_path.rootless_dirname
+            )
+            del leaf_tree[processed_path.basename]
+
+            self._forget(processed_path.rootless_path)
+            self._mark_dirty(processed_path)
 
     def add(self, contents):
-        # @todo a true bulk add without considering every file individually
         for content, path in contents:
-            blob = dulwich.objects.Blob.from_string(content.read())
-            self._add(path, blob)
+            self._check_path(ProcessedPath.from_path(path).rootless_path)
+            blob_id = stream.add_blob_stream(
+                self.object_store, content, self.chunk_size
+            )
+            self._add(path, blob_id)
 
-    def _add(self, path, blob, file_mode=0o100644):
+    def _add(self, path, blob_id, file_mode=0o100644):
         processed_path = ProcessedPath.from_path(path)
 
-        self.object_store.add_object(blob)
-        self._objects[processed_path.rootless_path] = blob
-
-        paths = list(processed_path.intermediate_paths())
-
-        # first update the leaf tree with the blob objects to add
-        leaf_path = paths[-1]
-        leaf_tree = self._get_or_create_tree(leaf_path)
+        # the blob itself is loaded only if it's read afterwards
+        self._forget(processed_path.rootless_path)
 
-        leaf_tree.add(processed_path.basename, file_mode,  blob.id)
+        # only stage the blob in the leaf tree, the trees are built when
+        # the root tree is read
+        leaf_tree = self._get_or_create_tree(processed_path.rootless_dirname)
+        leaf_tree.add(processed_path.basename, file_mode, blob_id)
 
-        self.object_store.add_object(leaf_tree)
+        self._mark_dirty(processed_path)
 
-        # iterate the other trees from the nearest until the root
-        # and update them
-        indexed_paths = list(enumerate(reversed(paths)))
 
-        for idx, intermediate_path in indexed_paths:
-            if intermediate_path:
-                # if intermediate_path == '' it's the root tree
-                _, parent_path = indexed_paths[idx + 1]
+def _outermost_paths(paths):
+    """Get the sorted paths which aren't under another one.
 
-                parent_tree = self._get_or_create_tree(parent_path)
-                child_tree = self._get_or_create_tree(intermediate_path)
-                child_idx = processed_path.tokens_n - 1 - idx
-                child_name = processed_path.tokens[child_idx]
+        Args:
+            paths (Iterable[bytes]): The rootless paths.
+        Returns:
+            (list(bytes))
+    """
+    outermost_paths = []
 
-                parent_tree.add(child_name, stat.S_IFDIR, child_tree.id)
+    for path in sorted(set(paths)):
+        if not any(
+            not other_path or path.startswith(other_path + b'/')
+            for other_path in outermost_paths
+        ):
+            outermost_paths.append(path)
 
-                self.object_store.add_object(child_tree)
-                self.object_store.add_object(parent_tree)
-            else:
-                break
+    return outermost_paths
 
 
 _ProcessedPath = collections.namedtuple(
@@ -205,3 +1173,7 @@ class ProcessedPath(_ProcessedPath):
     @property
     def rootless_path(self):
         return self.path[1:]
+
+    @property
+    def rootless_dirname(self):
+        return self.dirname[1:]
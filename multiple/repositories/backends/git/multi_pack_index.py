@@ -0,0 +1,195 @@
+import binascii
+import hashlib
+import mmap
+import shutil
+import struct
+
+from multiple.repositories.backends import git as git_aws
+
+SIGNATURE = b'MPIX'
+VERSION = 1
+
+# signature, version, number of packs
+HEADER = struct.Struct('>4sII')
+# number of objects with a sha starting by a byte lower or equal to each byte
+FANOUT = struct.Struct('>256I')
+# object sha, pack number
+RECORD = struct.Struct('>20sI')
+
+
+class MultiPackIndex(object):
+    """Index of the objects of many packs, an object is routed to its pack
+    with a single lookup and the indexes of the other packs aren't loaded.
+
+    The index starts with a header, the names of the packs and a fanout
+    table, then the records of the objects sorted by sha. It ends with the
+    sha1 of its content, which names the index, an index is never
+    modified. A pack isn't always in the index, e.g a pack added since the
+    index was written.
+    """
+
+    def __init__(self, data):
+        """
+            Args:
+                data (bytes): The content of the index, e.g a mmap.
+            Raises:
+                ValueError if the content isn't a multi pack index.
+        """
+        signature, version, packs_n = HEADER.unpack_from(data, 0)
+
+        if signature != SIGNATURE or version != VERSION:
+            raise ValueError('unsupported multi pack index')
+
+        offset = HEADER.size
+        self.pack_names = [
+            binascii.hexlify(data[offset + n * 20:offset + (n + 1) * 20])
+            for n in range(packs_n)
+        ]
+        offset += packs_n * 20
+
+        self._fanout = FANOUT.unpack_from(data, offset)
+        self._records_offset = offset + FANOUT.size
+        self._data = data
+
+    @classmethod
+    def from_path(cls, path):
+        """Map an index file in memory."""
+        with open(path, 'rb') as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def __len__(self):
+        return self._fanout[-1]
+
+    def __contains__(self, sha):
+        return self.lookup(sha) is not None
+
+    def _record(self, n):
+        return RECORD.unpack_from(
+            self._data, self._records_offset + n * RECORD.size
+        )
+
+    def lookup(self, sha):
+        """Get the pack of an object.
+
+            Args:
+                sha (bytes): The object sha, hexadecimal or binary.
+            Returns:
+                (bytes) The hexadecimal name of the pack or None if the
+                object isn't indexed.
+        """
+        if len(sha) == 40:
+            sha = binascii.unhexlify(sha)
+
+        start = self._fanout[sha[0] - 1] if sha[0] else 0
+        end = self._fanout[sha[0]]
+
+        while start < end:
+            middle = (start + end) // 2
+            record_sha, pack_number = self._record(middle)
+
+            if record_sha < sha:
+                start = middle + 1
+            elif record_sha > sha:
+                end = middle
+            else:
+                return self.pack_names[pack_number]
+
+        return None
+
+    def iterrecords(self):
+        """Iterate over the objects and their pack.
+
+            Returns:
+                (Iterable[tuple(bytes, bytes)]) The binary sha of an object
+                and the hexadecimal name of its pack.
+        """
+        for n in range(len(self)):
+            sha, pack_number = self._record(n)
+
+            yield sha, self.pack_names[pack_number]
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+
+
+def write_multi_pack_index(f, records):
+    """Write a multi pack index.
+
+        Args:
+            f (IO): The file where to write the index.
+            records (Iterable[tuple(bytes, bytes)]): The binary sha of the
+                objects and the hexadecimal name of their pack, an object
+                in many packs is routed to the first one.
+        Returns:
+            (bytes) The hexadecimal sha1 of the index, its name.
+    """
+    pack_numbers = {}
+    packs_by_sha = {}
+
+    for sha, pack_name in records:
+        pack_number = pack_numbers.setdefault(pack_name, len(pack_numbers))
+        packs_by_sha.setdefault(sha, pack_number)
+
+    shas = sorted(packs_by_sha)
+    fanout = [0] * 256
+
+    for sha in shas:
+        fanout[sha[0]] += 1
+
+    for n in range(1, 256):
+        fanout[n] += fanout[n - 1]
+
+    sha1 = hashlib.sha1()
+
+    def write(data):
+        f.write(data)
+        sha1.update(data)
+
+    write(HEADER.pack(SIGNATURE, VERSION, len(pack_numbers)))
+
+    for pack_name in sorted(pack_numbers, key=pack_numbers.get):
+        write(binascii.unhexlify(pack_name))
+
+    write(FANOUT.pack(*fanout))
+
+    for sha in shas:
+        write(RECORD.pack(sha, packs_by_sha[sha]))
+
+    f.write(sha1.digest())
+
+    return sha1.hexdigest().encode('ascii')
+
+
+def load_multi_pack_index(path, aws_s3_bucket, disk_cache=None):
+    """Load a multi pack index file by bucket key.
+
+        Like the pack indexes, with a disk cache the index is downloaded
+        once and mapped in memory from the cached file.
+
+        Args:
+            path (str): The key of the index file in the bucket.
+            aws_s3_bucket (boto3.Bucket): The bucket of the index file.
+            disk_cache (multiple.caches.disk.DiskCache): The local cache
+                where the index files are kept once downloaded.
+        Returns:
+            (MultiPackIndex)
+    """
+    if disk_cache is not None:
+        key = '{0}/{1}'.format(aws_s3_bucket.name, path)
+        cached_path = disk_cache.get_path(key)
+
+        if cached_path is None:
+            with git_aws.file.AwsS3GitFile(
+                path, 'rb', 0, aws_s3_bucket=aws_s3_bucket
+            ) as f:
+                cached_path = disk_cache.set_file(
+                    key, lambda cached: shutil.copyfileobj(f, cached)
+                )
+
+        return MultiPackIndex.from_path(cached_path)
+
+    with git_aws.file.AwsS3GitFile(
+        path, 'rb', 0, aws_s3_bucket=aws_s3_bucket
+    ) as f:
+        return MultiPackIndex(f.read())
@@ -1,9 +1,22 @@
+import io
+import itertools
+import os
+import shutil
+import tempfile
+import threading
+import time
+
 import boto3
+import botocore
 import dulwich
+import dulwich.object_store
+import dulwich.objects
+import dulwich.pack
 
 from dulwich.repo import OBJECTDIR
 from dulwich.object_store import PACKDIR
 
+from multiple import caches
 from multiple import utils
 from multiple.repositories.backends import git as git_aws
 
@@ -19,4 +32,599 @@ class AwsS3MissingObjectFinder(dulwich.object_store.MissingObjectFinder):
 
 
 class AwsS3ObjectStore(dulwich.object_store.PackBasedObjectStore):
-    # TODO
+    """Git object store in an amazon s3 bucket.
+
+    The objects are stored like in a git repository, the loose objects
+    under `objects/xx/` and the packs under `objects/pack/`. The packs are
+    read with range requests, the fetched blocks are kept in a memory cache
+    shared by the packs and, when a disk cache is provided, the pack
+    indexes, the blocks and the loose objects are kept on the local disk
+    too.
+
+    The pack listing is cached, it's only refreshed when an object isn't
+    found or a pack listed is missing, so a warm store serves its reads
+    without any request.
+
+    A pack replaced, e.g by a repack, is first retired: a marker file hides
+    it from the new listings while the stores which listed it can still
+    read it, it's deleted once the grace period of the marker is over.
+
+    The objects of the packs are indexed by a multi pack index, an object
+    is found with a single lookup instead of a lookup in the index of each
+    pack. The packs added since the multi pack index was written are looked
+    up one by one, it's only rewritten once enough packs aren't covered.
+    """
+
+    BLOCK_CACHE_SIZE = 1024 * 1024 * 64
+    DELTA_BASE_CACHE_SIZE = 1024 * 1024 * 64
+    MULTI_PACK_INDEX_THRESHOLD = 8
+
+    def __init__(self, aws_s3_bucket, path='', disk_cache=None,
+                 block_size=git_aws.file.AwsS3RangeFile.BLOCK_SIZE,
+                 block_cache_size=BLOCK_CACHE_SIZE, multi_pack_index=True,
+                 delta_base_cache=None,
+                 multi_pack_index_threshold=MULTI_PACK_INDEX_THRESHOLD):
+        """
+            Args:
+                aws_s3_bucket (s3.Bucket):
+                    The bucket where the objects are stored.
+                path (str):
+                    The key prefix of the repository in the bucket.
+                disk_cache (multiple.caches.disk.DiskCache):
+                    The local cache of the pack indexes, the pack blocks
+                    and the loose objects.
+                block_size (int):
+                    The size of the blocks fetched from the packs.
+                block_cache_size (int):
+                    The maximum size in bytes of the blocks kept in memory.
+                multi_pack_index (bool):
+                    Write the multi pack index when packs are added.
+                delta_base_cache (git_aws.pack.DeltaBaseCache):
+                    The cache of the delta bases shared by the packs, it
+                    could be shared between stores too.
+                multi_pack_index_threshold (int):
+                    The number of packs the multi pack index doesn't cover
+                    before a pack added rewrites it.
+        """
+        super().__init__()
+
+        self._aws_bucket = aws_s3_bucket
+        self._disk_cache = disk_cache
+        self._block_size = block_size
+        self._block_cache = caches.memory.LRUSizeCache(
+            block_cache_size, compute_size=len
+        )
+        if delta_base_cache is None:
+            delta_base_cache = git_aws.pack.DeltaBaseCache(
+                self.DELTA_BASE_CACHE_SIZE
+            )
+
+        self.delta_base_cache = delta_base_cache
+        self._packs_listed = False
+        self._packs_lock = threading.RLock()
+        # the objects, the packs and their indexes are named after their
+        # content, their writes aren't locked
+        self._no_lock_backend = git_aws.lock.NoLockBackend()
+
+        self.multi_pack_index = multi_pack_index
+        self.multi_pack_index_threshold = multi_pack_index_threshold
+        self._multi_pack_index = None
+        self._multi_pack_index_key = None
+        # the basenames of the packs indexed by the multi pack index
+        self._multi_indexed = frozenset()
+
+        self.path = '/'.join(p for p in (path.strip('/'), OBJECTDIR) if p)
+        self.pack_dir = '/'.join((self.path, PACKDIR))
+        self.multi_pack_index_prefix = self.pack_dir + '/multi-pack-index-'
+
+    def local_info_path(self, name):
+        """Get the local path of an info file of the repository, e.g the
+            commit graph, kept in the disk cache directory.
+
+            The info files aren't entries of the disk cache, they're neither
+            counted in its size nor evicted.
+
+            Args:
+                name (str): The name of the info file.
+            Returns:
+                (str) The path or None without disk cache.
+        """
+        if self._disk_cache is None:
+            return None
+
+        return os.path.join(
+            self._disk_cache.directory, 'info', self._aws_bucket.name,
+            self.path, 'info', name
+        )
+
+    def _get_shafile_key(self, sha):
+        if isinstance(sha, bytes):
+            sha = sha.decode('ascii')
+
+        return '{0}/{1}/{2}'.format(self.path, sha[:2], sha[2:])
+
+    def _get_pack_basepath(self, entries):
+        suffix = dulwich.pack.iter_sha1(entry[0] for entry in entries)
+
+        return '{0}/pack-{1}'.format(self.pack_dir, suffix.decode('ascii'))
+
+    def _pack_basename(self, pack_name):
+        return '{0}/pack-{1}'.format(self.pack_dir, pack_name.decode('ascii'))
+
+    def _new_pack(self, basename, data_size=None):
+        return git_aws.pack.AwsS3Pack(
+            basename, aws_s3_bucket=self._aws_bucket,
+            block_size=self._block_size, block_cache=self._block_cache,
+            disk_cache=self._disk_cache, data_size=data_size,
+            delta_base_cache=self.delta_base_cache
+        )
+
+    @property
+    def packs(self):
+        with self._packs_lock:
+            if not self._packs_listed:
+                self._update_pack_cache()
+
+            return list(self._iter_cached_packs())
+
+    def _update_pack_cache(self):
+        """List the packs of the bucket and cache the new ones.
+
+            A pack is only listed once its index is written.
+
+            Returns:
+                (list(git_aws.pack.AwsS3Pack)) The new packs.
+        """
+        with self._packs_lock:
+            sizes = {}
+            retired = set()
+            multi_pack_indexes = []
+
+            for summary in self._aws_bucket.objects.filter(
+                Prefix=self.pack_dir + '/'
+            ):
+                if summary.key.startswith(self.multi_pack_index_prefix):
+                    multi_pack_indexes.append(summary.key)
+                elif summary.key.endswith('.retired'):
+                    retired.add(summary.key[:-len('.retired')])
+                else:
+                    sizes[summary.key] = summary.size
+
+            pack_files = {
+                key[:-len('.pack')]
+                for key in sizes
+                if key.endswith('.pack')
+                and key[:-len('.pack')] + '.idx' in sizes
+            } - retired
+
+            new_packs = []
+            for basename in pack_files - set(self._pack_cache):
+                pack = self._new_pack(basename, sizes[basename + '.pack'])
+                new_packs.append(pack)
+                self._pack_cache[basename] = pack
+
+            for basename in set(self._pack_cache) - pack_files:
+                self._pack_cache.pop(basename).close()
+
+            if multi_pack_indexes:
+                self._load_multi_pack_index(max(multi_pack_indexes))
+
+            self._packs_listed = True
+
+            return new_packs
+
+    def _load_multi_pack_index(self, key):
+        """Load a multi pack index unless it's already loaded.
+
+            When the multi pack index was deleted since it was listed, the
+            index loaded is kept, the packs it doesn't cover are looked up
+            one by one.
+        """
+        with self._packs_lock:
+            if key == self._multi_pack_index_key:
+                return
+
+            try:
+                multi_pack_index = git_aws.multi_pack_index \
+                    .load_multi_pack_index(
+                        key, self._aws_bucket, disk_cache=self._disk_cache
+                    )
+            except IOError:
+                return
+
+            if self._multi_pack_index is not None:
+                self._multi_pack_index.close()
+
+            self._multi_pack_index = multi_pack_index
+            self._multi_pack_index_key = key
+            self._multi_indexed = frozenset(
+                self._pack_basename(name)
+                for name in multi_pack_index.pack_names
+            )
+
+    def write_multi_pack_index(self):
+        """Write the multi pack index of the packs listed.
+
+            When packs were only added, the records of the current multi
+            pack index are kept and only the indexes of the new packs are
+            loaded. Once a pack indexed is removed, its objects may be in
+            other packs and all the indexes are loaded. The multi pack
+            indexes replaced are kept for the stores which listed them,
+            `delete_retired_packs` deletes them.
+        """
+        with self._packs_lock:
+            packs = {pack._basename: pack for pack in self.packs}
+            indexed = self._multi_indexed
+            records = []
+
+            if self._multi_pack_index is not None and indexed <= set(packs):
+                records.append(self._multi_pack_index.iterrecords())
+            else:
+                indexed = frozenset()
+
+            for basename, pack in sorted(packs.items()):
+                if basename not in indexed:
+                    records.append(zip(
+                        (sha for sha, _, _ in pack.index.iterentries()),
+                        itertools.repeat(basename[-40:].encode('ascii'))
+                    ))
+
+            f = io.BytesIO()
+            name = git_aws.multi_pack_index.write_multi_pack_index(
+                f, itertools.chain.from_iterable(records)
+            ).decode('ascii')
+
+            if self._multi_pack_index_key is not None \
+                    and self._multi_pack_index_key.endswith(name + '.midx'):
+                return
+
+            # the generation orders the indexes, the last one is loaded
+            generation = max(
+                (
+                    int(summary.key[len(self.multi_pack_index_prefix):]
+                        .split('-')[0])
+                    for summary in self._aws_bucket.objects.filter(
+                        Prefix=self.multi_pack_index_prefix
+                    )
+                ),
+                default=0
+            ) + 1
+            key = '{0}{1:010d}-{2}.midx'.format(
+                self.multi_pack_index_prefix, generation, name
+            )
+
+            with git_aws.file.AwsS3GitFile(
+                key, 'wb', 0, self._aws_bucket,
+                lock_backend=self._no_lock_backend
+            ) as index_file:
+                index_file.write(f.getvalue())
+
+            self._load_multi_pack_index(key)
+
+    def _uncovered_packs(self):
+        """Count the packs listed the multi pack index doesn't cover."""
+        with self._packs_lock:
+            return sum(
+                1 for pack in self.packs
+                if pack._basename not in self._multi_indexed
+            )
+
+    def find_pack(self, sha):
+        """Find the pack of an object.
+
+            The object is looked up in the multi pack index, then in the
+            index of each pack the multi pack index doesn't cover, or of
+            each pack when the pack indexed is no longer listed. When a
+            pack listed is missing, e.g deleted by a repack, the packs are
+            listed again and the object looked up again.
+
+            Args:
+                sha (bytes): The object sha, hexadecimal or binary.
+            Returns:
+                (git_aws.pack.AwsS3Pack) The pack or None if the object
+                isn't in a pack listed.
+        """
+        try:
+            return self._find_pack(sha)
+        except IOError:
+            self._update_pack_cache()
+
+        return self._find_pack(sha)
+
+    def _find_pack(self, sha):
+        packs = self.packs
+        multi_pack_index = self._multi_pack_index
+        indexed = self._multi_indexed
+
+        if multi_pack_index is not None:
+            name = multi_pack_index.lookup(sha)
+
+            if name is not None:
+                pack = self._pack_cache.get(self._pack_basename(name))
+
+                if pack is not None:
+                    return pack
+
+                # the pack was retired since the index was written, the
+                # object may be in any pack
+                indexed = frozenset()
+
+        for pack in packs:
+            if pack._basename not in indexed and sha in pack:
+                return pack
+
+        return None
+
+    def contains_packed(self, sha):
+        return self.find_pack(sha) is not None
+
+    def get_raw(self, name):
+        """Get the type number and the content of an object.
+
+            The pack of the object is found with `find_pack`, then the
+            object is looked up in the loose objects and in the packs added
+            in the meantime.
+
+            Args:
+                name (bytes): The object sha, hexadecimal or binary.
+            Returns:
+                (tuple(int, bytes))
+            Raises:
+                KeyError if the object doesn't exists.
+        """
+        if name == dulwich.objects.ZERO_SHA:
+            raise KeyError(name)
+
+        if len(name) == 20:
+            sha, hexsha = name, dulwich.objects.sha_to_hex(name)
+        else:
+            sha, hexsha = dulwich.objects.hex_to_sha(name), name
+
+        pack = self.find_pack(sha)
+
+        if pack is not None:
+            try:
+                return pack.get_raw(sha)
+            except IOError:
+                # the pack was deleted since it was listed
+                self._update_pack_cache()
+                pack = self.find_pack(sha)
+
+                if pack is not None:
+                    return pack.get_raw(sha)
+
+        obj = self._get_loose_object(hexsha)
+
+        if obj is not None:
+            return obj.type_num, obj.as_raw_string()
+
+        for pack in self._update_pack_cache():
+            try:
+                return pack.get_raw(sha)
+            except KeyError:
+                pass
+
+        raise KeyError(hexsha)
+
+    def _iter_loose_objects(self):
+        for summary in self._aws_bucket.objects.filter(
+            Prefix=self.path + '/'
+        ):
+            tokens = summary.key[len(self.path) + 1:].split('/')
+
+            if len(tokens) == 2 and len(tokens[0]) == 2:
+                sha = (tokens[0] + tokens[1]).encode('ascii')
+
+                if dulwich.objects.valid_hexsha(sha):
+                    yield sha
+
+    def open_loose_object(self, sha):
+        """Open the file of a loose object.
+
+            The objects being immutable, they are kept in the disk cache
+            once downloaded.
+
+            Args:
+                sha (bytes): The object sha.
+            Returns:
+                (IO) The file or None if the object isn't loose.
+        """
+        key = self._get_shafile_key(sha)
+
+        if self._disk_cache is not None:
+            path = self._disk_cache.get_path(key)
+
+            if path is not None:
+                return open(path, 'rb')
+
+        try:
+            f = git_aws.file.AwsS3GitFile(key, 'rb', 0, self._aws_bucket)
+        except IOError:
+            return None
+
+        if self._disk_cache is None:
+            return f
+
+        with f:
+            path = self._disk_cache.set_file(
+                key, lambda cached: shutil.copyfileobj(f, cached)
+            )
+
+        return open(path, 'rb')
+
+    def _get_loose_object(self, sha):
+        f = self.open_loose_object(sha)
+
+        if f is None:
+            return None
+
+        with f:
+            return dulwich.objects.ShaFile.from_file(f)
+
+    def contains_loose(self, sha):
+        key = self._get_shafile_key(sha)
+
+        if self._disk_cache is not None and key in self._disk_cache:
+            return True
+
+        try:
+            self._aws_bucket.Object(key).load()
+        except botocore.exceptions.ClientError:
+            return False
+
+        return True
+
+    def _remove_loose_object(self, sha):
+        self._aws_bucket.Object(self._get_shafile_key(sha)).delete()
+
+    def retire_pack(self, pack):
+        """Hide a pack from the new listings, it's deleted once the grace
+            period is over, see `delete_retired_packs`.
+
+            Args:
+                pack (git_aws.pack.AwsS3Pack): The pack, its objects must be
+                    in other packs.
+        """
+        self._aws_bucket.Object(pack._basename + '.retired').put(Body=b'')
+        self._pack_cache.pop(pack._basename, None)
+
+    def delete_retired_packs(self, grace_period):
+        """Delete the packs retired for longer than a grace period.
+
+            The multi pack indexes replaced for longer than the grace period
+            are deleted too.
+
+            Args:
+                grace_period (float): The number of seconds a retired pack
+                    is kept, longer than the time a store reads a pack it
+                    listed before looking up the packs again.
+            Returns:
+                (int) The number of packs deleted.
+        """
+        expired = time.time() - grace_period
+        deleted = 0
+        multi_pack_indexes = []
+
+        for summary in self._aws_bucket.objects.filter(
+            Prefix=self.pack_dir + '/'
+        ):
+            if summary.key.startswith(self.multi_pack_index_prefix):
+                multi_pack_indexes.append(summary)
+            elif summary.key.endswith('.retired') \
+                    and summary.last_modified.timestamp() <= expired:
+                basename = summary.key[:-len('.retired')]
+
+                self._aws_bucket.Object(basename + '.pack').delete()
+                self._aws_bucket.Object(basename + '.idx').delete()
+                # the marker last, a pack is never listed partially deleted
+                summary.delete()
+                deleted += 1
+
+        # an index is replaced by the ones of the next generations
+        replaced = max(
+            (
+                summary.key for summary in multi_pack_indexes
+                if summary.last_modified.timestamp() <= expired
+            ),
+            default=None
+        )
+
+        for summary in multi_pack_indexes:
+            if replaced is not None and summary.key < replaced:
+                summary.delete()
+
+        return deleted
+
+    def _remove_pack(self, pack):
+        self._pack_cache.pop(pack._basename, None)
+        pack.close()
+
+        self._aws_bucket.Object(pack._data_path).delete()
+        self._aws_bucket.Object(pack._idx_path).delete()
+
+    def add_object(self, obj):
+        """Add a single object to this object store.
+
+            Args:
+                obj (dulwich.objects.ShaFile): The object to add.
+        """
+        with git_aws.file.AwsS3GitFile(
+            self._get_shafile_key(obj.id), 'wb', 0, self._aws_bucket,
+            lock_backend=self._no_lock_backend
+        ) as f:
+            f.write(obj.as_legacy_object())
+
+    def add_object_stream(self, sha, type_num, length, chunks):
+        """Add a single object from its content chunks.
+
+            Args:
+                sha (bytes): The object sha.
+                type_num (int): The object type number.
+                length (int): The length of the object content.
+                chunks (Iterable[bytes]): The object content.
+        """
+        with git_aws.file.AwsS3GitFile(
+            self._get_shafile_key(sha), 'wb', 0, self._aws_bucket,
+            lock_backend=self._no_lock_backend
+        ) as f:
+            git_aws.stream.write_loose_object(f, type_num, length, chunks)
+
+    def add_pack(self):
+        """Add a new pack to this object store.
+
+            The pack is written in a local temporary file, on commit it's
+            indexed and both the pack and its index are uploaded in the
+            bucket, the index last so the pack is never listed incomplete.
+
+            Returns:
+                Fileobject to write to, a commit function to call when the
+                pack is finished and an abort function.
+        """
+        f = tempfile.TemporaryFile()
+
+        def commit():
+            size = f.tell()
+
+            if not size:
+                f.close()
+                return None
+
+            f.seek(0)
+
+            with dulwich.pack.PackData.from_file(f, size) as pack_data:
+                entries = pack_data.sorted_entries()
+                pack_checksum = pack_data.get_stored_checksum()
+                basename = self._get_pack_basepath(entries)
+
+                if basename in self._pack_cache:
+                    return self._pack_cache[basename]
+
+                f.seek(0)
+                with git_aws.file.AwsS3GitFile(
+                    basename + '.pack', 'wb', 0, self._aws_bucket,
+                    lock_backend=self._no_lock_backend
+                ) as pack_file:
+                    for chunk in git_aws.stream.iter_chunks(f):
+                        pack_file.write(chunk)
+
+            with git_aws.file.AwsS3GitFile(
+                basename + '.idx', 'wb', 0, self._aws_bucket,
+                lock_backend=self._no_lock_backend
+            ) as index_file:
+                dulwich.pack.write_pack_index_v2(
+                    index_file, entries, pack_checksum
+                )
+
+            pack = self._new_pack(basename, size)
+            self._add_cached_pack(basename, pack)
+
+            if self.multi_pack_index and self._uncovered_packs() \
+                    >= self.multi_pack_index_threshold:
+                self.write_multi_pack_index()
+
+            return pack
+
+        def abort():
+            f.close()
+
+        return f, commit, abort
@@ -1,25 +1,131 @@
+import collections
+import shutil
+import threading
+
 import dulwich
+import dulwich.errors
+import dulwich.pack
 
+from multiple import caches
 from multiple.repositories.backends import git as git_aws
 
 
-def load_pack_index(path, aws_s3_bucket):
+def load_pack_index(path, aws_s3_bucket, disk_cache=None):
     """Load an index file by bucket key.
 
+        With a disk cache the index file is downloaded once in the cache, it
+        is then mapped in memory from the cached file, so all the processes
+        sharing the cache directory share one page cached copy. The key of
+        an index contains the pack sha, an index is never modified.
+
         Args:
             path (str):
                 The key to the index file in the aws s3 bucket.
             aws_s3_bucket (boto3.Bucket):
                 The aws s3 bucket where the file pack index is stored.
+            disk_cache (multiple.caches.disk.DiskCache):
+                The local cache where the index files are kept once
+                downloaded.
         Returns:
             PackIndex: Loaded pack index file
     """
+    if disk_cache is not None:
+        key = '{0}/{1}'.format(aws_s3_bucket.name, path)
+        cached_path = disk_cache.get_path(key)
+
+        if cached_path is None:
+            with git_aws.file.AwsS3GitFile(
+                path, 'rb', 0, aws_s3_bucket=aws_s3_bucket
+            ) as f:
+                cached_path = disk_cache.set_file(
+                    key, lambda cached: shutil.copyfileobj(f, cached)
+                )
+
+        # the index is mapped in memory by dulwich
+        return dulwich.pack.load_pack_index(cached_path)
+
     with git_aws.file.AwsS3GitFile(
         path, 'rb', 0, aws_s3_bucket=aws_s3_bucket
     ) as f:
         return dulwich.pack.load_pack_index_file(path, f)
 
 
+DeltaBaseCacheStats = collections.namedtuple(
+    'DeltaBaseCacheStats',
+    caches.memory.CacheStats._fields + (
+        'inflated_bytes',  # the number of bytes decompressed from the packs
+    )
+)
+
+
+class DeltaBaseCache(object):
+    """Cache of the delta bases and of the objects resolved from deltas,
+    bounded in bytes and shared by many packs.
+
+    Without the cache the bases of a delta chain are decompressed again
+    each time an object of the chain is read. The counters of the cache
+    and the number of bytes decompressed size the cache against the cost
+    of the delta resolution.
+    """
+
+    MAX_SIZE = 1024 * 1024 * 64
+
+    def __init__(self, max_size=MAX_SIZE):
+        """
+            Args:
+                max_size (int): The maximum size in bytes of the objects.
+        """
+        self._objects = caches.memory.LRUSizeCache(
+            max_size, compute_size=dulwich.pack._compute_object_size
+        )
+        self._lock = threading.Lock()
+        self.inflated_bytes = 0
+
+    @property
+    def stats(self):
+        """
+            Returns:
+                (DeltaBaseCacheStats) The counters and the size of the
+                cache.
+        """
+        return DeltaBaseCacheStats(
+            *self._objects.stats, inflated_bytes=self.inflated_bytes
+        )
+
+    def reset_stats(self):
+        self._objects.reset_stats()
+        self.inflated_bytes = 0
+
+    def add_inflated(self, size):
+        with self._lock:
+            self.inflated_bytes += size
+
+    def for_pack(self, name):
+        """Get the view of the cache for a pack, its entries are keyed by
+            offset like the offset cache of a `dulwich.pack.PackData`.
+
+            Args:
+                name (str): The unique name of the pack.
+        """
+        return _PackOffsetCache(self._objects, name)
+
+
+class _PackOffsetCache(object):
+
+    def __init__(self, objects, name):
+        self._objects = objects
+        self._name = name
+
+    def __contains__(self, offset):
+        return (self._name, offset) in self._objects
+
+    def __getitem__(self, offset):
+        return self._objects[(self._name, offset)]
+
+    def __setitem__(self, offset, value):
+        self._objects.add((self._name, offset), value)
+
+
 class AwsS3PackData(dulwich.pack.PackData):
     PACK_HEADER_SIZE = 12
     """
@@ -35,33 +141,160 @@ class AwsS3PackData(dulwich.pack.PackData):
             order)
     """
     OFFSET_CACHE_SIZE = 1024 * 1024 * 20
+    # the header of an object with the reference to its delta base fits,
+    # its block is fetched before the size of the object is known
+    OBJECT_HEADER_SIZE = 32
+    # the bytes fetched from the start of each object of a batch, before
+    # the size of the object is known
+    READ_AHEAD = 1024 * 64
 
-    def __init__(self, filename, aws_s3_bucket, file=None):
+    def __init__(self, filename, aws_s3_bucket, file=None,
+                 block_size=git_aws.file.AwsS3RangeFile.BLOCK_SIZE,
+                 block_cache=None, disk_cache=None, size=None,
+                 delta_base_cache=None):
         """
             Args:
                 filename (str):
                     The full key of the pack file in the aws s3 bucket.
                 aws_s3_bucket (s3.Bucket):
                     The aws s3 bucket where the file pack is stored.
+                file (git_aws.file.AwsS3RangeFile):
+                    The file of the pack, by default the pack is read with
+                    range requests.
+                block_size (int):
+                    The size of the blocks fetched by the range requests.
+                block_cache (multiple.caches.memory.LRUSizeCache):
+                    The cache of the blocks fetched, could be shared between
+                    packs.
+                disk_cache (multiple.caches.disk.DiskCache):
+                    The local cache of the blocks fetched.
+                size (int):
+                    The size of the pack file if it's already known.
+                delta_base_cache (DeltaBaseCache):
+                    The cache of the delta bases, could be shared between
+                    packs, by default the pack has its own.
         """
         self._aws_bucket = aws_s3_bucket
-        self._filename = filename
-        self._header_size = self.PACK_HEADER_SIZE
 
-        if not isinstance(git_aws.file.AwsS3GitFile, file):
+        if file is None:
+            file = git_aws.file.AwsS3RangeFile(
+                filename, aws_s3_bucket=self._aws_bucket,
+                block_size=block_size, block_cache=block_cache,
+                disk_cache=disk_cache, size=size
+            )
+        elif not isinstance(file, git_aws.file.AwsS3RangeFile):
             raise ValueError('unsupported file interface %r', file)
 
+        super().__init__(filename, file=file, size=file.size)
+
+        if delta_base_cache is None:
+            delta_base_cache = DeltaBaseCache(self.OFFSET_CACHE_SIZE)
+
+        self.delta_base_cache = delta_base_cache
+        self._offset_cache = delta_base_cache.for_pack(filename)
+        # set while the deltas of an object are resolved
+        self._resolving = threading.local()
+
+        self.pack = None
+
+    @property
+    def _file(self):
+        """The file of the pack for the current thread.
+
+            The pack data reads its objects by seeking its file, each thread
+            gets its own copy of the file so the objects can be read
+            concurrently, the copies share the block caches.
+        """
+        file = getattr(self._local, 'file', None)
+
         if file is None:
-            self._file = git_aws.file.AwsS3GitFile(
-                self._filename, 'rb', 0, aws_s3_bucket=self._aws_bucket
-            )
+            file = self._local.file = self._shared_file.copy()
+
+        return file
+
+    @_file.setter
+    def _file(self, file):
+        self._shared_file = file
+        self._local = threading.local()
+        self._local.file = file
 
-        self._offset_cache = dulwich.lru_cache.LRUSizeCache(
-            self.OFFSET_CACHE_SIZE,
-            compute_size=dulwich.lru_cache._compute_object_size
+    def _object_end(self, offset):
+        """Get an offset after the last byte of the object at an offset.
+
+            The header of the object must be fetched. The end is bounded
+            from the size of the object and the worst case of zlib, it can
+            be past the object.
+        """
+        _, length, offset = git_aws.stream.read_pack_object_header(
+            self._file, offset
         )
 
-        self.pack = None
+        # the reference to the base of a delta, at most a sha, the zlib
+        # compress bound and the buffer dulwich reads past the object
+        return (
+            offset + 20 + length + (length >> 12) + (length >> 14)
+            + (length >> 25) + 13 + dulwich.pack._ZLIB_BUFSIZE
+        )
+
+    def prefetch_objects(self, offsets):
+        """Fetch all the bytes of many objects, the neighbour objects are
+            fetched with a single request.
+
+            The start of each object is fetched first, up to the next object
+            of the batch within the read ahead, then the rest of the larger
+            objects.
+
+            Args:
+                offsets (Iterable[int]): The offsets of the objects.
+        """
+        offsets = sorted(offsets)
+        f = self._file
+
+        f.prefetch_ranges(
+            (offset, min(next_offset, offset + self.READ_AHEAD))
+            for offset, next_offset in zip(
+                offsets, offsets[1:] + [self._get_size()]
+            )
+        )
+        f.prefetch_ranges(
+            (offset, self._object_end(offset)) for offset in offsets
+        )
+
+    def _prefetch_object(self, offset):
+        """Fetch all the bytes of an object with the fewest requests."""
+        self._file.prefetch(offset, offset + self.OBJECT_HEADER_SIZE)
+        self._file.prefetch(offset, self._object_end(offset))
+
+    def get_compressed_data_at(self, offset):
+        self._prefetch_object(offset)
+
+        return super().get_compressed_data_at(offset)
+
+    def get_object_at(self, offset):
+        """Get the type number and the object at an offset, the deltas
+            aren't resolved.
+
+            The delta bases read while a delta is resolved are kept in the
+            delta base cache.
+        """
+        try:
+            return self._offset_cache[offset]
+        except KeyError:
+            pass
+
+        self._prefetch_object(offset)
+
+        self._file.seek(offset)
+        unpacked, _ = dulwich.pack.unpack_object(self._file.read)
+        self.delta_base_cache.add_inflated(unpacked.decomp_len)
+
+        value = unpacked.pack_type_num, unpacked._obj()
+
+        if getattr(self._resolving, 'active', False) \
+                and value[0] not in dulwich.pack.DELTA_TYPES:
+            self._offset_cache[offset] = value
+
+        return value
 
 
 class AwsS3Pack(dulwich.pack.Pack):
@@ -69,13 +302,125 @@ class AwsS3Pack(dulwich.pack.Pack):
 
     def __init__(self, *args, **kwargs):
         self._aws_bucket = kwargs.pop('aws_s3_bucket')
+        self._block_size = kwargs.pop(
+            'block_size', git_aws.file.AwsS3RangeFile.BLOCK_SIZE
+        )
+        self._block_cache = kwargs.pop('block_cache', None)
+        self._disk_cache = kwargs.pop('disk_cache', None)
+        self._data_size = kwargs.pop('data_size', None)
+        self._delta_base_cache = kwargs.pop('delta_base_cache', None)
 
         super().__init__(*args, **kwargs)
 
-        self._data_load = lambda: AwsS3PackData(
-            self._data_path, self.aws_bucket
-        )
+        self._data_load = self._aws_data_load
 
         self._idx_load = lambda: load_pack_index(
-            self._idx_path, self._aws_bucket
+            self._idx_path, self._aws_bucket, disk_cache=self._disk_cache
+        )
+
+    def _aws_data_load(self):
+        data = AwsS3PackData(
+            self._data_path, self._aws_bucket, block_size=self._block_size,
+            block_cache=self._block_cache, disk_cache=self._disk_cache,
+            size=self._data_size, delta_base_cache=self._delta_base_cache
         )
+        data.pack = self
+
+        return data
+
+    def resolve_object(self, offset, type, obj, get_ref=None):
+        """Resolve the deltas of an object, the bases are cached."""
+        resolving = self.data._resolving
+        resolving.active = True
+
+        try:
+            return super().resolve_object(offset, type, obj, get_ref=get_ref)
+        finally:
+            resolving.active = False
+
+    def resolve_objects(self, offsets, executor=None):
+        """Resolve many objects of the pack at once.
+
+            The objects are read by increasing offset, the neighbour objects
+            with a single request, then their delta bases the same way. The
+            objects are inflated and the deltas applied by the executor,
+            zlib releases the gil, one level of the delta chains after the
+            other. A base shared by many objects is resolved once and kept
+            in the delta base cache.
+
+            Args:
+                offsets (Iterable[int]): The offsets of the objects.
+                executor (concurrent.futures.Executor): The executor
+                    inflating the objects and applying the deltas, by
+                    default the objects are resolved by the current thread.
+            Returns:
+                (dict(int, tuple(int, list(bytes)))) The type number and
+                the content chunks of the objects by offset.
+        """
+        data = self.data
+        map_objects = map if executor is None else executor.map
+
+        offsets = set(offsets)
+        unpacked = {}
+        bases = {}
+        resolved = {}
+        pending = sorted(offsets)
+
+        while pending:
+            data.prefetch_objects(pending)
+            unpacked.update(
+                zip(pending, map_objects(data.get_object_at, pending))
+            )
+            next_pending = set()
+
+            for offset in pending:
+                type_num, obj = unpacked[offset]
+
+                if type_num == dulwich.pack.OFS_DELTA:
+                    base = offset - obj[0]
+                elif type_num == dulwich.pack.REF_DELTA:
+                    try:
+                        base = self.index.object_index(obj[0])
+                    except KeyError:
+                        # the base is out of the pack
+                        resolved[offset] = self.resolve_object(
+                            offset, type_num, obj
+                        )
+                        continue
+                else:
+                    resolved[offset] = unpacked[offset]
+                    continue
+
+                bases[offset] = base
+
+                if base not in unpacked:
+                    next_pending.add(base)
+
+            pending = sorted(next_pending)
+
+        shared_bases = set(bases.values())
+
+        def apply_delta(offset):
+            base_type, base_chunks = resolved[bases[offset]]
+            _, (_, delta) = unpacked[offset]
+
+            return base_type, dulwich.pack.apply_delta(base_chunks, delta)
+
+        while bases:
+            ready = [
+                offset for offset, base in bases.items() if base in resolved
+            ]
+
+            if not ready:
+                raise dulwich.errors.ApplyDeltaError(
+                    'circular delta chain in {0}'.format(data.filename)
+                )
+
+            for offset, value in zip(ready, map_objects(apply_delta, ready)):
+                resolved[offset] = value
+                del bases[offset]
+
+                if offset in shared_bases:
+                    data._offset_cache[offset] = value
+
+        return {offset: resolved[offset] for offset in offsets}
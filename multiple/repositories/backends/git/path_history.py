@@ -0,0 +1,179 @@
+import os
+import sqlite3
+import stat
+import threading
+
+import dulwich
+import dulwich.object_store
+import dulwich.objects
+
+from multiple import utils
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS commits ('
+    ' sha BLOB PRIMARY KEY'
+    ')',
+    'CREATE TABLE IF NOT EXISTS changes ('
+    ' path BLOB NOT NULL,'
+    ' generation INTEGER NOT NULL,'
+    ' commit_time INTEGER NOT NULL,'
+    ' sha BLOB NOT NULL,'
+    ' PRIMARY KEY (path, generation, commit_time, sha)'
+    ') WITHOUT ROWID',
+)
+
+
+def default_path(object_store):
+    """Get the path of the path history of an object store, next to the
+        packs of the stores on the disk, or next to the local cache of the
+        stores which have one.
+
+        Returns:
+            (str) The path or None if the object store has nothing on the
+            disk.
+    """
+    if isinstance(object_store, dulwich.object_store.DiskObjectStore):
+        return os.path.join(object_store.path, 'info', 'path-history')
+
+    local_info_path = getattr(object_store, 'local_info_path', None)
+
+    if local_info_path is not None:
+        return local_info_path('path-history')
+
+    return None
+
+
+def _entries(object_store, sha):
+    if sha is None:
+        return {}
+
+    tree = object_store[sha]
+
+    return {
+        entry.path: (entry.mode, entry.sha) for entry in tree.iteritems()
+    }
+
+
+def changed_paths(object_store, tree_sha, other_tree_sha, path=b''):
+    """Get the paths changed between two trees, the trees with the same sha
+        aren't compared.
+
+        Args:
+            object_store (dulwich.object_store.BaseObjectStore):
+                The object store where the trees are stored.
+            tree_sha (bytes): The sha of the tree, None for no tree.
+            other_tree_sha (bytes): The sha of the other tree, None for no
+                tree.
+            path (bytes): The rootless path of the trees.
+        Returns:
+            (Iterable[bytes]) The rootless paths of the changed blobs and
+            of the trees containing them.
+    """
+    if tree_sha == other_tree_sha:
+        return
+
+    entries = _entries(object_store, tree_sha)
+    other_entries = _entries(object_store, other_tree_sha)
+
+    for name in sorted(set(entries) | set(other_entries)):
+        mode, sha = entries.get(name, (None, None))
+        other_mode, other_sha = other_entries.get(name, (None, None))
+
+        if (mode, sha) == (other_mode, other_sha):
+            continue
+
+        child_path = utils.paths.path_join(path, name)
+        yield child_path
+
+        is_tree = mode is not None and stat.S_ISDIR(mode)
+        other_is_tree = other_mode is not None and stat.S_ISDIR(other_mode)
+
+        if is_tree or other_is_tree:
+            yield from changed_paths(
+                object_store,
+                sha if is_tree else None,
+                other_sha if other_is_tree else None,
+                child_path
+            )
+
+
+class PathHistory(object):
+    """Index of the commits changing each path.
+
+    The changes of a commit are its paths, blobs and trees, differing from
+    all its parents. The index is a sqlite database, a path history is read
+    with a single index range scan, the descendants first, ordered by their
+    generation then by their time. A commit is only indexed once all its
+    parents are.
+    """
+
+    def __init__(self, path=None):
+        """
+            Args:
+                path (str): The path of the database, by default the index
+                    is kept in memory.
+        """
+        self.path = path
+
+        if path is not None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            path or ':memory:', check_same_thread=False
+        )
+
+        with self._lock, self._connection:
+            for statement in SCHEMA:
+                self._connection.execute(statement)
+
+    def __contains__(self, sha):
+        with self._lock:
+            return self._connection.execute(
+                'SELECT 1 FROM commits WHERE sha = ?', (sha, )
+            ).fetchone() is not None
+
+    def add(self, sha, commit_time, generation, paths):
+        """Index the paths changed by a commit.
+
+            Args:
+                sha (bytes): The commit sha.
+                commit_time (int): The commit time, it orders the commits
+                    with the same generation.
+                generation (int): The commit generation.
+                paths (Iterable[bytes]): The rootless paths changed.
+        """
+        with self._lock, self._connection:
+            self._connection.executemany(
+                'INSERT OR IGNORE INTO changes VALUES (?, ?, ?, ?)',
+                ((path, generation, commit_time, sha) for path in paths)
+            )
+            self._connection.execute(
+                'INSERT OR IGNORE INTO commits VALUES (?)', (sha, )
+            )
+
+    def history(self, path, max_count=None):
+        """Get the commits changing a path, the descendants first.
+
+            Args:
+                path (bytes): The path.
+                max_count (int): The maximum number of commits.
+            Returns:
+                (list(bytes)) The commits shas.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT sha FROM changes WHERE path = ?'
+                ' ORDER BY generation DESC, commit_time DESC LIMIT ?',
+                (path.strip(b'/'), -1 if max_count is None else max_count)
+            )
+
+            return [row[0] for row in rows]
+
+    def clear(self):
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM changes')
+            self._connection.execute('DELETE FROM commits')
+
+    def close(self):
+        self._connection.close()
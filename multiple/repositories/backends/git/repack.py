@@ -0,0 +1,468 @@
+import collections
+import functools
+import os
+import stat
+import threading
+import time
+
+import dulwich
+import dulwich.object_store
+import dulwich.objects
+import dulwich.pack
+
+from multiple import exceptions
+from multiple.repositories.backends import git as git_aws
+
+RepackStep = collections.namedtuple(
+    'RepackStep',
+    (
+        'pack',            # the new pack, None if no object was kept
+        'packs',           # the number of packs merged
+        'loose_objects',   # the number of loose objects packed
+        'pruned_objects',  # the number of unreachable objects dropped
+    )
+)
+
+
+def reachable_objects(object_store, roots):
+    """Get the shas of the objects reachable from some objects.
+
+        The commits, the trees and the tags are loaded, the blobs aren't.
+
+        Args:
+            object_store (dulwich.object_store.BaseObjectStore):
+                The object store where the objects are stored.
+            roots (Iterable[bytes]): The shas of the objects, e.g the
+                commits of the references.
+        Returns:
+            (set(bytes)) The shas of the objects.
+        Raises:
+            KeyError if a reachable object doesn't exists.
+    """
+    reachable = set()
+    pending = list(roots)
+
+    while pending:
+        sha = pending.pop()
+
+        if sha in reachable:
+            continue
+
+        reachable.add(sha)
+        obj = object_store[sha]
+
+        if isinstance(obj, dulwich.objects.Commit):
+            pending.append(obj.tree)
+            pending.extend(obj.parents)
+        elif isinstance(obj, dulwich.objects.Tree):
+            for entry in obj.iteritems():
+                # the submodules commits are in other repositories
+                if stat.S_ISDIR(entry.mode):
+                    pending.append(entry.sha)
+                elif not dulwich.objects.S_ISGITLINK(entry.mode):
+                    reachable.add(entry.sha)
+        elif isinstance(obj, dulwich.objects.Tag):
+            pending.append(obj.object[1])
+
+    return reachable
+
+
+class Budget(object):
+    """Throttle a task to a rate of bytes read and to a share of the cpu.
+
+    The task reports the bytes it reads, it's put to sleep as soon as it
+    goes faster than its budget since it started.
+    """
+
+    def __init__(self, io_rate=None, cpu_ratio=None):
+        """
+            Args:
+                io_rate (float): The maximum number of bytes read by second,
+                    unlimited by default.
+                cpu_ratio (float): The maximum share of the time spent on
+                    the cpu, between 0 and 1, unlimited by default.
+        """
+        if cpu_ratio is not None and not 0 < cpu_ratio <= 1:
+            raise ValueError('the cpu ratio must be between 0 and 1')
+
+        self.io_rate = io_rate
+        self.cpu_ratio = cpu_ratio
+
+        self.start()
+
+    def start(self):
+        self._started = time.monotonic()
+        self._cpu_started = time.process_time()
+        self._read = 0
+
+    def consume(self, size=0):
+        """Report bytes read and wait until the task is within its budget.
+
+            Args:
+                size (int): The number of bytes read.
+        """
+        self._read += size
+        elapsed = time.monotonic() - self._started
+        delay = 0
+
+        if self.io_rate:
+            delay = max(delay, self._read / self.io_rate - elapsed)
+
+        if self.cpu_ratio:
+            cpu_time = time.process_time() - self._cpu_started
+            delay = max(delay, cpu_time / self.cpu_ratio - elapsed)
+
+        if delay > 0:
+            time.sleep(delay)
+
+
+class Repacker(object):
+    """Merge the small packs and the loose objects of a pack based object
+    store into larger packs.
+
+    Each step merges the smallest packs and the loose objects, within a
+    size budget, into a new pack with recomputed deltas. The new pack is
+    added before the merged packs and objects are removed, the objects are
+    always readable. The packs of a s3 object store are retired, the
+    stores which listed them can still read them until the grace period is
+    over. The steps hold a lock, by default a lock file next to the packs
+    of a s3 object store, so only one repacker changes the packs.
+
+    With roots, the objects merged which aren't reachable from the roots
+    are dropped, unless they are younger than the prune expiry, like the
+    objects of an index not committed yet. The roots must hold all the
+    references.
+    """
+
+    SMALL_PACK_SIZE = 1024 * 1024 * 16
+    MAX_STEP_SIZE = 1024 * 1024 * 256
+    DELTA_WINDOW_SIZE = 10
+    GRACE_PERIOD = 60 * 60
+    PRUNE_EXPIRY = 60 * 60 * 24 * 14
+    LOCK_NAME = 'repack.lock'
+
+    def __init__(self, object_store, lock_backend=None,
+                 small_pack_size=SMALL_PACK_SIZE, max_step_size=MAX_STEP_SIZE,
+                 delta_window_size=DELTA_WINDOW_SIZE, budget=None,
+                 grace_period=GRACE_PERIOD, prune_expiry=PRUNE_EXPIRY):
+        """
+            Args:
+                object_store (dulwich.object_store.PackBasedObjectStore):
+                    The object store to repack.
+                lock_backend (git_aws.lock.LockBackendBase):
+                    The backend of the repack lock, by default a lock file
+                    next to the packs of the s3 and disk object stores and
+                    a lock in memory for the other object stores.
+                small_pack_size (int):
+                    The size under which a pack is merged.
+                max_step_size (int):
+                    The maximum size of the packs and loose objects merged
+                    by a step, it bounds the memory used by a step.
+                delta_window_size (int):
+                    The number of objects a delta base is searched among.
+                budget (Budget):
+                    The io and cpu budget of the steps, unlimited by
+                    default.
+                grace_period (float):
+                    The number of seconds a replaced pack of a s3 object
+                    store is kept for the stores which listed it.
+                prune_expiry (float):
+                    The age in seconds under which the unreachable objects
+                    are kept, by the modification time of their pack or
+                    loose object.
+        """
+        if lock_backend is None:
+            if isinstance(
+                object_store, git_aws.object_store.AwsS3ObjectStore
+            ):
+                lock_backend = git_aws.lock.AwsS3LockBackend(
+                    object_store._aws_bucket
+                )
+            elif isinstance(
+                object_store, dulwich.object_store.DiskObjectStore
+            ):
+                lock_backend = git_aws.lock.LocalFileLockBackend(
+                    os.path.join(object_store.path, 'info')
+                )
+            else:
+                lock_backend = git_aws.lock.MemoryLockBackend()
+
+        self.object_store = object_store
+        self.lock_backend = lock_backend
+        self.small_pack_size = small_pack_size
+        self.max_step_size = max_step_size
+        self.delta_window_size = delta_window_size
+        self.budget = budget or Budget()
+        self.grace_period = grace_period
+        self.prune_expiry = prune_expiry
+
+        path = getattr(object_store, 'path', None)
+        self.lock_name = '/'.join(p for p in (path, self.LOCK_NAME) if p)
+
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def _select(self):
+        """Select the packs and the loose objects of the next step.
+
+            The loose objects are candidates, they are merged within the
+            size left by the packs, see `_iter_objects`.
+
+            Returns:
+                (tuple(list, list)) The packs, the smallest first, and the
+                shas of the loose objects.
+        """
+        self.object_store._update_pack_cache()
+
+        packs = {
+            pack._basename: pack for pack in self.object_store.packs
+        }
+        sizes = sorted(
+            (pack.data._get_size(), basename)
+            for basename, pack in packs.items()
+        )
+
+        selected = []
+        step_size = 0
+
+        for size, basename in sizes:
+            if size > self.small_pack_size \
+                    or step_size + size > self.max_step_size:
+                break
+
+            selected.append(packs[basename])
+            step_size += size
+
+        return selected, list(self.object_store._iter_loose_objects())
+
+    def repack(self, roots=None):
+        """Run a single step.
+
+            Args:
+                roots (Iterable[bytes]): The shas of the objects to keep
+                    with the objects reachable from them, by default all
+                    the objects are kept.
+            Returns:
+                (RepackStep) The step or None if there was nothing to
+                merge.
+            Raises:
+                multiple.exceptions.LockError if another repacker holds the
+                lock, or if the lock was lost before the merged packs were
+                replaced.
+        """
+        return self._repack(self._reachable(roots))
+
+    def _reachable(self, roots):
+        """Get a function computing once the objects reachable from some
+            roots, the steps of a run share it.
+
+            Returns:
+                (callable) The function or None to keep all the objects.
+        """
+        if roots is None:
+            return None
+
+        roots = list(roots)
+
+        return functools.lru_cache(maxsize=None)(
+            lambda: reachable_objects(self.object_store, roots)
+        )
+
+    def _repack(self, get_reachable):
+        with self.lock_backend.acquire(self.lock_name) as lock:
+            delete_retired_packs = getattr(
+                self.object_store, 'delete_retired_packs', None
+            )
+
+            if delete_retired_packs is not None:
+                delete_retired_packs(self.grace_period)
+
+            packs, loose = self._select()
+
+            if len(packs) + len(loose) < 2 and get_reachable is None:
+                return None
+
+            if not packs and not loose:
+                return None
+
+            reachable = None
+            if get_reachable is not None:
+                reachable = get_reachable()
+
+            self.budget.start()
+            objects = []
+            merged_loose = []
+            pruned = 0
+            expiry = time.time() - self.prune_expiry
+            mtimes = {}
+
+            for obj, path in self._iter_objects(
+                packs, loose, merged_loose, lock
+            ):
+                if path not in mtimes and reachable is not None \
+                        and obj.id not in reachable:
+                    mtimes[path] = self._mtime(path)
+
+                if reachable is None or obj.id in reachable \
+                        or mtimes[path] > expiry:
+                    objects.append((obj, None))
+                else:
+                    pruned += 1
+
+            if len(packs) == 1 and not merged_loose and not pruned:
+                return None
+
+            pack = self._add_pack(objects)
+            # the deltification and the upload may outlast the lease, the
+            # packs are only replaced by the owner of the lock
+            lock.renew()
+
+            new_basename = getattr(pack, '_basename', None)
+            remove_pack = getattr(
+                self.object_store, 'retire_pack',
+                self.object_store._remove_pack
+            )
+
+            for old_pack in packs:
+                if old_pack._basename != new_basename:
+                    remove_pack(old_pack)
+
+            for sha in merged_loose:
+                self.object_store._remove_loose_object(sha)
+
+            if getattr(self.object_store, 'multi_pack_index', False):
+                self.object_store.write_multi_pack_index()
+
+        return RepackStep(pack, len(packs), len(merged_loose), pruned)
+
+    def _iter_objects(self, packs, loose, merged_loose, lock):
+        """Iterate over the objects of a step.
+
+            The loose objects are merged until the step is full, a step
+            merges at least two packs or objects so the steps progress.
+
+            Args:
+                merged_loose (list): Filled with the shas of the loose
+                    objects merged.
+            Returns:
+                (Iterable[tuple(dulwich.objects.ShaFile, str)]) The objects
+                and the path of their pack or loose object file.
+        """
+        step_size = 0
+
+        for pack in packs:
+            for obj in pack.iterobjects():
+                yield obj, pack._data_path
+
+            step_size += pack.data._get_size()
+            self.budget.consume(pack.data._get_size())
+            lock.renew_if_needed()
+
+        for sha in loose:
+            obj = self.object_store._get_loose_object(sha)
+            size = obj.raw_length()
+
+            if step_size + size > self.max_step_size \
+                    and len(packs) + len(merged_loose) > 1:
+                break
+
+            merged_loose.append(sha)
+            step_size += size
+            yield obj, self._loose_path(sha)
+
+            self.budget.consume(size)
+            lock.renew_if_needed()
+
+    def _loose_path(self, sha):
+        get_shafile_key = getattr(self.object_store, '_get_shafile_key', None)
+
+        if get_shafile_key is not None:
+            return get_shafile_key(sha)
+
+        return self.object_store._get_shafile_path(sha)
+
+    def _mtime(self, path):
+        """Get the modification time of a pack or a loose object file."""
+        if isinstance(
+            self.object_store, git_aws.object_store.AwsS3ObjectStore
+        ):
+            return self.object_store._aws_bucket.Object(path) \
+                .last_modified.timestamp()
+
+        return os.path.getmtime(path)
+
+    def _add_pack(self, objects):
+        """Add the objects as a new pack, deltified.
+
+            Returns:
+                The new pack, None if there is no object.
+        """
+        if not objects:
+            return None
+
+        f, commit, abort = self.object_store.add_pack()
+
+        try:
+            dulwich.pack.write_pack_objects(
+                f.write, objects, delta_window_size=self.delta_window_size,
+                deltify=True
+            )
+        except BaseException:
+            abort()
+            raise
+
+        return commit()
+
+    def run(self, roots=None):
+        """Run the steps until there is nothing left to merge.
+
+            Args:
+                roots (Iterable[bytes]): The shas of the objects to keep,
+                    see `repack`.
+            Returns:
+                (list(RepackStep)) The steps.
+        """
+        steps = []
+        get_reachable = self._reachable(roots)
+
+        while not self._stopped.is_set():
+            step = self._repack(get_reachable)
+
+            if step is None:
+                break
+
+            steps.append(step)
+
+        return steps
+
+    def start(self, interval=60, get_roots=None):
+        """Run the steps in a background thread.
+
+            Args:
+                interval (float): The number of seconds between two runs.
+                get_roots (callable): Get the shas of the objects to keep at
+                    each run, by default all the objects are kept.
+        """
+        self._stopped.clear()
+
+        def run():
+            while not self._stopped.is_set():
+                try:
+                    self.run(None if get_roots is None else get_roots())
+                except exceptions.LockError:
+                    pass
+
+                self._stopped.wait(interval)
+
+        self._thread = threading.Thread(
+            target=run, name='multiple-repack', daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background thread once its current step is done."""
+        self._stopped.set()
+
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,835 @@
+import collections
+import concurrent.futures
+import hashlib
+import io
+import os
+import tempfile
+import zlib
+
+import dulwich
+import dulwich.errors
+import dulwich.file
+import dulwich.object_store
+import dulwich.objects
+import dulwich.pack
+
+CHUNK_SIZE = 1024 * 1024
+MAX_WORKERS = 16
+
+
+def iter_chunks(stream, chunk_size=CHUNK_SIZE):
+    """Read a stream chunk by chunk until its end.
+
+        Args:
+            stream (IO): The stream to read.
+            chunk_size (int): The maximum size of a chunk.
+        Returns:
+            (Iterable[bytes]) The chunks.
+    """
+    while True:
+        chunk = stream.read(chunk_size)
+
+        if not chunk:
+            break
+
+        yield chunk
+
+
+def sized_stream(stream, chunk_size=CHUNK_SIZE):
+    """Get a seekable stream and the length of its remaining content.
+
+        When the stream isn't seekable the content is spooled in a temporary
+        file, kept in memory only while it's smaller than the chunk size.
+
+        Args:
+            stream (IO): The stream.
+            chunk_size (int): The size of the chunks to copy the content.
+        Returns:
+            (tuple(IO, int)) The seekable stream, positioned at the start of
+            the content, and the length of the content.
+    """
+    seekable = getattr(stream, 'seekable', None)
+
+    if seekable is not None and seekable():
+        start = stream.tell()
+        length = stream.seek(0, os.SEEK_END) - start
+        stream.seek(start)
+
+        return stream, length
+
+    spool = tempfile.SpooledTemporaryFile(max_size=chunk_size)
+    length = 0
+
+    for chunk in iter_chunks(stream, chunk_size):
+        length += spool.write(chunk)
+
+    spool.seek(0)
+
+    return spool, length
+
+
+def write_loose_object(f, type_num, length, chunks):
+    """Write an object in the loose format, compressing it chunk by chunk.
+
+        Args:
+            f (IO): The file where to write the object.
+            type_num (int): The object type number.
+            length (int): The length of the object content.
+            chunks (Iterable[bytes]): The content of the object.
+        Raises:
+            ValueError if the content length isn't the length given, the
+            object would be stored under a sha which isn't its own.
+    """
+    compressor = zlib.compressobj()
+    written = 0
+
+    f.write(compressor.compress(dulwich.objects.object_header(
+        type_num, length
+    )))
+
+    for chunk in chunks:
+        written += len(chunk)
+        f.write(compressor.compress(chunk))
+
+    if written != length:
+        raise ValueError(
+            'object content of %d bytes instead of %d' % (written, length)
+        )
+
+    f.write(compressor.flush())
+
+
+def add_blob_stream(object_store, stream, chunk_size=CHUNK_SIZE):
+    """Add the content of a stream as a blob in an object store.
+
+        The git object header and the content are hashed chunk by chunk and
+        the object is written chunk by chunk too, the peak memory is bounded
+        by the chunk size whatever the content size.
+
+        Object stores that can store an object from a stream must implement
+        `add_object_stream(sha, type_num, length, chunks)`, the loose objects
+        of a `dulwich.object_store.DiskObjectStore` are written directly. As
+        a last resort the blob is created in memory.
+
+        Args:
+            object_store (dulwich.object_store.BaseObjectStore):
+                The object store where to add the blob.
+            stream (IO): The content of the blob.
+            chunk_size (int): The maximum size of the chunks read from the
+                stream.
+        Returns:
+            (bytes) The blob sha.
+    """
+    stream, length = sized_stream(stream, chunk_size)
+    start = stream.tell()
+
+    sha1 = hashlib.sha1(dulwich.objects.object_header(
+        dulwich.objects.Blob.type_num, length
+    ))
+
+    for chunk in iter_chunks(stream, chunk_size):
+        sha1.update(chunk)
+
+    sha = sha1.hexdigest().encode('ascii')
+
+    if sha in object_store:
+        return sha
+
+    stream.seek(start)
+    chunks = iter_chunks(stream, chunk_size)
+
+    add_object_stream = getattr(object_store, 'add_object_stream', None)
+
+    if add_object_stream is not None:
+        add_object_stream(sha, dulwich.objects.Blob.type_num, length, chunks)
+    elif isinstance(object_store, dulwich.object_store.DiskObjectStore):
+        path = dulwich.objects.hex_to_filename(object_store.path, sha)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with dulwich.file.GitFile(path, 'wb') as f:
+            write_loose_object(
+                f, dulwich.objects.Blob.type_num, length, chunks
+            )
+    else:
+        object_store.add_object(
+            dulwich.objects.Blob.from_string(b''.join(chunks))
+        )
+
+    return sha
+
+
+class ObjectReader(io.RawIOBase):
+    """Read-only stream on the content of a git object.
+
+        The content is decompressed on demand chunk by chunk, only the chunk
+        being read is kept in memory. Seeking forward skips the content,
+        seeking backward restarts the decompression from the beginning.
+    """
+
+    def __init__(self, open_chunks, length):
+        """
+            Args:
+                open_chunks (Callable[[], Iterable[bytes]]):
+                    Provide a new iterator on the content chunks, from the
+                    beginning of the content.
+                length (int):
+                    The length of the content.
+        """
+        super().__init__()
+
+        self._open_chunks = open_chunks
+        self._length = length
+
+        self._chunks = None
+        self._pending = memoryview(b'')
+        self._position = 0
+
+    @property
+    def length(self):
+        return self._length
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def readinto(self, b):
+        if self._chunks is None:
+            self._chunks = iter(self._open_chunks())
+
+        # fill the whole buffer unless the end of the content is reached,
+        # like a buffered stream would do
+        b = memoryview(b)
+        filled = 0
+
+        while filled < len(b):
+            if not self._pending:
+                try:
+                    self._pending = memoryview(next(self._chunks))
+                except StopIteration:
+                    break
+                continue
+
+            size = min(len(b) - filled, len(self._pending))
+            b[filled:filled + size] = self._pending[:size]
+
+            self._pending = self._pending[size:]
+            filled += size
+
+        self._position += filled
+
+        return filled
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self._length
+
+        if offset < 0:
+            raise ValueError('negative seek position %r' % offset)
+
+        if offset < self._position:
+            self._rewind()
+
+        remaining = offset - self._position
+
+        while remaining:
+            skipped = self.read(min(remaining, CHUNK_SIZE))
+
+            if not skipped:
+                break
+
+            remaining -= len(skipped)
+
+        return self._position
+
+    def _rewind(self):
+        if self._chunks is not None:
+            getattr(self._chunks, 'close', lambda: None)()
+
+        self._chunks = None
+        self._pending = memoryview(b'')
+        self._position = 0
+
+    def close(self):
+        self._rewind()
+        super().close()
+
+
+def inflate(read_compressed, chunk_size=CHUNK_SIZE):
+    """Decompress a zlib stream chunk by chunk.
+
+        Args:
+            read_compressed (Callable[[], bytes]):
+                Read the next compressed bytes, an empty result means the end
+                of the file.
+            chunk_size (int):
+                The maximum size of the decompressed chunks.
+        Returns:
+            (Iterable[bytes]) The decompressed chunks.
+    """
+    decompressor = zlib.decompressobj()
+
+    while not decompressor.eof:
+        data = decompressor.unconsumed_tail or read_compressed()
+
+        if not data:
+            raise zlib.error('truncated zlib stream')
+
+        chunk = decompressor.decompress(data, chunk_size)
+
+        if chunk:
+            yield chunk
+
+
+def _iter_loose_chunks(open_file, chunk_size):
+    """Iterate over the content of a loose object, without its header."""
+    with open_file() as f:
+        header = b''
+        chunks = inflate(lambda: f.read(chunk_size), chunk_size)
+
+        for chunk in chunks:
+            if header is not None:
+                header += chunk
+                if b'\0' not in header:
+                    continue
+                chunk = header[header.index(b'\0') + 1:]
+                header = None
+
+            if chunk:
+                yield chunk
+
+
+def _read_loose_header(open_file):
+    """Read the type number and the length of a loose object."""
+    with open_file() as f:
+        header = b''
+        decompressor = zlib.decompressobj()
+
+        while b'\0' not in header:
+            data = decompressor.unconsumed_tail or f.read(32)
+
+            if not data:
+                raise dulwich.errors.ObjectFormatException(
+                    'invalid loose object header'
+                )
+
+            header += decompressor.decompress(data, 32)
+
+    type_name, length = header[:header.index(b'\0')].split(b' ', 1)
+
+    return (
+        dulwich.objects.object_class(type_name).type_num,
+        int(length)
+    )
+
+
+def read_pack_object_header(f, offset):
+    """Read the header of an object in a pack data file.
+
+        Returns:
+            (tuple(int, int, int)) The type number, the length of the
+            content and the offset of the compressed content.
+    """
+    f.seek(offset)
+
+    byte = ord(f.read(1))
+    type_num = (byte >> 4) & 0x07
+    length = byte & 0x0f
+    shift = 4
+    offset += 1
+
+    while byte & 0x80:
+        byte = ord(f.read(1))
+        length |= (byte & 0x7f) << shift
+        shift += 7
+        offset += 1
+
+    return type_num, length, offset
+
+
+def _pack_file_opener(pack):
+    """Get a function opening a new file on the data of a pack.
+
+        The pack data reads its objects by seeking a single file, a reader
+        in another thread must use its own file: a copy of a s3 file, which
+        shares its caches, or the pack file opened again.
+
+        Returns:
+            (Callable[[], IO])
+    """
+    f = pack.data._file
+
+    if hasattr(f, 'copy'):
+        return f.copy
+
+    # the full path of the pack file
+    filename = pack.data._filename
+
+    return lambda: open(filename, 'rb')
+
+
+def _iter_pack_chunks(open_file, offset, chunk_size):
+    """Iterate over the content of a non deltified object in a pack."""
+    with open_file() as f:
+        f.seek(offset)
+
+        for chunk in inflate(lambda: f.read(chunk_size), chunk_size):
+            yield chunk
+
+
+def _get_raw_packed(pack, sha):
+    """Get the type number and the content of a deltified object of a pack
+        from another thread than the pack.
+
+        The pack data of a disk pack isn't thread safe, the object is
+        resolved from a pack data of its own.
+    """
+    if hasattr(pack.data._file, 'copy'):
+        return pack.get_raw(sha)
+
+    data = dulwich.pack.PackData(pack.data._filename)
+
+    try:
+        own_pack = dulwich.pack.Pack.from_objects(data, pack.index)
+        own_pack.resolve_ext_ref = pack.resolve_ext_ref
+
+        return own_pack.get_raw(sha)
+    finally:
+        data.close()
+
+
+def open_object_stream(object_store, sha, chunk_size=CHUNK_SIZE):
+    """Open a stream on the content of an object of an object store.
+
+        Loose objects and non deltified packed objects are decompressed on
+        demand. Deltified objects can't be resolved without their base, they
+        are loaded in memory, as are the objects of the object stores with
+        unknown storage.
+
+        Object stores storing the loose objects elsewhere than on the disk
+        must implement `open_loose_object(sha)`, returning a new binary
+        file on the compressed loose object or None if it's not loose.
+
+        Args:
+            object_store (dulwich.object_store.BaseObjectStore):
+                The object store where the object is stored.
+            sha (bytes): The object sha.
+            chunk_size (int): The maximum size of the decompressed chunks.
+        Returns:
+            (ObjectReader) The stream on the object content.
+        Raises:
+            KeyError if the object doesn't exists.
+    """
+    open_loose_object = getattr(object_store, 'open_loose_object', None)
+
+    if open_loose_object is None and isinstance(
+        object_store, dulwich.object_store.DiskObjectStore
+    ):
+        path = dulwich.objects.hex_to_filename(object_store.path, sha)
+
+        def open_loose_object(sha):
+            return open(path, 'rb') if os.path.exists(path) else None
+
+    # the packs are looked up first, checking a loose object may be a
+    # request while the pack indexes are cached
+    for pack in _candidate_packs(object_store, (sha, )):
+        try:
+            offset = pack.index.object_index(sha)
+        except KeyError:
+            continue
+
+        # the stream may be read from another thread than the pack, it gets
+        # its own files
+        open_file = _pack_file_opener(pack)
+
+        with open_file() as f:
+            type_num, length, offset = read_pack_object_header(f, offset)
+
+        if type_num not in dulwich.pack.DELTA_TYPES:
+            return ObjectReader(
+                lambda: _iter_pack_chunks(open_file, offset, chunk_size),
+                length
+            )
+
+        _, content = _get_raw_packed(pack, sha)
+
+        return ObjectReader(lambda: (content, ), len(content))
+
+    if open_loose_object is not None and object_store.contains_loose(sha):
+        def open_file():
+            return open_loose_object(sha)
+
+        _, length = _read_loose_header(open_file)
+
+        return ObjectReader(
+            lambda: _iter_loose_chunks(open_file, chunk_size), length
+        )
+
+    _, content = object_store.get_raw(sha)
+
+    return ObjectReader(lambda: (content, ), len(content))
+
+
+def _candidate_packs(object_store, shas):
+    """Get the packs which may hold some objects.
+
+        Object stores that can find the pack of an object without looking
+        up each pack index must implement `find_pack(sha)`, e.g with a
+        multi pack index.
+
+        Returns:
+            (Iterable[dulwich.pack.Pack])
+    """
+    find_pack = getattr(object_store, 'find_pack', None)
+
+    if find_pack is None:
+        return getattr(object_store, 'packs', ())
+
+    packs = collections.OrderedDict()
+
+    for sha in shas:
+        pack = find_pack(sha)
+
+        if pack is not None:
+            packs[pack._basename] = pack
+
+    return packs.values()
+
+
+def _batch_objects(object_store, shas, max_workers):
+    """Group the objects by pack, in batches sorted by offset.
+
+        Returns:
+            (list(tuple(Pack, list(tuple(int, bytes))))) The pack, None for
+            the objects not packed, and the offsets and shas of a batch.
+    """
+    remaining = set(shas)
+    batches = []
+
+    for pack in _candidate_packs(object_store, remaining):
+        offsets = []
+
+        for sha in remaining:
+            try:
+                offsets.append((pack.index.object_index(sha), sha))
+            except KeyError:
+                continue
+
+        if not offsets:
+            continue
+
+        remaining.difference_update(sha for _, sha in offsets)
+        offsets.sort()
+
+        # split the pack objects between the workers, the neighbour
+        # objects stay in the same batch
+        size = -(-len(offsets) // max_workers)
+        for start in range(0, len(offsets), size):
+            batches.append((pack, offsets[start:start + size]))
+
+    for sha in shas:
+        if sha in remaining:
+            batches.append((None, [(None, sha)]))
+
+    return batches
+
+
+def open_object_streams(object_store, shas, max_workers=MAX_WORKERS,
+                        chunk_size=CHUNK_SIZE):
+    """Open streams on the contents of many objects concurrently.
+
+        The packed objects are grouped by pack and sorted by offset, the
+        batches of objects are then opened by a bounded pool of threads.
+        Packs implementing `prefetch_objects(offsets)` fetch all the objects
+        of a batch up front, e.g. the neighbour objects of a s3 pack with a
+        single range request.
+        Packs implementing `resolve_objects(offsets)` resolve the
+        deltified objects of a batch together, see `load_objects`.
+
+        Args:
+            object_store (dulwich.object_store.BaseObjectStore):
+                The object store where the objects are stored.
+            shas (Iterable[bytes]): The objects shas.
+            max_workers (int): The maximum number of threads opening the
+                objects.
+            chunk_size (int): The maximum size of the decompressed chunks.
+        Returns:
+            (Iterable[tuple(bytes, ObjectReader)]) The shas and the streams
+            on their content, as they are opened.
+        Raises:
+            KeyError if an object doesn't exists.
+    """
+    shas = list(collections.OrderedDict.fromkeys(shas))
+
+    def open_batch(pack, offsets):
+        prefetch_objects = getattr(pack and pack.data, 'prefetch_objects',
+                                   None)
+
+        if prefetch_objects is not None:
+            prefetch_objects(offset for offset, _ in offsets)
+
+        contents = _resolve_deltas(pack, offsets)
+        streams = []
+
+        for offset, sha in offsets:
+            if offset in contents:
+                content = b''.join(contents[offset][1])
+                streams.append(
+                    (sha, ObjectReader(lambda c=content: (c, ), len(content)))
+                )
+            else:
+                streams.append(
+                    (sha, open_object_stream(object_store, sha, chunk_size))
+                )
+
+        return streams
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        futures = [
+            executor.submit(open_batch, pack, offsets)
+            for pack, offsets in _batch_objects(
+                object_store, shas, max_workers
+            )
+        ]
+
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                for result in future.result():
+                    yield result
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def _resolve_deltas(pack, offsets):
+    """Resolve the deltified objects of a batch of a pack.
+
+        Returns:
+            (dict(int, tuple(int, list(bytes)))) The type number and the
+            content chunks of the deltified objects by offset, empty if the
+            pack can't resolve many objects at once.
+    """
+    if getattr(pack, 'resolve_objects', None) is None:
+        return {}
+
+    f = pack.data._file
+    delta_offsets = [
+        offset for offset, _ in offsets
+        if read_pack_object_header(f, offset)[0] in dulwich.pack.DELTA_TYPES
+    ]
+
+    if not delta_offsets:
+        return {}
+
+    return pack.resolve_objects(delta_offsets)
+
+
+def load_objects(object_store, shas, max_workers=MAX_WORKERS):
+    """Load many objects in memory.
+
+        The packed objects are grouped by pack and sorted by offset. Packs
+        implementing `resolve_objects(offsets, executor)` read the objects
+        of a pack together, the contiguous objects and their delta bases
+        are fetched at once and resolved by a bounded pool of threads, see
+        `pack.AwsS3Pack.resolve_objects`. The other objects are loaded one
+        by one.
+
+        Args:
+            object_store (dulwich.object_store.BaseObjectStore):
+                The object store where the objects are stored.
+            shas (Iterable[bytes]): The objects shas.
+            max_workers (int): The maximum number of threads resolving the
+                objects.
+        Returns:
+            (Iterable[dulwich.objects.ShaFile]) The objects, as they are
+            loaded.
+        Raises:
+            KeyError if an object doesn't exists.
+    """
+    shas = list(collections.OrderedDict.fromkeys(shas))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        # a single batch by pack, the pool resolves the objects of a batch
+        for pack, offsets in _batch_objects(object_store, shas, 1):
+            if getattr(pack, 'resolve_objects', None) is None:
+                for _, sha in offsets:
+                    yield object_store[sha]
+
+                continue
+
+            resolved = pack.resolve_objects(
+                (offset for offset, _ in offsets), executor
+            )
+
+            for offset, sha in offsets:
+                type_num, chunks = resolved[offset]
+
+                yield dulwich.objects.ShaFile.from_raw_chunks(
+                    type_num, chunks, sha=sha
+                )
+
+
+class PackWriter(object):
+    """Collect new objects to add them to an object store as a single pack.
+
+    The objects are compressed in a temporary file as they are added, the
+    content of the blobs added from a stream is never held in memory. On
+    commit the pack is written with the `add_pack` of the object store, an
+    s3 object store uploads the pack and its index, the cost of a commit
+    doesn't depend on its number of objects.
+
+    The objects added are readable from the writer until the commit, the
+    other objects are read from the object store.
+
+    Note:
+        The objects aren't deltified against the objects of the object
+        store, a pack must hold the bases of its deltas.
+    """
+
+    def __init__(self, object_store):
+        """
+            Args:
+                object_store (dulwich.object_store.BaseObjectStore):
+                    The object store where to add the pack.
+        """
+        self.object_store = object_store
+
+        self._file = tempfile.TemporaryFile()
+        # offset of each object added in the temporary file
+        self._offsets = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __contains__(self, sha):
+        return sha in self._offsets or sha in self.object_store
+
+    def __getitem__(self, sha):
+        if sha not in self._offsets:
+            return self.object_store[sha]
+
+        type_num, content = self.get_raw(sha)
+
+        return dulwich.objects.ShaFile.from_raw_string(
+            type_num, content, sha=sha
+        )
+
+    def get_raw(self, sha):
+        """Get the type number and the content of an object.
+
+            Returns:
+                (tuple(int, bytes))
+        """
+        try:
+            offset = self._offsets[sha]
+        except KeyError:
+            return self.object_store.get_raw(sha)
+
+        type_num, _, offset = read_pack_object_header(self._file, offset)
+
+        return type_num, b''.join(
+            inflate(lambda: self._file.read(CHUNK_SIZE), CHUNK_SIZE)
+        )
+
+    def _start_object(self, sha):
+        """Get the offset of a new object, None if the object exists."""
+        if sha in self:
+            return None
+
+        self._file.seek(0, io.SEEK_END)
+
+        return self._file.tell()
+
+    def add_object(self, obj):
+        """Add a single object to the pack.
+
+            Args:
+                obj (dulwich.objects.ShaFile): The object to add.
+        """
+        offset = self._start_object(obj.id)
+
+        if offset is None:
+            return
+
+        for chunk in dulwich.pack.pack_object_chunks(
+            obj.type_num, obj.as_raw_chunks()
+        ):
+            self._file.write(chunk)
+
+        self._offsets[obj.id] = offset
+
+    def add_object_stream(self, sha, type_num, length, chunks):
+        """Add a single object to the pack from its content chunks.
+
+            Args:
+                sha (bytes): The object sha.
+                type_num (int): The object type number.
+                length (int): The length of the object content.
+                chunks (Iterable[bytes]): The object content.
+        """
+        offset = self._start_object(sha)
+
+        if offset is None:
+            return
+
+        self._file.write(dulwich.pack.pack_object_header(
+            type_num, None, length
+        ))
+        compressor = zlib.compressobj()
+
+        for chunk in chunks:
+            self._file.write(compressor.compress(chunk))
+
+        self._file.write(compressor.flush())
+        self._offsets[sha] = offset
+
+    def commit(self):
+        """Add the objects to the object store as a single pack.
+
+            The writer is emptied and can collect the next objects.
+
+            Returns:
+                The pack added or None if there is no object.
+        """
+        if not self._offsets:
+            return None
+
+        f, commit, abort = self.object_store.add_pack()
+
+        try:
+            sha1 = hashlib.sha1()
+
+            def write(data):
+                f.write(data)
+                sha1.update(data)
+
+            dulwich.pack.write_pack_header(write, len(self._offsets))
+            self._file.seek(0)
+
+            for chunk in iter_chunks(self._file):
+                write(chunk)
+
+            f.write(sha1.digest())
+        except BaseException:
+            abort()
+            raise
+
+        pack = commit()
+        self.abort()
+
+        return pack
+
+    def abort(self):
+        """Drop the objects added since the last commit."""
+        self._file.close()
+        self._file = tempfile.TemporaryFile()
+        self._offsets.clear()
+
+    def close(self):
+        self._file.close()
@@ -55,18 +55,41 @@ class RepositoryBase(object):
         """
         raise NotImplementedError
 
-    def walk(**kwargs):
+    def walk(self, reference, paths=None, max_count=None, since=None,
+             until=None):
         """
-            Walk accross the references
+            Walk accross the references, from the newest to the oldest
 
             Args:
-                @todo
+                reference (str): The reference where to start the walk.
+                paths (Iterable[str]): Only walk the references changing one
+                    of the paths.
+                max_count (int): The maximum number of references.
+                since (time.struct_time): Stop at the references older than
+                    the time.
+                until (time.struct_time): Skip the references newer than the
+                    time.
 
             Returns:
                 (Iterable[str]) The references as string
         """
         raise NotImplementedError
 
+    def diff(self, reference, other_reference, paths=None):
+        """
+            Compare the contents of two references
+
+            Args:
+                reference (str): The reference of the old contents.
+                other_reference (str): The reference of the new contents.
+                paths (Iterable[str]): Only compare the contents under the
+                    paths.
+
+            Returns:
+                (Iterable) The contents added, removed and modified
+        """
+        raise NotImplementedError
+
 
 class IndexBase(object):
     """
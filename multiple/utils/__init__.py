@@ -0,0 +1,7 @@
+from multiple.utils import (
+    paths,
+)
+
+__all__ = [
+    'paths',
+]
@@ -24,6 +24,12 @@ setuptools.setup(
         'fastimport>=0.9.5',
     ],
     extras_require={
+        'postgres': ['psycopg2'],
         'test': []
     },
+    entry_points={
+        'console_scripts': [
+            'multiple-git=multiple.repositories.backends.git.cli:main',
+        ],
+    },
 )
@@ -0,0 +1,128 @@
+import os
+import uuid
+
+import pytest
+
+from multiple import caches
+
+
+@pytest.fixture(params=('disk', 'sqlite', 'postgres'))
+def cache(request, tmpdir):
+    """Provide a cache of 10 bytes.
+
+        Note:
+            The postgres cache is tested only when the environment variable
+            MULTIPLE_TEST_POSTGRES_DSN is set, e.g
+            `postgresql://postgres@localhost/multiple_test`.
+    """
+    if request.param == 'disk':
+        yield caches.disk.DiskCache(str(tmpdir), max_size=10)
+    elif request.param == 'sqlite':
+        yield caches.sql.SqliteCache(max_size=10, access_granularity=0)
+    else:
+        pytest.importorskip('psycopg2')
+
+        try:
+            dsn = os.environ['MULTIPLE_TEST_POSTGRES_DSN']
+        except KeyError:
+            pytest.skip('MULTIPLE_TEST_POSTGRES_DSN is not set')
+
+        cache = caches.sql.PostgresCache(
+            dsn, table='multiple_test_{0}'.format(uuid.uuid4().hex),
+            max_size=10, access_granularity=0
+        )
+        yield cache
+
+        with cache._transaction() as cursor:
+            cursor.execute(cache._sql('DROP TABLE {table}'))
+            cursor.execute(cache._sql('DROP TABLE {table}_size'))
+        cache.close()
+
+
+def test_get_and_set(cache):
+    """Test that the values are cached by key"""
+    assert cache.get('a') is None
+    assert cache.get('a', b'') == b''
+
+    cache['a'] = b'aaaa'
+    cache['a'] = b'aa'
+
+    assert cache['a'] == b'aa'
+    assert 'a' in cache
+    assert cache.size == 2
+
+    with pytest.raises(KeyError):
+        cache['b']
+
+
+def test_eviction(cache):
+    """Test that the least recently used entries are evicted"""
+    cache['a'] = b'aaaa'
+    cache['b'] = b'bbbb'
+    assert cache.get('a') == b'aaaa'
+
+    cache['c'] = b'cccc'
+
+    assert 'a' in cache
+    assert 'b' not in cache
+    assert 'c' in cache
+    assert cache.size == 8
+
+
+def test_delete_and_clear(cache):
+    """Test that the entries are removed"""
+    cache['a'] = b'aaaa'
+    cache['b'] = b'bbbb'
+
+    del cache['a']
+    assert 'a' not in cache
+    assert cache.size == 4
+
+    cache.clear()
+    assert 'b' not in cache
+    assert cache.size == 0
+
+
+def test_sql_access_granularity():
+    """Test that a read only updates an access time older than the
+       granularity.
+    """
+    cache = caches.sql.SqliteCache(max_size=10, access_granularity=60)
+    cache['a'] = b'aaaa'
+    changes = cache._connection.total_changes
+
+    assert cache['a'] == b'aaaa'
+    assert cache._connection.total_changes == changes
+
+    with cache._transaction() as cursor:
+        cursor.execute(cache._sql('UPDATE {table} SET accessed_at = 0'))
+
+    changes = cache._connection.total_changes
+
+    assert cache['a'] == b'aaaa'
+    assert cache._connection.total_changes == changes + 1
+
+
+def test_memory_stats():
+    """Test that the memory cache counts its hits, misses and evictions."""
+    cache = caches.memory.LRUSizeCache(
+        10, after_cleanup_size=10, compute_size=len
+    )
+
+    cache.add('a', b'12345')
+    cache.add('b', b'12345')
+
+    assert cache.get('a') == b'12345'
+    assert cache.get('c') is None
+
+    cache.add('c', b'12345')
+
+    assert 'b' not in cache
+    assert cache.stats == caches.memory.CacheStats(
+        hits=1, misses=1, evictions=1, size=10, max_size=10
+    )
+
+    cache.clear()
+    cache.reset_stats()
+
+    assert cache.stats == caches.memory.CacheStats(0, 0, 0, 0, 10)
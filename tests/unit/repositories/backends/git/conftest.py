@@ -1,9 +1,17 @@
 import boto3
+import dulwich.objects
+import dulwich.pack
 import os
 import placebo
+import random
 import pytest
 import uuid
 
+try:
+    import moto
+except ImportError:  # pragma: no cover
+    moto = None
+
 
 @pytest.fixture()
 def unique_filename():
@@ -17,16 +25,23 @@ def aws_s3_bucket(aws_session):
         Note:
             This method require to have set the environment variable:
                 - MULTIPLE_TEST_AWS_S3_BUCKET : The name of the bucket to use
-                    for the tests.
+                    for the tests, when the aws mock is used it defaults to
+                    'multiple-test'.
     """
     try:
         bucket_name = os.environ['MULTIPLE_TEST_AWS_S3_BUCKET']
     except KeyError:
-        raise ValueError("MULTIPLE_TEST_AWS_S3_BUCKET isn't set")
+        if not aws_mock_enabled():
+            raise ValueError("MULTIPLE_TEST_AWS_S3_BUCKET isn't set")
+
+        bucket_name = 'multiple-test'
 
     s3 = aws_session.resource('s3')
     bucket = s3.Bucket(bucket_name)
 
+    if aws_mock_enabled():
+        bucket.create()
+
     bucket.objects.delete()
 
     return bucket
@@ -45,6 +60,17 @@ def aws_s3_file(aws_s3_bucket, unique_filename):
     }
 
 
+def aws_mock_enabled():
+    """Check if the aws services are mocked with moto.
+
+        Note:
+            The mock is enabled by setting the environment variable:
+                - MULTIPLE_TEST_AWS_MOCK : to 'moto', the placebo mode is then
+                    ignored.
+    """
+    return os.environ.get('MULTIPLE_TEST_AWS_MOCK') == 'moto'
+
+
 @pytest.fixture(scope='session')
 def aws_session():
     """Provide an aws session.
@@ -58,6 +84,15 @@ def aws_session():
                     either 'record', 'playback', or 'off', 'playback' is
                     thedefault. In 'off' mode placebo isn't used.
     """
+    if aws_mock_enabled():
+        if moto is None:
+            raise ValueError('moto is required to mock aws')
+
+        with moto.mock_aws():
+            yield boto3.Session(region_name='us-east-1')
+
+        return
+
     session = boto3.Session()
 
     mode = os.environ.get('MULTIPLE_TEST_PLACEBO_MODE', 'playback')
@@ -79,4 +114,33 @@ def aws_session():
         elif mode == 'playback':
             pill.playback()
 
-    return session
+    yield session
+
+
+@pytest.fixture()
+def aws_s3_pack(aws_s3_bucket, tmpdir, unique_filename):
+    """Provide a pack, with deltified objects, stored in the bucket."""
+    rng = random.Random(0)
+    contents = [
+        bytes(rng.getrandbits(8) for _ in range(4096)) for _ in range(10)
+    ]
+    # a new version of the last content, stored as a delta
+    contents.append(contents[-1] + b'new version')
+
+    blobs = [dulwich.objects.Blob.from_string(c) for c in contents]
+
+    local_basename = str(tmpdir.join('pack'))
+    dulwich.pack.write_pack(
+        local_basename, [(blob, None) for blob in blobs], deltify=True
+    )
+
+    basename = 'objects/pack/pack-{0}'.format(unique_filename)
+
+    for extension in ('.pack', '.idx'):
+        with open(local_basename + extension, 'rb') as f:
+            aws_s3_bucket.Object(basename + extension).put(Body=f.read())
+
+    return {
+        'basename': basename,
+        'blobs': blobs,
+    }
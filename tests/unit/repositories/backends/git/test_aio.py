@@ -0,0 +1,85 @@
+import asyncio
+import io
+
+import dulwich.repo
+import pytest
+
+from multiple.repositories.backends import git as git_aws
+from multiple.repositories.backends.git import main as git_main
+
+
+@pytest.fixture()
+def runner():
+    runner = git_aws.aio.Runner(max_concurrency=16)
+    yield runner
+    runner.shutdown()
+
+
+@pytest.fixture()
+def run():
+    loop = asyncio.new_event_loop()
+    yield loop.run_until_complete
+    loop.close()
+
+
+def test_file_write_and_read(run, runner, aws_s3_bucket, unique_filename):
+    """Test that a file can be written and read from a coroutine"""
+    async def write_and_read():
+        async with await git_aws.aio.AsyncAwsS3GitFile.open(
+            unique_filename, 'wb', 0, aws_s3_bucket, runner
+        ) as f:
+            await f.write(b'async content')
+
+        async with await git_aws.aio.AsyncAwsS3GitFile.open(
+            unique_filename, 'rb', 0, aws_s3_bucket, runner
+        ) as f:
+            return await f.read()
+
+    assert run(write_and_read()) == b'async content'
+
+
+def test_repository_roundtrip(run, runner):
+    """Test that contents committed by coroutines are read concurrently"""
+    repository = git_aws.aio.AsyncRepositoryGit(
+        git_main.RepositoryGit(dulwich.repo.MemoryRepo()), runner
+    )
+    paths = [b'/parts/%d.json' % n for n in range(20)]
+
+    async def commit_and_get():
+        index = await repository.open_index_at(None)
+        await index.add((io.BytesIO(path), path) for path in paths)
+        reference = await repository.commit(
+            index, message=b'test', author=b'test <test@wevolver.com>'
+        )
+
+        async def read(path):
+            content = await repository.get(path, reference)
+            return await content.read()
+
+        missing = await repository.get(b'/missing.json', reference, b'')
+
+        return missing, await asyncio.gather(*(read(p) for p in paths))
+
+    missing, contents = run(commit_and_get())
+
+    assert missing == b''
+    assert contents == paths
+
+
+def test_concurrent_pack_reads(run, runner, aws_s3_bucket, aws_s3_pack):
+    """Test that the objects of a s3 pack are read concurrently"""
+    object_store = git_aws.object_store.AwsS3ObjectStore(
+        aws_s3_bucket, block_size=1024
+    )
+    blobs = aws_s3_pack['blobs'] * 4
+
+    async def read(blob):
+        content = await git_aws.aio.open_object_stream(
+            object_store, blob.id, runner, chunk_size=512
+        )
+        return await content.read()
+
+    async def read_all():
+        return await asyncio.gather(*(read(blob) for blob in blobs))
+
+    assert run(read_all()) == [blob.data for blob in blobs]
@@ -0,0 +1,53 @@
+import io
+
+import dulwich.repo
+
+from multiple.repositories.backends import git as git_aws
+from multiple.repositories.backends.git import cli as git_cli
+from multiple.repositories.backends.git import main as git_main
+
+
+def test_rebuild_path_history(tmpdir):
+    """Test that the path history of a repository is rebuilt"""
+    backend = dulwich.repo.Repo.init_bare(str(tmpdir))
+    repository = git_main.RepositoryGit(
+        backend, path_history=git_aws.path_history.PathHistory()
+    )
+    references = [None]
+
+    for content in (b'v1', b'v2'):
+        index = repository.open_index_at(references[-1])
+        index.add(((io.BytesIO(content), b'/parts/motor.json'), ))
+        references.append(repository.commit(
+            index, message=b'test', author=b'test <test@wevolver.com>'
+        ))
+
+    assert git_cli.main(['rebuild-path-history', str(tmpdir)]) == 0
+
+    repository = git_main.RepositoryGit(backend)
+    assert repository.path_history.path == str(
+        tmpdir.join('objects', 'info', 'path-history')
+    )
+    assert repository.path_history.history(b'/parts/motor.json') \
+        == references[:0:-1]
+
+
+def test_repack(tmpdir):
+    """Test that the packs of a local repository are merged"""
+    backend = dulwich.repo.Repo.init_bare(str(tmpdir))
+    repository = git_main.RepositoryGit(backend)
+    reference = None
+
+    for content in (b'v1', b'v2'):
+        index = repository.open_index_at(reference, pack=True)
+        index.add(((io.BytesIO(content), b'/parts/motor.json'), ))
+        reference = repository.commit(
+            index, message=b'test', author=b'test <test@wevolver.com>'
+        )
+
+    assert len(tmpdir.join('objects', 'pack').listdir('*.pack')) == 2
+    assert git_cli.main(['repack', str(tmpdir)]) == 0
+    assert len(tmpdir.join('objects', 'pack').listdir('*.pack')) == 1
+
+    repository = git_main.RepositoryGit(dulwich.repo.Repo(str(tmpdir)))
+    assert repository.get(b'/parts/motor.json', reference).read() == b'v2'
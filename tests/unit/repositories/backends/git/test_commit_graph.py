@@ -0,0 +1,110 @@
+import mmap
+
+import pytest
+
+from multiple.repositories.backends import git as git_aws
+
+
+def sha(name):
+    return name.encode('ascii').hex().ljust(40, '0').encode('ascii')
+
+
+TREE = sha('tree')
+
+
+def add_history(graph):
+    """Add a history with a merge and an octopus merge.
+
+            a - b - c - m - o
+                 \\ d /    /
+                  \\ e ---/
+                   \\ f -/
+    """
+    for name, time, parents in (
+        ('a', 1, ()), ('b', 2, ('a', )), ('c', 3, ('b', )),
+        ('d', 4, ('b', )), ('m', 5, ('c', 'd')), ('e', 6, ('b', )),
+        ('f', 7, ('b', )), ('o', 8, ('m', 'e', 'f')),
+    ):
+        graph.add(sha(name), TREE, time, [sha(p) for p in parents])
+
+
+@pytest.fixture(params=('memory', 'file'))
+def graph(request, tmpdir):
+    if request.param == 'memory':
+        return git_aws.commit_graph.CommitGraph()
+
+    return git_aws.commit_graph.CommitGraph(
+        str(tmpdir.join('info', 'commit-graph'))
+    )
+
+
+def test_entries(graph):
+    """Test that the entries hold the commits with their generation"""
+    add_history(graph)
+
+    assert len(graph) == 8
+    assert graph[sha('a')] == (sha('a'), TREE, 1, 1, [])
+    assert graph[sha('m')].parents == [sha('c'), sha('d')]
+    assert graph[sha('m')].generation == 4
+    assert graph[sha('o')].parents == [sha('m'), sha('e'), sha('f')]
+    assert graph[sha('o')].generation == 5
+    assert graph.get(sha('z')) is None
+
+    with pytest.raises(KeyError):
+        graph.add(sha('z'), TREE, 9, [sha('y')])
+
+
+def test_ancestry(graph):
+    """Test the ancestry queries"""
+    add_history(graph)
+
+    assert graph.is_ancestor(sha('a'), sha('o'))
+    assert graph.is_ancestor(sha('d'), sha('m'))
+    assert graph.is_ancestor(sha('m'), sha('m'))
+    assert not graph.is_ancestor(sha('e'), sha('m'))
+    assert not graph.is_ancestor(sha('o'), sha('a'))
+
+    assert graph.merge_bases(sha('c'), sha('d')) == [sha('b')]
+    assert graph.merge_bases(sha('m'), sha('e')) == [sha('b')]
+    assert graph.merge_bases(sha('o'), sha('d')) == [sha('d')]
+    assert graph.merge_bases(sha('a'), sha('a')) == [sha('a')]
+
+
+def test_file_is_shared(tmpdir):
+    """Test that the commits appended by a graph are seen by the others"""
+    path = str(tmpdir.join('commit-graph'))
+    graph = git_aws.commit_graph.CommitGraph(path)
+    other_graph = git_aws.commit_graph.CommitGraph(path)
+
+    add_history(graph)
+
+    assert isinstance(other_graph._records, bytes)
+    assert other_graph[sha('o')] == graph[sha('o')]
+    assert isinstance(other_graph._records, mmap.mmap)
+
+    reopened_graph = git_aws.commit_graph.CommitGraph(path)
+    assert len(reopened_graph) == 8
+    assert reopened_graph.is_ancestor(sha('f'), sha('o'))
+
+
+def test_lookup(graph, monkeypatch):
+    """Test that the records are found in the lookup once it's written and
+       that only the records appended since are indexed in memory.
+    """
+    monkeypatch.setattr(
+        git_aws.commit_graph.CommitGraph, 'LOOKUP_THRESHOLD', 3
+    )
+    add_history(graph)
+
+    assert len(graph._positions) == 2
+    assert graph._lookup_count == 6
+    assert graph[sha('c')].parents == [sha('b')]
+    assert graph[sha('o')].parents == [sha('m'), sha('e'), sha('f')]
+    assert sha('z') not in graph
+
+    if graph.path is not None:
+        other_graph = git_aws.commit_graph.CommitGraph(graph.path)
+
+        assert other_graph._lookup_count == 6
+        assert len(other_graph._positions) == 2
+        assert other_graph.merge_bases(sha('o'), sha('d')) == [sha('d')]
@@ -1,3 +1,4 @@
+import botocore
 import pytest
 import uuid
 
@@ -108,3 +109,121 @@ def test_invalid_mode(aws_s3_bucket, mode, expected_message):
         git_aws.file.AwsS3GitFile(filename, mode, 0, aws_s3_bucket)
 
     assert expected_message in str(excinfo.value)
+
+
+MB = 1024 * 1024
+
+
+def test_invalid_part_size(aws_s3_bucket, unique_filename):
+    """Test that a part size lower than the s3 minimum is refused"""
+    with pytest.raises(ValueError):
+        git_aws.file.AwsS3GitFile(
+            unique_filename, 'wb', 0, aws_s3_bucket, part_size=MB
+        )
+
+
+def test_wb_multipart_upload(aws_s3_bucket, unique_filename):
+    """Test that a large content is uploaded part by part and the parts
+       failing are retried.
+    """
+    content = b''.join(bytes([n]) * MB for n in range(12))
+    client = aws_s3_bucket.meta.client
+    upload_part = client.upload_part
+    failures = []
+
+    def flaky_upload_part(**kwargs):
+        if kwargs['PartNumber'] == 2 and not failures:
+            failures.append(kwargs['PartNumber'])
+            raise botocore.exceptions.EndpointConnectionError(
+                endpoint_url='s3'
+            )
+
+        return upload_part(**kwargs)
+
+    client.upload_part = flaky_upload_part
+
+    try:
+        with git_aws.file.AwsS3GitFile(
+            unique_filename, 'wb', 0, aws_s3_bucket,
+            multipart_threshold=5 * MB, part_size=5 * MB
+        ) as git_file:
+            for offset in range(0, len(content), MB):
+                git_file.write(content[offset:offset + MB])
+
+            assert git_file._upload_id is not None
+            assert git_file.tell() == len(content)
+            assert len(git_file._uploaded_parts) == 2
+    finally:
+        del client.upload_part
+
+    assert failures == [2]
+
+    with git_aws.file.AwsS3GitFile(unique_filename, 'rb', 0, aws_s3_bucket) as git_file:  # noqa
+        assert git_file.read() == content
+
+
+def test_wb_multipart_abort(aws_s3_bucket, unique_filename):
+    """Test that an aborted multipart upload doesn't create the file"""
+    git_file = git_aws.file.AwsS3GitFile(
+        unique_filename, 'wb', 0, aws_s3_bucket,
+        multipart_threshold=5 * MB, part_size=5 * MB
+    )
+    git_file.write(b'0' * 6 * MB)
+    git_file.abort()
+
+    uploads = aws_s3_bucket.meta.client.list_multipart_uploads(
+        Bucket=aws_s3_bucket.name
+    )
+
+    assert not uploads.get('Uploads')
+
+    with pytest.raises(IOError):
+        git_aws.file.AwsS3GitFile(unique_filename, 'rb', 0, aws_s3_bucket)
+
+
+@pytest.mark.parametrize('size', (MB, 6 * MB))
+def test_wb_failed_block_not_published(aws_s3_bucket, unique_filename, size):
+    """Test that a file written by a with block which raises isn't
+       published and that its lock is released.
+    """
+    with pytest.raises(RuntimeError):
+        with git_aws.file.AwsS3GitFile(
+            unique_filename, 'wb', 0, aws_s3_bucket,
+            multipart_threshold=5 * MB, part_size=5 * MB
+        ) as git_file:
+            git_file.write(b'0' * size)
+            raise RuntimeError('source failed')
+
+    uploads = aws_s3_bucket.meta.client.list_multipart_uploads(
+        Bucket=aws_s3_bucket.name
+    )
+
+    assert not uploads.get('Uploads')
+
+    with pytest.raises(IOError):
+        git_aws.file.AwsS3GitFile(unique_filename, 'rb', 0, aws_s3_bucket)
+
+    git_aws.file.AwsS3GitFile(
+        unique_filename, 'wb', 0, aws_s3_bucket
+    ).abort()
+
+
+def test_rb_streaming(aws_s3_bucket, unique_filename):
+    """Test that the rb mode streams the content and only buffers it on a
+       backward seek.
+    """
+    content = bytes(range(256)) * 16
+    aws_s3_bucket.Object(unique_filename).put(Body=content)
+
+    with git_aws.file.AwsS3GitFile(unique_filename, 'rb', 100, aws_s3_bucket) as git_file:  # noqa
+        body = git_file._buffer.raw
+
+        assert git_file.read(10) == content[:10]
+        git_file.seek(1000)
+        assert git_file.readline() == content[1000:1035]
+        assert git_file.tell() == 1035
+        assert body._buffer is None
+
+        git_file.seek(5)
+        assert git_file.read(5) == content[5:10]
+        assert body._buffer is not None
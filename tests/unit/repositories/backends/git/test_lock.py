@@ -0,0 +1,168 @@
+import json
+import time
+
+import pytest
+
+from multiple import exceptions
+from multiple.repositories.backends import git as git_aws
+
+
+@pytest.fixture(params=('memory', 'local_file', 'aws_s3'))
+def lock_backend_factory(request, tmpdir):
+    def factory(lease_duration):
+        if request.param == 'memory':
+            return git_aws.lock.MemoryLockBackend(lease_duration)
+        elif request.param == 'local_file':
+            return git_aws.lock.LocalFileLockBackend(
+                str(tmpdir), lease_duration
+            )
+        else:
+            return git_aws.lock.AwsS3LockBackend(
+                request.getfixturevalue('aws_s3_bucket'), lease_duration
+            )
+
+    return factory
+
+
+def test_lock_is_exclusive(lock_backend_factory, unique_filename):
+    """Test that a lock can't be acquired twice until it's released"""
+    lock_backend = lock_backend_factory(60)
+
+    with lock_backend.acquire(unique_filename) as lock:
+        with pytest.raises(exceptions.LockError):
+            lock_backend.acquire(unique_filename)
+
+        lock.renew()
+
+    lock_backend.acquire(unique_filename).release()
+
+
+def test_expired_lock_is_taken_over(lock_backend_factory, unique_filename):
+    """Test that an expired lock can be taken over and can't be renewed"""
+    lock_backend = lock_backend_factory(0)
+
+    lock = lock_backend.acquire(unique_filename)
+    other_lock = lock_backend.acquire(unique_filename)
+
+    with pytest.raises(exceptions.LockError):
+        lock.renew()
+
+    # releasing a lost lock leaves the new owner untouched
+    lock.release()
+    other_lock.lease_duration = 60
+    other_lock.renew()
+
+    other_lock.release()
+
+
+def test_wb_lock_backend(aws_s3_bucket, unique_filename):
+    """Test that the lock of a file is taken with its lock backend"""
+    lock_backend = git_aws.lock.MemoryLockBackend()
+
+    with git_aws.file.AwsS3GitFile(
+        unique_filename, 'wb', 0, aws_s3_bucket, lock_backend=lock_backend
+    ):
+        with pytest.raises(IOError):
+            git_aws.file.AwsS3GitFile(
+                unique_filename, 'wb', 0, aws_s3_bucket,
+                lock_backend=lock_backend
+            )
+
+    git_aws.file.AwsS3GitFile(
+        unique_filename, 'wb', 0, aws_s3_bucket, lock_backend=lock_backend
+    ).abort()
+
+
+@pytest.mark.parametrize('multipart', (False, True))
+def test_wb_lost_lock_not_published(aws_s3_bucket, unique_filename,
+                                    multipart):
+    """Test that a file whose lock was taken over isn't published"""
+    lock_backend = git_aws.lock.MemoryLockBackend()
+    mb = 1024 * 1024
+
+    git_file = git_aws.file.AwsS3GitFile(
+        unique_filename, 'wb', 0, aws_s3_bucket, lock_backend=lock_backend,
+        multipart_threshold=5 * mb, part_size=5 * mb
+    )
+    git_file.write(b'0' * (6 * mb if multipart else 10))
+    assert (git_file._upload_id is not None) == multipart
+
+    # the lease expires and the lock is taken over
+    git_file._lock.expires = time.time()
+    lock_backend.acquire(git_file.lock_name)
+
+    with pytest.raises(exceptions.LockError):
+        git_file.close()
+
+    uploads = aws_s3_bucket.meta.client.list_multipart_uploads(
+        Bucket=aws_s3_bucket.name
+    )
+
+    assert not uploads.get('Uploads')
+
+    with pytest.raises(IOError):
+        git_aws.file.AwsS3GitFile(unique_filename, 'rb', 0, aws_s3_bucket)
+
+
+def test_local_file_takeover_race(tmpdir, unique_filename):
+    """Test that a lock taken over in the meantime isn't overwritten by
+       another writer seeing it expired.
+    """
+    lock_backend = git_aws.lock.LocalFileLockBackend(str(tmpdir), 0)
+    path = lock_backend._path(unique_filename)
+
+    expired_lock = lock_backend.acquire(unique_filename)
+    expired = lock_backend._read(path)
+
+    lock_backend.lease_duration = 60
+    lock = lock_backend.acquire(unique_filename)
+
+    # the writer read the lock while it was expired
+    read = lock_backend._read
+    lock_backend._read = lambda p: expired if p == path else read(p)
+
+    with pytest.raises(exceptions.LockError):
+        lock_backend.acquire(unique_filename)
+
+    lock_backend._read = read
+    expired_lock.release()
+
+    lock.renew()
+    lock.release()
+
+    assert not tmpdir.listdir()
+
+
+def test_local_file_renew_in_place(tmpdir, unique_filename, monkeypatch):
+    """Test that a lease renewed before it expires keeps its lock file, a
+       writer never finds the lock free in the meantime.
+    """
+    lock_backend = git_aws.lock.LocalFileLockBackend(str(tmpdir), 60)
+    other_lock_backend = git_aws.lock.LocalFileLockBackend(str(tmpdir), 60)
+    lock = lock_backend.acquire(unique_filename)
+    expires = lock.expires
+    acquired = []
+
+    dump = json.dump
+
+    def acquire_and_dump(*args, **kwargs):
+        # another writer tries to acquire while the lock file is written
+        monkeypatch.setattr(json, 'dump', dump)
+
+        try:
+            acquired.append(other_lock_backend.acquire(unique_filename))
+        except exceptions.LockError:
+            pass
+
+        return dump(*args, **kwargs)
+
+    time.sleep(0.01)
+    monkeypatch.setattr(json, 'dump', acquire_and_dump)
+    lock.renew()
+
+    assert not acquired
+    assert lock.expires > expires
+    assert lock_backend._read(lock_backend._path(unique_filename)) \
+        == {'owner': lock.owner, 'expires': lock.expires}
+
+    lock.release()
@@ -0,0 +1,581 @@
+import io
+import time
+
+import dulwich.objects
+import dulwich.refs
+import dulwich.repo
+import pytest
+
+from multiple import caches
+from multiple.repositories.backends import git as git_aws
+from multiple.repositories.backends.git import main as git_main
+
+
+@pytest.fixture()
+def repository():
+    return git_main.RepositoryGit(dulwich.repo.MemoryRepo())
+
+
+@pytest.fixture()
+def reference(repository):
+    """Provide a commit reference with a few files in nested trees."""
+    index = repository.open_index_at(None)
+    index.add((
+        (io.BytesIO(b'frame'), b'/assemblies/frame.json'),
+        (io.BytesIO(b'motor'), b'/parts/motor/motor.json'),
+        (io.BytesIO(b'wheel'), b'/parts/wheel.json'),
+        (io.BytesIO(b'readme'), b'/README'),
+    ))
+
+    return repository.commit(
+        index, message=b'test', author=b'test <test@wevolver.com>'
+    )
+
+
+def test_lazy_index_loads_nothing_up_front(repository, reference):
+    """Test that opening a lazy index only holds the root tree"""
+    index = repository.open_index_at(reference)
+
+    assert list(index._objects) == [b'']
+
+
+def test_lazy_index_loads_touched_paths(repository, reference):
+    """Test that a get loads the trees along the path only"""
+    index = repository.open_index_at(reference)
+
+    assert index.get(b'/parts/motor/motor.json').data == b'motor'
+    assert set(index._objects) == {
+        b'', b'parts', b'parts/motor', b'parts/motor/motor.json'
+    }
+    assert index.get(b'/parts/missing.json') is None
+
+
+def test_lazy_index_matches_eager_index(repository, reference):
+    """Test that the lazy and the eager index build the same trees"""
+    contents = (
+        (b'/parts/motor/coil.json', b'coil'),
+        (b'/parts/bolt.json', b'bolt'),
+    )
+    lazy_index = repository.open_index_at(reference)
+    eager_index = repository.open_index_at(reference, lazy=False)
+
+    for index in (lazy_index, eager_index):
+        index.add(
+            (io.BytesIO(content), path) for path, content in contents
+        )
+        index.remove((b'/README',))
+
+    assert lazy_index.root_tree.id == eager_index.root_tree.id
+    assert lazy_index.objects.keys() == eager_index.objects.keys()
+    assert lazy_index.get(b'README') is None
+
+
+def test_lazy_index_copy_on_write(repository, reference):
+    """Test that the trees of the reference are left untouched"""
+    commit = repository.backend[reference]
+    index = repository.open_index_at(reference)
+
+    index.add(((io.BytesIO(b'bolt'), b'/parts/bolt.json'), ))
+
+    assert index.root_tree.id != commit.tree
+    assert b'bolt.json' not in repository.backend[
+        repository.backend[commit.tree][b'parts'][1]
+    ]
+
+
+def test_add_stores_each_tree_once(repository):
+    """Test that a bulk add only stores the final trees"""
+    object_store = repository.backend.object_store
+    index = repository.open_index_at(None)
+
+    stored = []
+    add_object = object_store.add_object
+
+    def spy_add_object(obj):
+        stored.append(obj.id)
+        add_object(obj)
+
+    object_store.add_object = spy_add_object
+
+    index.add(
+        (io.BytesIO(str(n).encode()), b'/a/b/c/%d.json' % n)
+        for n in range(10)
+    )
+    assert len(stored) == 10
+
+    root_tree = index.root_tree
+
+    # the 10 blobs and the trees /a/b/c, /a/b, /a and the root
+    assert len(stored) == 14
+    assert len(set(stored)) == 14
+    assert root_tree.id in stored
+
+
+def test_remove_prunes_empty_trees(repository, reference):
+    """Test that the trees left empty by a remove are removed"""
+    index = repository.open_index_at(reference)
+
+    index.remove((b'/parts/motor/motor.json', ))
+
+    assert index.get(b'/parts/motor') is None
+    assert b'motor' not in repository.backend[index.root_tree[b'parts'][1]]
+
+    with pytest.raises(KeyError):
+        index.remove((b'/parts/motor/motor.json', ))
+
+
+def test_remove_prunes_new_empty_trees(repository, reference):
+    """Test that a tree created then emptied before the trees are built
+       isn't added.
+    """
+    index = repository.open_index_at(reference)
+
+    index.add(((io.BytesIO(b'b'), b'/a/b.txt'), ))
+    index.remove((b'/a/b.txt', ))
+
+    assert index.get(b'/a') is None
+    assert b'a' not in index.root_tree
+    assert index.get(b'/README').data == b'readme'
+
+
+def test_get_returns_a_stream(repository, reference):
+    """Test that the repository returns a stream on the content"""
+    content = repository.get(b'/parts/motor/motor.json', reference)
+
+    assert content.read(2) == b'mo'
+    assert content.read() == b'tor'
+    assert repository.get(b'/parts/motor', reference) is None
+    assert repository.get(b'/parts/missing.json', reference) is None
+    assert repository.get(b'/README/missing.json', reference) is None
+
+
+def test_get_many(repository, reference):
+    """Test that many contents are fetched at once"""
+    paths = [
+        b'/parts/motor/motor.json', b'/parts/wheel.json', b'/README',
+        b'/parts/missing.json', b'/README/missing.json', b'/parts',
+    ]
+
+    contents = dict(repository.get_many(paths, reference, max_workers=2))
+
+    assert contents.keys() == set(paths)
+    assert contents[b'/parts/motor/motor.json'].read() == b'motor'
+    assert contents[b'/parts/wheel.json'].read() == b'wheel'
+    assert contents[b'/README'].read() == b'readme'
+    assert contents[b'/parts/missing.json'] is None
+    assert contents[b'/README/missing.json'] is None
+    assert contents[b'/parts'] is None
+
+
+@pytest.fixture()
+def history(repository, reference):
+    """Provide the references of a linear history, the newest first."""
+    references = [reference]
+
+    for day, (path, content) in enumerate((
+        (b'/parts/wheel.json', b'wheel v2'),
+        (b'/README', b'readme v2'),
+        (b'/parts/wheel.json', b'wheel v3'),
+    )):
+        index = repository.open_index_at(references[0])
+        index.add(((io.BytesIO(content), path), ))
+        references.insert(0, repository.commit(
+            index, message=b'test', author=b'test <test@wevolver.com>',
+            at_time=time.gmtime(86400 * (day + 1))
+        ))
+
+    return references
+
+
+def test_commit_parents(repository, history):
+    """Test that a commit has the reference of its index as parent"""
+    assert repository.backend[history[0]].parents == [history[1]]
+    assert repository.backend[history[-1]].parents == []
+
+
+def test_commit_on_reference_name(repository, reference):
+    """Test that an index opened at a reference name commits on the commit
+       it names.
+    """
+    repository.backend.refs[b'refs/heads/master'] = reference
+    index = repository.open_index_at(b'refs/heads/master')
+    index.add(((io.BytesIO(b'wheel v2'), b'/parts/wheel.json'), ))
+
+    sha = repository.commit(
+        index, message=b'test', author=b'test <test@wevolver.com>'
+    )
+
+    assert repository.backend[sha].parents == [reference]
+    assert repository.commit_graph[sha].parents == [reference]
+
+
+def test_commit_on_bad_reference(repository, reference):
+    """Test that a commit with a parent which isn't a sha isn't stored"""
+    index = repository.open_index_at(reference)
+    index.reference = b'refs/heads/master'
+    stored = len(list(repository.backend.object_store))
+
+    with pytest.raises(ValueError):
+        repository.commit(
+            index, message=b'test', author=b'test <test@wevolver.com>'
+        )
+
+    assert len(list(repository.backend.object_store)) == stored
+
+
+def test_walk(repository, history):
+    """Test that the walk yields the history from the newest commit"""
+    assert list(repository.walk(history[0])) == history
+    assert list(repository.walk(history[0], max_count=2)) == history[:2]
+    assert list(repository.walk(history[1])) == history[1:]
+
+
+def test_walk_paths(repository, history):
+    """Test that the walk only yields the commits changing the paths"""
+    assert list(repository.walk(history[0], paths=[b'/parts/wheel.json'])) \
+        == [history[0], history[2], history[3]]
+    assert list(repository.walk(history[0], paths=[b'README'])) \
+        == [history[1], history[3]]
+    assert list(repository.walk(history[0], paths=[b'/parts/motor'])) \
+        == [history[3]]
+    assert list(repository.walk(history[0], paths=[b'/missing'])) == []
+
+
+def test_walk_times(repository, history):
+    """Test that the walk is bounded in time"""
+    assert list(repository.walk(
+        history[0], since=time.gmtime(86400 * 2),
+        until=time.gmtime(86400 * 2)
+    )) == [history[1]]
+
+
+def test_ancestry(repository, history):
+    """Test the ancestry of the references"""
+    index = repository.open_index_at(history[2])
+    index.add(((io.BytesIO(b'bolt'), b'/parts/bolt.json'), ))
+    branch = repository.commit(
+        index, message=b'test', author=b'test <test@wevolver.com>'
+    )
+
+    assert repository.is_ancestor(history[3], history[0])
+    assert not repository.is_ancestor(history[0], history[3])
+    assert not repository.is_ancestor(branch, history[0])
+    assert repository.merge_bases(branch, history[0]) == [history[2]]
+
+
+def test_walk_reads_the_commit_graph(repository, history, monkeypatch):
+    """Test that the walk doesn't read the commits in the graph"""
+    def fail_getitem(self, name):
+        raise AssertionError('commit read %r' % name)
+
+    monkeypatch.setattr(dulwich.repo.MemoryRepo, '__getitem__', fail_getitem)
+
+    assert list(repository.walk(history[0])) == history
+
+
+def test_commit_graph_on_disk(tmpdir):
+    """Test that the commit graph of a disk repository is kept next to the
+       packs and completed for the commits it misses.
+    """
+    backend = dulwich.repo.Repo.init_bare(str(tmpdir))
+    repository = git_main.RepositoryGit(backend)
+    references = [None]
+
+    for n in range(3):
+        index = repository.open_index_at(references[-1])
+        index.add(((io.BytesIO(b'%d' % n), b'/%d.json' % n), ))
+        references.append(repository.commit(
+            index, message=b'test', author=b'test <test@wevolver.com>'
+        ))
+
+    assert tmpdir.join('objects', 'info', 'commit-graph').check()
+
+    other_repository = git_main.RepositoryGit(
+        backend, commit_graph=git_aws.commit_graph.CommitGraph()
+    )
+
+    assert list(other_repository.walk(references[-1])) \
+        == references[:0:-1]
+    assert len(other_repository.commit_graph) == 3
+
+
+def test_info_in_disk_cache(aws_s3_bucket, unique_filename, tmpdir):
+    """Test that the commit graph and the path history of a bucket repository
+       are kept next to the disk cache and reused by the next processes.
+    """
+    def open_repository():
+        object_store = git_aws.object_store.AwsS3ObjectStore(
+            aws_s3_bucket, path=unique_filename,
+            disk_cache=caches.disk.DiskCache(str(tmpdir))
+        )
+
+        return git_main.RepositoryGit(dulwich.repo.BaseRepo(
+            object_store, dulwich.refs.DictRefsContainer({})
+        ))
+
+    repository = open_repository()
+    references = [None]
+
+    for n in range(3):
+        index = repository.open_index_at(references[-1])
+        index.add(((io.BytesIO(b'%d' % n), b'/%d.json' % n), ))
+        references.append(repository.commit(
+            index, message=b'test', author=b'test <test@wevolver.com>'
+        ))
+
+    other_repository = open_repository()
+
+    assert other_repository.commit_graph.path.startswith(str(tmpdir))
+    assert len(other_repository.commit_graph) == 3
+    assert list(other_repository.walk(references[-1])) \
+        == references[:0:-1]
+
+    assert other_repository.path_history.path.startswith(str(tmpdir))
+    assert all(
+        reference in other_repository.path_history
+        for reference in references[1:]
+    )
+    assert other_repository.history(b'/1.json') == [references[2]]
+
+
+def test_history(repository, history):
+    """Test that the path history lists the commits changing a path"""
+    assert repository.history(b'/parts/wheel.json') \
+        == [history[0], history[2], history[3]]
+    assert repository.history(b'/parts/wheel.json', max_count=1) \
+        == [history[0]]
+    assert repository.history(b'/parts') \
+        == [history[0], history[2], history[3]]
+    assert repository.history(b'README', reference=history[2]) \
+        == [history[3]]
+    assert repository.history(b'/missing') == []
+
+
+def test_history_indexes_missing_commits(repository, history):
+    """Test that the commits missing from the path history are indexed"""
+    repository.path_history = git_aws.path_history.PathHistory()
+
+    assert repository.history(b'/README') == []
+    assert repository.history(b'/README', reference=history[0]) \
+        == [history[1], history[3]]
+
+
+@pytest.mark.parametrize('source', ('refs', 'commit_graph'))
+def test_rebuild_path_history_reads_no_blob(repository, history, source,
+                                             monkeypatch):
+    """Test that the rebuild finds the commits from the refs or from the
+       commit graph, only the commits and the trees are read.
+    """
+    if source == 'refs':
+        repository.backend.refs[b'refs/heads/master'] = history[0]
+        repository.commit_graph = git_aws.commit_graph.CommitGraph()
+
+    object_store = repository.backend.object_store
+    getitem = type(object_store).__getitem__
+
+    def read_no_blob(self, sha):
+        obj = getitem(self, sha)
+        assert not isinstance(obj, dulwich.objects.Blob)
+        return obj
+
+    monkeypatch.setattr(type(object_store), '__getitem__', read_no_blob)
+    monkeypatch.setattr(type(object_store), '__iter__', None)
+
+    repository.rebuild_path_history()
+
+    assert repository.history(b'/README') == [history[1], history[3]]
+
+
+def test_get_from_cache(repository, reference):
+    """Test that the resolved paths and the objects are read from the cache
+       before the object store.
+    """
+    cached_repository = git_main.RepositoryGit(
+        repository.backend, cache=caches.sql.SqliteCache()
+    )
+
+    assert cached_repository.get(b'/parts/motor/motor.json', reference) \
+        .read() == b'motor'
+    assert cached_repository.open_index_at(reference) \
+        .get(b'/parts/wheel.json').data == b'wheel'
+
+    repository.backend.object_store._data.clear()
+
+    assert cached_repository.get(b'/parts/motor/motor.json', reference) \
+        .read() == b'motor'
+    assert cached_repository.open_index_at(reference) \
+        .get(b'/parts/wheel.json').data == b'wheel'
+
+
+def test_object_cache(repository, reference):
+    """Test that the parsed objects are shared by the repositories and the
+       indexes using the same object cache.
+    """
+    object_cache = git_aws.cache.ObjectCache()
+    cached_repository = git_main.RepositoryGit(
+        repository.backend, object_cache=object_cache
+    )
+
+    assert cached_repository.get(b'/parts/motor/motor.json', reference) \
+        .read() == b'motor'
+
+    hits = object_cache.stats.hits
+
+    other_repository = git_main.RepositoryGit(
+        repository.backend, object_cache=object_cache
+    )
+    index = other_repository.open_index_at(reference)
+
+    assert index.get(b'/parts/motor/motor.json').data == b'motor'
+    # the commit, the root tree and the trees along the path
+    assert object_cache.stats.hits >= hits + 4
+
+    index.add(((io.BytesIO(b'engine'), b'/parts/motor/motor.json'), ))
+    index.root_tree
+
+    assert cached_repository.get(b'/parts/motor/motor.json', reference) \
+        .read() == b'motor'
+
+
+def test_object_cache_evictions(repository, reference):
+    """Test that the object cache is bounded by the size of the objects."""
+    object_cache = git_aws.cache.ObjectCache(max_size=200, max_blob_size=0)
+    cached_repository = git_main.RepositoryGit(
+        repository.backend, object_cache=object_cache
+    )
+
+    cached_repository.get(b'/parts/motor/motor.json', reference).read()
+
+    stats = object_cache.stats
+    assert stats.evictions > 0 and stats.size <= 200
+
+
+def test_path_cache(repository, reference):
+    """Test that the trees resolved by path are cached, the next reads in
+       the same directory only load the tree of the directory.
+    """
+    path_cache = git_aws.cache.PathCache()
+    cached_repository = git_main.RepositoryGit(
+        repository.backend, path_cache=path_cache
+    )
+
+    assert cached_repository.get(b'/parts/motor/motor.json', reference) \
+        .read() == b'motor'
+    assert cached_repository.get(b'/parts/motor', reference) is None
+    assert cached_repository.get(b'/README/motor.json', reference) is None
+    assert cached_repository.get(b'/parts/engine.json', reference) is None
+
+    object_cache = git_aws.cache.ObjectCache()
+    other_repository = git_main.RepositoryGit(
+        repository.backend, object_cache=object_cache, path_cache=path_cache
+    )
+
+    assert other_repository.get(b'/parts/wheel.json', reference) \
+        .read() == b'wheel'
+    # the commit, the tree of the directory and the blob
+    assert object_cache.stats.misses == 3
+
+
+def test_diff(repository, reference):
+    """Test that the diff streams the changes between two references
+       without loading the subtrees with the same sha.
+    """
+    index = repository.open_index_at(reference)
+    index.remove((b'/README', b'/assemblies/frame.json'))
+    index.add((
+        (io.BytesIO(b'engine'), b'/parts/motor/motor.json'),
+        (io.BytesIO(b'battery'), b'/parts/battery.json'),
+        (io.BytesIO(b'frame'), b'/README/frame.json'),
+    ))
+    other_reference = repository.commit(
+        index, message=b'test', author=b'test <test@wevolver.com>'
+    )
+
+    object_cache = git_aws.cache.ObjectCache()
+    cached_repository = git_main.RepositoryGit(
+        repository.backend, object_cache=object_cache
+    )
+    changes = [
+        (change.type, change.old.path, change.new.path)
+        for change in cached_repository.diff(reference, other_reference)
+    ]
+
+    assert changes == [
+        ('delete', b'README', None),
+        ('add', None, b'README/frame.json'),
+        ('delete', b'assemblies/frame.json', None),
+        ('add', None, b'parts/battery.json'),
+        ('modify', b'parts/motor/motor.json', b'parts/motor/motor.json'),
+    ]
+    # the commits and the changed trees, the new README tree is the old
+    # assemblies tree, the blobs aren't loaded
+    assert object_cache.stats.misses == 9
+
+    assert [
+        change.new.path for change in repository.diff(
+            reference, other_reference, paths=(b'/parts/motor', b'/parts')
+        )
+    ] == [b'parts/battery.json', b'parts/motor/motor.json']
+    assert list(repository.diff(
+        reference, other_reference, paths=(b'/parts/wheel.json', )
+    )) == []
+    assert list(repository.diff(reference, reference)) == []
+
+
+def test_open_sparse_index(repository, reference):
+    """Test that a sparse index only loads and tracks the contents under
+       its prefixes, the other subtrees are kept by sha.
+    """
+    index = repository.open_index_at(
+        reference, lazy=False, prefixes=(b'/parts/motor', b'/parts/motor/')
+    )
+
+    assert index.prefixes == [b'parts/motor']
+    assert sorted(index._objects) == [
+        b'', b'parts', b'parts/motor', b'parts/motor/motor.json'
+    ]
+
+    with pytest.raises(ValueError):
+        index.get(b'/parts/wheel.json')
+
+    with pytest.raises(ValueError):
+        index.add(((io.BytesIO(b'frame'), b'/parts/frame.json'), ))
+
+    index.add(((io.BytesIO(b'engine'), b'/parts/motor/engine.json'), ))
+    other_reference = repository.commit(
+        index, message=b'test', author=b'test <test@wevolver.com>'
+    )
+
+    assert sorted(index.objects) == [
+        b'', b'parts', b'parts/motor', b'parts/motor/engine.json',
+        b'parts/motor/motor.json'
+    ]
+    assert [
+        change.new.path
+        for change in repository.diff(reference, other_reference)
+    ] == [b'parts/motor/engine.json']
+
+
+def test_commit_pack(tmpdir):
+    """Test that an index in pack mode is committed as a single pack"""
+    backend = dulwich.repo.Repo.init_bare(str(tmpdir))
+    repository = git_main.RepositoryGit(backend)
+
+    index = repository.open_index_at(None, pack=True)
+    index.add((
+        (io.BytesIO(b'motor'), b'/parts/motor/motor.json'),
+        (io.BytesIO(b'wheel'), b'/parts/wheel.json'),
+    ))
+
+    assert index.get(b'/parts/wheel.json').data == b'wheel'
+
+    reference = repository.commit(
+        index, message=b'test', author=b'test <test@wevolver.com>'
+    )
+
+    object_store = backend.object_store
+    assert list(object_store._iter_loose_objects()) == []
+    assert len(tmpdir.join('objects', 'pack').listdir('*.pack')) == 1
+    assert len(object_store.packs[0]) == 6
+    assert repository.get(b'/parts/motor/motor.json', reference).read() \
+        == b'motor'
@@ -0,0 +1,168 @@
+import io
+import os
+
+import dulwich.objects
+import pytest
+
+from multiple import caches
+from multiple.repositories.backends import git as git_aws
+
+
+def test_multi_pack_index():
+    """Test that the objects are routed to their pack"""
+    shas = [os.urandom(20) for _ in range(100)]
+    records = [
+        (sha, b'%040x' % (n % 3)) for n, sha in enumerate(shas)
+    ]
+    f = io.BytesIO()
+
+    name = git_aws.multi_pack_index.write_multi_pack_index(
+        f, records + [(shas[0], b'%040x' % 4)]
+    )
+    multi_pack_index = git_aws.multi_pack_index.MultiPackIndex(f.getvalue())
+
+    assert len(name) == 40
+    assert len(multi_pack_index) == 100
+    assert multi_pack_index.pack_names == [b'%040x' % n for n in (0, 1, 2, 4)]
+    assert sorted(multi_pack_index.iterrecords()) == sorted(records)
+
+    for sha, pack_name in records:
+        assert multi_pack_index.lookup(sha) == pack_name
+        assert multi_pack_index.lookup(
+            dulwich.objects.sha_to_hex(sha)
+        ) == pack_name
+
+    assert os.urandom(20) not in multi_pack_index
+
+    with pytest.raises(ValueError):
+        git_aws.multi_pack_index.MultiPackIndex(b'PACK' + bytes(1100))
+
+
+def test_object_store_lookups(aws_s3_bucket, unique_filename, monkeypatch,
+                              tmpdir):
+    """Test that an object store loads only the index of the pack of an
+       object.
+    """
+    object_store = git_aws.object_store.AwsS3ObjectStore(
+        aws_s3_bucket, path=unique_filename, multi_pack_index_threshold=1
+    )
+    blobs = [
+        dulwich.objects.Blob.from_string(b'packed content %d' % n)
+        for n in range(3)
+    ]
+
+    for blob in blobs:
+        object_store.add_objects([(blob, None)])
+
+    loaded = []
+    load_pack_index = git_aws.pack.load_pack_index
+
+    def record_load(path, *args, **kwargs):
+        loaded.append(path)
+        return load_pack_index(path, *args, **kwargs)
+
+    monkeypatch.setattr(git_aws.pack, 'load_pack_index', record_load)
+
+    other_object_store = git_aws.object_store.AwsS3ObjectStore(
+        aws_s3_bucket, path=unique_filename,
+        disk_cache=caches.disk.DiskCache(str(tmpdir))
+    )
+
+    assert other_object_store[blobs[1].id].data == b'packed content 1'
+    assert len(loaded) == 1
+    assert not other_object_store.contains_packed(b'0' * 40)
+    assert len(loaded) == 1
+
+    # a pack added without a multi pack index is looked up by its index
+    blob = dulwich.objects.Blob.from_string(b'new content')
+    git_aws.object_store.AwsS3ObjectStore(
+        aws_s3_bucket, path=unique_filename, multi_pack_index=False
+    ).add_objects([(blob, None)])
+
+    assert other_object_store[blob.id].data == b'new content'
+    assert len(loaded) == 2
+    # the replaced indexes are kept until the grace period is over
+    assert len(list(aws_s3_bucket.objects.filter(
+        Prefix=object_store.multi_pack_index_prefix
+    ))) == 3
+
+
+def test_multi_pack_index_threshold(aws_s3_bucket, unique_filename):
+    """Test that the multi pack index is only rewritten once enough packs
+       aren't covered and that the replaced ones are kept until their grace
+       period is over.
+    """
+    object_store = git_aws.object_store.AwsS3ObjectStore(
+        aws_s3_bucket, path=unique_filename, multi_pack_index_threshold=2
+    )
+
+    def multi_pack_indexes():
+        return sorted(
+            summary.key for summary in aws_s3_bucket.objects.filter(
+                Prefix=object_store.multi_pack_index_prefix
+            )
+        )
+
+    blobs = [
+        dulwich.objects.Blob.from_string(b'packed content %d' % n)
+        for n in range(4)
+    ]
+
+    object_store.add_objects([(blobs[0], None)])
+    assert multi_pack_indexes() == []
+
+    object_store.add_objects([(blobs[1], None)])
+    first = multi_pack_indexes()
+    assert len(first) == 1
+
+    object_store.add_objects([(blobs[2], None)])
+    assert multi_pack_indexes() == first
+
+    # a store listed the first index before it was replaced
+    other_object_store = git_aws.object_store.AwsS3ObjectStore(
+        aws_s3_bucket, path=unique_filename
+    )
+    other_object_store.packs
+
+    object_store.add_objects([(blobs[3], None)])
+    assert len(multi_pack_indexes()) == 2
+
+    assert object_store.delete_retired_packs(3600) == 0
+    assert len(multi_pack_indexes()) == 2
+
+    object_store.delete_retired_packs(0)
+    assert multi_pack_indexes() == [object_store._multi_pack_index_key]
+
+    # the index it listed is missing, the packs are looked up one by one
+    other_object_store._multi_pack_index_key = None
+    other_object_store._multi_pack_index = None
+    other_object_store._multi_indexed = frozenset()
+    other_object_store._load_multi_pack_index(first[0])
+
+    assert other_object_store._multi_pack_index is None
+
+    for n, blob in enumerate(blobs):
+        assert other_object_store[blob.id].data == b'packed content %d' % n
+
+
+def test_multi_pack_index_stale_pack(aws_s3_bucket, unique_filename):
+    """Test that an object indexed in a pack retired since is looked up in
+       the other packs, even the ones the index covers.
+    """
+    object_store = git_aws.object_store.AwsS3ObjectStore(
+        aws_s3_bucket, path=unique_filename, multi_pack_index_threshold=1
+    )
+    blobs = [
+        dulwich.objects.Blob.from_string(b'packed content %d' % n)
+        for n in range(2)
+    ]
+
+    old_pack = object_store.add_objects([(blobs[0], None)])
+    object_store.add_objects([(blob, None) for blob in blobs])
+
+    assert object_store._multi_pack_index.lookup(blobs[0].id) \
+        == old_pack._basename[-40:].encode('ascii')
+
+    object_store.retire_pack(old_pack)
+
+    assert object_store[blobs[0].id].data == b'packed content 0'
@@ -0,0 +1,155 @@
+import dulwich.objects
+import pytest
+
+from multiple import caches
+from multiple.repositories.backends import git as git_aws
+
+
+@pytest.fixture()
+def disk_cache(tmpdir):
+    return caches.disk.DiskCache(str(tmpdir.join('cache')))
+
+
+@pytest.fixture()
+def object_store(aws_s3_bucket, unique_filename, disk_cache):
+    return git_aws.object_store.AwsS3ObjectStore(
+        aws_s3_bucket, path=unique_filename, disk_cache=disk_cache
+    )
+
+
+def test_loose_objects(object_store):
+    """Test that the loose objects can be added and read"""
+    blob = dulwich.objects.Blob.from_string(b'loose content')
+
+    assert blob.id not in object_store
+
+    object_store.add_object(blob)
+
+    assert object_store.contains_loose(blob.id)
+    assert not object_store.contains_packed(blob.id)
+    assert object_store[blob.id].data == b'loose content'
+    assert list(object_store) == [blob.id]
+
+
+def test_failed_object_stream_not_stored(object_store):
+    """Test that an object whose content stream fails or ends early isn't
+       stored under its sha.
+    """
+    blob = dulwich.objects.Blob.from_string(b'0' * 1024)
+
+    def failing_chunks():
+        yield b'0' * 512
+        raise IOError('source failed')
+
+    with pytest.raises(IOError):
+        object_store.add_object_stream(
+            blob.id, blob.type_num, 1024, failing_chunks()
+        )
+
+    with pytest.raises(ValueError):
+        object_store.add_object_stream(
+            blob.id, blob.type_num, 1024, iter([b'0' * 512])
+        )
+
+    assert not object_store.contains_loose(blob.id)
+    assert blob.id not in object_store
+
+
+def test_objects_written_without_lock(aws_s3_bucket, object_store):
+    """Test that the content addressed objects are written without taking
+       their lock.
+    """
+    blob = dulwich.objects.Blob.from_string(b'loose content')
+    key = object_store._get_shafile_key(blob.id)
+    lock_backend = git_aws.lock.AwsS3LockBackend(aws_s3_bucket)
+
+    with lock_backend.acquire(key + '.lock'):
+        object_store.add_object(blob)
+
+    assert object_store[blob.id].data == b'loose content'
+
+
+def test_packs(aws_s3_bucket, object_store, unique_filename):
+    """Test that the objects added as a pack are found by other stores"""
+    blobs = [
+        dulwich.objects.Blob.from_string(b'packed content %d' % n)
+        for n in range(5)
+    ]
+
+    pack = object_store.add_objects([(blob, None) for blob in blobs])
+
+    assert isinstance(pack, git_aws.pack.AwsS3Pack)
+
+    other_object_store = git_aws.object_store.AwsS3ObjectStore(
+        aws_s3_bucket, path=unique_filename
+    )
+
+    for blob in blobs:
+        assert other_object_store.contains_packed(blob.id)
+        assert other_object_store[blob.id].data == blob.data
+
+
+def test_warm_reads_without_requests(aws_s3_bucket, object_store,
+                                     unique_filename, disk_cache):
+    """Test that a store with a warm disk cache doesn't request the packs"""
+    blob = dulwich.objects.Blob.from_string(b'cached content')
+    pack = object_store.add_objects([(blob, None)])
+
+    assert object_store[blob.id].data == b'cached content'
+
+    other_object_store = git_aws.object_store.AwsS3ObjectStore(
+        aws_s3_bucket, path=unique_filename, disk_cache=disk_cache
+    )
+    other_object_store.packs
+
+    aws_s3_bucket.Object(pack._data_path).delete()
+    aws_s3_bucket.Object(pack._idx_path).delete()
+
+    assert other_object_store[blob.id].data == b'cached content'
+
+
+def test_warm_streams_without_loose_lookup(object_store):
+    """Test that a packed object is streamed without looking up the loose
+       objects.
+    """
+    blob = dulwich.objects.Blob.from_string(b'packed content')
+    object_store.add_objects([(blob, None)])
+
+    def contains_loose(sha):
+        raise AssertionError('the loose objects are looked up')
+
+    object_store.contains_loose = contains_loose
+
+    with git_aws.stream.open_object_stream(object_store, blob.id) as reader:
+        assert reader.read() == b'packed content'
+
+
+def test_disk_cache_eviction(tmpdir):
+    """Test that the least recently used entries are evicted"""
+    disk_cache = caches.disk.DiskCache(str(tmpdir), max_size=10)
+
+    disk_cache['a'] = b'aaaa'
+    disk_cache['b'] = b'bbbb'
+    assert disk_cache.get('a') == b'aaaa'
+
+    disk_cache['c'] = b'cccc'
+
+    assert 'b' not in disk_cache
+    assert disk_cache['a'] == b'aaaa'
+    assert disk_cache['c'] == b'cccc'
+    assert disk_cache.size == 8
+
+
+def test_disk_cache_shared_eviction(tmpdir):
+    """Test that the caches sharing a directory are bounded together"""
+    disk_cache = caches.disk.DiskCache(str(tmpdir), max_size=10)
+    other_disk_cache = caches.disk.DiskCache(str(tmpdir), max_size=10)
+
+    disk_cache['a'] = b'aaaa'
+    other_disk_cache['b'] = b'bbbb'
+    disk_cache['c'] = b'cccc'
+
+    assert 'a' not in disk_cache
+    assert disk_cache['b'] == b'bbbb'
+    assert disk_cache['c'] == b'cccc'
+    assert disk_cache.size == 8
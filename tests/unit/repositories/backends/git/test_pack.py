@@ -0,0 +1,220 @@
+import concurrent.futures
+import mmap
+
+from multiple import caches
+from multiple.repositories.backends import git as git_aws
+
+
+def test_range_file_fetches_blocks(aws_s3_file, aws_s3_bucket):
+    """Test that a range file only fetches the blocks being read"""
+    filename = aws_s3_file['filename']
+    content = aws_s3_file['content']
+
+    with git_aws.file.AwsS3RangeFile(
+        filename, aws_s3_bucket, block_size=4
+    ) as range_file:
+        assert range_file.size == len(content)
+
+        range_file.seek(5)
+        assert range_file.read(6) == content[5:11]
+        assert set(range_file._block_cache.keys()) == {
+            (filename, 1), (filename, 2)
+        }
+
+        range_file.seek(-3, 2)
+        assert range_file.read() == content[-3:]
+        assert range_file.read() == b''
+
+
+def test_pack_reads_objects_with_ranges(aws_s3_pack, aws_s3_bucket):
+    """Test that the objects of a pack are read without downloading the
+       whole pack.
+    """
+    pack = git_aws.pack.AwsS3Pack(
+        aws_s3_pack['basename'], aws_s3_bucket=aws_s3_bucket,
+        block_size=1024
+    )
+    blob = aws_s3_pack['blobs'][5]
+
+    assert pack[blob.id].data == blob.data
+
+    cached = pack.data._file._block_cache._value_size
+    assert cached < pack.data._file.size / 2
+
+    for blob in aws_s3_pack['blobs']:
+        assert pack[blob.id].data == blob.data
+
+
+def test_pack_index_is_mapped_from_the_disk_cache(aws_s3_pack, aws_s3_bucket,
+                                                  tmpdir):
+    """Test that an index is downloaded once and then mapped from the disk
+       cache.
+    """
+    disk_cache = caches.disk.DiskCache(str(tmpdir))
+    path = aws_s3_pack['basename'] + '.idx'
+
+    index = git_aws.pack.load_pack_index(path, aws_s3_bucket, disk_cache)
+    assert isinstance(index._contents, mmap.mmap)
+
+    aws_s3_bucket.Object(path).delete()
+
+    cached_index = git_aws.pack.load_pack_index(
+        path, aws_s3_bucket, disk_cache
+    )
+    assert isinstance(cached_index._contents, mmap.mmap)
+    assert list(cached_index.iterentries()) == list(index.iterentries())
+
+
+def test_pack_prefetches_neighbour_objects(aws_s3_pack, aws_s3_bucket):
+    """Test that the neighbour objects are fetched with a single request"""
+    pack = git_aws.pack.AwsS3Pack(
+        aws_s3_pack['basename'], aws_s3_bucket=aws_s3_bucket,
+        block_size=1024
+    )
+    offsets = [offset for _, offset, _ in pack.index.iterentries()]
+
+    fetched = []
+    fetch = pack.data._file._fetch
+
+    def spy_fetch(first_block, last_block):
+        fetched.append((first_block, last_block))
+        return fetch(first_block, last_block)
+
+    pack.data._file._fetch = spy_fetch
+    pack.data.prefetch_objects(offsets)
+
+    assert len(fetched) == 1
+
+    for blob in aws_s3_pack['blobs']:
+        assert pack[blob.id].data == blob.data
+
+    assert len(fetched) == 1
+
+
+def test_pack_caches_delta_bases(aws_s3_pack, aws_s3_bucket):
+    """Test that the base of a delta is inflated once and counted"""
+    delta_base_cache = git_aws.pack.DeltaBaseCache()
+    pack = git_aws.pack.AwsS3Pack(
+        aws_s3_pack['basename'], aws_s3_bucket=aws_s3_bucket,
+        delta_base_cache=delta_base_cache
+    )
+    # the older version is stored as a delta of the newer one
+    delta = aws_s3_pack['blobs'][-2]
+
+    assert pack[delta.id].data == delta.data
+
+    # the delta and its base are missed, the base and the resolved object
+    # are cached
+    stats = delta_base_cache.stats
+    assert stats.misses == 2
+    assert stats.size >= 2 * len(delta.data)
+    inflated_bytes = stats.inflated_bytes
+    assert inflated_bytes > len(delta.data)
+
+    assert pack[delta.id].data == delta.data
+
+    stats = delta_base_cache.stats
+    assert stats.hits == 1
+    assert stats.inflated_bytes == inflated_bytes
+
+
+def test_delta_base_cache_is_shared_by_packs(aws_s3_pack, aws_s3_bucket):
+    """Test that the packs sharing a delta base cache are bounded by its
+       size.
+    """
+    delta_base_cache = git_aws.pack.DeltaBaseCache(max_size=6000)
+    object_store = git_aws.object_store.AwsS3ObjectStore(
+        aws_s3_bucket, delta_base_cache=delta_base_cache
+    )
+    basename = aws_s3_pack['basename']
+    copy_basename = basename + '-copy'
+
+    for extension in ('.pack', '.idx'):
+        aws_s3_bucket.Object(copy_basename + extension).copy_from(
+            CopySource={
+                'Bucket': aws_s3_bucket.name, 'Key': basename + extension
+            }
+        )
+
+    packs = [
+        object_store._new_pack(name) for name in (basename, copy_basename)
+    ]
+    # the older version is stored as a delta of the newer one
+    delta = aws_s3_pack['blobs'][-2]
+
+    for pack in packs:
+        assert pack.data.delta_base_cache is delta_base_cache
+        assert pack[delta.id].data == delta.data
+
+    stats = delta_base_cache.stats
+    assert stats.misses == 4
+    assert stats.evictions > 0
+    assert stats.size <= stats.max_size
+
+
+def test_pack_resolves_objects_in_batch(aws_s3_pack, aws_s3_bucket):
+    """Test that the objects of a batch are fetched with a single request
+       and their shared bases resolved once.
+    """
+    delta_base_cache = git_aws.pack.DeltaBaseCache()
+    pack = git_aws.pack.AwsS3Pack(
+        aws_s3_pack['basename'], aws_s3_bucket=aws_s3_bucket,
+        block_size=1024, delta_base_cache=delta_base_cache
+    )
+    offsets = {
+        sha: offset for sha, offset, _ in pack.index.iterentries()
+    }
+
+    fetched = []
+    fetch = pack.data._file._fetch
+
+    def spy_fetch(first_block, last_block):
+        fetched.append((first_block, last_block))
+        return fetch(first_block, last_block)
+
+    pack.data._file._fetch = spy_fetch
+
+    with concurrent.futures.ThreadPoolExecutor(4) as executor:
+        resolved = pack.resolve_objects(offsets.values(), executor)
+
+    assert len(fetched) == 1
+
+    for blob in aws_s3_pack['blobs']:
+        type_num, chunks = resolved[offsets[blob.sha().digest()]]
+
+        assert type_num == blob.type_num
+        assert b''.join(chunks) == blob.data
+
+    # each object is inflated once, the deltified blob is smaller inflated
+    assert delta_base_cache.stats.inflated_bytes < sum(
+        len(blob.data) for blob in aws_s3_pack['blobs']
+    )
+
+
+def test_pack_reads_objects_without_index_scan(aws_s3_pack, aws_s3_bucket):
+    """Test that the end of an object is bounded from its header, not from
+       the offsets of all the objects of the index.
+    """
+    pack = git_aws.pack.AwsS3Pack(
+        aws_s3_pack['basename'], aws_s3_bucket=aws_s3_bucket,
+        block_size=1024
+    )
+
+    def iterentries():
+        raise AssertionError('the index is scanned')
+
+    pack.index.iterentries = iterentries
+
+    fetched = []
+    fetch = pack.data._file._fetch
+
+    def spy_fetch(first_block, last_block):
+        fetched.append((first_block, last_block))
+        return fetch(first_block, last_block)
+
+    pack.data._file._fetch = spy_fetch
+    blob = aws_s3_pack['blobs'][5]
+
+    assert pack[blob.id].data == blob.data
+    # the block of the header, then the rest of the object
+    assert len(fetched) == 2
@@ -0,0 +1,225 @@
+import time
+
+import dulwich.objects
+import pytest
+
+from multiple import exceptions
+from multiple.repositories.backends import git as git_aws
+
+
+@pytest.fixture()
+def object_store(aws_s3_bucket, unique_filename):
+    return git_aws.object_store.AwsS3ObjectStore(
+        aws_s3_bucket, path=unique_filename
+    )
+
+
+def add_commit(object_store, content, parents=()):
+    blob = dulwich.objects.Blob.from_string(content)
+    tree = dulwich.objects.Tree()
+    tree.add(b'motor.json', 0o100644, blob.id)
+
+    commit = dulwich.objects.Commit()
+    commit.tree = tree.id
+    commit.parents = list(parents)
+    commit.author = commit.committer = b'test <test@wevolver.com>'
+    commit.commit_time = commit.author_time = 0
+    commit.commit_timezone = commit.author_timezone = 0
+    commit.message = b'test'
+
+    object_store.add_objects([(obj, None) for obj in (blob, tree, commit)])
+
+    return commit.id
+
+
+def test_repack(aws_s3_bucket, object_store, unique_filename):
+    """Test that the small packs and the loose objects are merged"""
+    references = [add_commit(object_store, b'motor')]
+    references.append(add_commit(object_store, b'engine', references))
+    loose_blob = dulwich.objects.Blob.from_string(b'loose')
+    object_store.add_object(loose_blob)
+
+    repacker = git_aws.repack.Repacker(object_store)
+    steps = repacker.run()
+
+    assert [step[1:] for step in steps] == [(2, 1, 0)]
+
+    other_object_store = git_aws.object_store.AwsS3ObjectStore(
+        aws_s3_bucket, path=unique_filename
+    )
+
+    assert [pack._basename for pack in other_object_store.packs] \
+        == [steps[0].pack._basename]
+    assert list(other_object_store._iter_loose_objects()) == []
+    assert other_object_store[loose_blob.id].data == b'loose'
+    assert len(git_aws.repack.reachable_objects(
+        other_object_store, references[-1:]
+    )) == 6
+
+    assert repacker.repack() is None
+
+
+def test_repack_prune(object_store):
+    """Test that the unreachable objects are dropped"""
+    reference = add_commit(object_store, b'motor')
+    unreachable = add_commit(object_store, b'engine')
+    loose_blob = dulwich.objects.Blob.from_string(b'loose')
+    object_store.add_object(loose_blob)
+
+    steps = git_aws.repack.Repacker(
+        object_store, prune_expiry=0
+    ).run([reference])
+
+    assert [step[1:] for step in steps] == [(2, 1, 4)]
+    assert reference in object_store
+    assert unreachable not in object_store
+    assert loose_blob.id not in object_store
+
+
+def test_repack_reachable_once(object_store, monkeypatch):
+    """Test that the reachable objects are computed once per run"""
+    reference = add_commit(object_store, b'motor')
+    for n in range(5):
+        object_store.add_object(dulwich.objects.Blob.from_string(b'%d' % n))
+
+    calls = []
+    reachable_objects = git_aws.repack.reachable_objects
+
+    def record_reachable_objects(*args):
+        calls.append(args)
+        return reachable_objects(*args)
+
+    monkeypatch.setattr(
+        git_aws.repack, 'reachable_objects', record_reachable_objects
+    )
+
+    steps = git_aws.repack.Repacker(
+        object_store, max_step_size=200
+    ).run([reference])
+
+    assert len(steps) > 1
+    assert len(calls) == 1
+
+
+def test_repack_lost_lock(object_store, monkeypatch):
+    """Test that a repacker which lost its lock while adding the new pack
+       doesn't replace the merged packs.
+    """
+    add_commit(object_store, b'motor')
+    add_commit(object_store, b'engine')
+    packs = {pack._basename for pack in object_store.packs}
+
+    repacker = git_aws.repack.Repacker(
+        object_store, lock_backend=git_aws.lock.MemoryLockBackend()
+    )
+    add_pack = repacker._add_pack
+
+    def lose_lock(objects):
+        pack = add_pack(objects)
+        repacker.lock_backend._locks.clear()
+        return pack
+
+    monkeypatch.setattr(repacker, '_add_pack', lose_lock)
+
+    with pytest.raises(exceptions.LockError):
+        repacker.repack()
+
+    object_store._update_pack_cache()
+
+    assert packs <= {pack._basename for pack in object_store.packs}
+
+
+def test_repack_prune_keeps_young_objects(object_store):
+    """Test that the unreachable objects younger than the prune expiry are
+       kept, e.g the objects of an index not committed yet.
+    """
+    reference = add_commit(object_store, b'motor')
+    unreachable = add_commit(object_store, b'engine')
+    loose_blob = dulwich.objects.Blob.from_string(b'loose')
+    object_store.add_object(loose_blob)
+
+    steps = git_aws.repack.Repacker(object_store).run([reference])
+
+    assert [step[1:] for step in steps] == [(2, 1, 0)]
+    assert unreachable in object_store
+    assert loose_blob.id in object_store
+
+
+def test_repack_bounds_loose_objects(object_store):
+    """Test that the loose objects merged by a step fit its size"""
+    blobs = [
+        dulwich.objects.Blob.from_string(b'%d' % n * 100) for n in range(10)
+    ]
+    for blob in blobs:
+        object_store.add_object(blob)
+
+    steps = git_aws.repack.Repacker(object_store, max_step_size=450).run()
+
+    assert steps[0].loose_objects == 4
+    assert len(steps) > 2
+    assert list(object_store._iter_loose_objects()) == []
+
+    for blob in blobs:
+        assert object_store[blob.id].data == blob.data
+
+
+def test_repack_retires_packs(aws_s3_bucket, object_store, unique_filename):
+    """Test that the merged packs stay readable by the stores which listed
+       them until the grace period is over.
+    """
+    sha = add_commit(object_store, b'motor')
+    add_commit(object_store, b'engine')
+
+    other_object_store = git_aws.object_store.AwsS3ObjectStore(
+        aws_s3_bucket, path=unique_filename, multi_pack_index=False
+    )
+    listed = other_object_store.packs
+
+    repacker = git_aws.repack.Repacker(object_store, grace_period=0)
+    step, = repacker.run()
+
+    assert [pack._basename for pack in git_aws.object_store.AwsS3ObjectStore(
+        aws_s3_bucket, path=unique_filename
+    ).packs] == [step.pack._basename]
+    assert other_object_store[sha].id == sha
+
+    # the next step deletes the retired packs, the stores look the packs up
+    # again
+    assert repacker.repack() is None
+
+    for pack in listed:
+        with pytest.raises(Exception):
+            aws_s3_bucket.Object(pack._idx_path).load()
+
+    other_object_store = git_aws.object_store.AwsS3ObjectStore(
+        aws_s3_bucket, path=unique_filename, multi_pack_index=False
+    )
+    other_object_store._pack_cache.update(
+        (pack._basename, pack) for pack in listed
+    )
+    other_object_store._packs_listed = True
+
+    assert other_object_store[sha].id == sha
+
+
+def test_repack_lock(object_store):
+    """Test that a single repacker changes the packs"""
+    repacker = git_aws.repack.Repacker(object_store)
+
+    with repacker.lock_backend.acquire(repacker.lock_name):
+        with pytest.raises(exceptions.LockError):
+            repacker.repack()
+
+
+def test_budget(monkeypatch):
+    """Test that the reads are throttled to the io rate"""
+    delays = []
+    monkeypatch.setattr(time, 'sleep', delays.append)
+
+    budget = git_aws.repack.Budget(io_rate=1000)
+    budget.consume(2000)
+
+    assert 1.5 < delays[0] <= 2
+
+    with pytest.raises(ValueError):
+        git_aws.repack.Budget(cpu_ratio=2)
@@ -0,0 +1,208 @@
+import io
+
+import dulwich.objects
+import dulwich.pack
+import dulwich.repo
+import pytest
+
+from multiple.repositories.backends import git as git_aws
+
+
+class ReadRecorder(io.RawIOBase):
+    """Non seekable stream recording the size of the reads."""
+
+    def __init__(self, content):
+        self._content = io.BytesIO(content)
+        self.read_sizes = []
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        self.read_sizes.append(size)
+        return self._content.read(size)
+
+
+@pytest.fixture()
+def disk_repository(tmpdir):
+    return dulwich.repo.Repo.init_bare(str(tmpdir))
+
+
+@pytest.mark.parametrize('seekable', (True, False))
+def test_add_blob_stream(disk_repository, seekable):
+    """Test that a stream is stored as a loose blob with the git sha"""
+    content = b'0123456789' * 100
+    object_store = disk_repository.object_store
+
+    if seekable:
+        content_stream = io.BytesIO(content)
+    else:
+        content_stream = ReadRecorder(content)
+
+    sha = git_aws.stream.add_blob_stream(
+        object_store, content_stream, chunk_size=64
+    )
+
+    assert sha == dulwich.objects.Blob.from_string(content).id
+    assert object_store.contains_loose(sha)
+    assert object_store[sha].data == content
+
+    if not seekable:
+        assert set(content_stream.read_sizes) == {64}
+
+
+def test_add_blob_stream_existing(disk_repository):
+    """Test that an existing blob isn't written again"""
+    object_store = disk_repository.object_store
+    blob = dulwich.objects.Blob.from_string(b'content')
+
+    object_store.add_object(blob)
+
+    def add_object_stream(*args):
+        raise AssertionError('the blob must not be written again')
+
+    object_store.add_object_stream = add_object_stream
+
+    sha = git_aws.stream.add_blob_stream(object_store, io.BytesIO(b'content'))
+
+    assert sha == blob.id
+
+
+@pytest.mark.parametrize('packed', (True, False))
+def test_open_object_stream(disk_repository, packed):
+    """Test that a loose or packed object can be read and seek on demand"""
+    content = bytes(range(256)) * 64
+    blob = dulwich.objects.Blob.from_string(content)
+    object_store = disk_repository.object_store
+
+    if packed:
+        object_store.add_objects([(blob, None)])
+    else:
+        object_store.add_object(blob)
+
+    assert object_store.contains_packed(blob.id) == packed
+
+    with git_aws.stream.open_object_stream(
+        object_store, blob.id, chunk_size=100
+    ) as reader:
+        assert reader.length == len(content)
+        assert reader.read(10) == content[:10]
+
+        reader.seek(1000)
+        assert reader.read(300) == content[1000:1300]
+
+        reader.seek(5)
+        assert reader.read(5) == content[5:10]
+
+        reader.seek(-6, io.SEEK_END)
+        assert reader.read() == content[-6:]
+
+        reader.seek(0)
+        assert reader.read() == content
+
+
+def test_open_object_stream_memory():
+    """Test that the objects of an unknown storage are read in memory"""
+    object_store = dulwich.repo.MemoryRepo().object_store
+    blob = dulwich.objects.Blob.from_string(b'content')
+
+    object_store.add_object(blob)
+
+    reader = git_aws.stream.open_object_stream(object_store, blob.id)
+
+    assert reader.read() == b'content'
+
+
+def test_open_object_streams(aws_s3_bucket, aws_s3_pack):
+    """Test that the objects are opened concurrently, loose or packed"""
+    object_store = git_aws.object_store.AwsS3ObjectStore(
+        aws_s3_bucket, block_size=1024
+    )
+    loose_blob = dulwich.objects.Blob.from_string(b'loose content')
+    object_store.add_object(loose_blob)
+    blobs = aws_s3_pack['blobs'] + [loose_blob]
+
+    contents = {
+        sha: content.read()
+        for sha, content in git_aws.stream.open_object_streams(
+            object_store, [blob.id for blob in blobs], max_workers=4
+        )
+    }
+
+    assert contents == {blob.id: blob.data for blob in blobs}
+
+
+def test_open_object_streams_disk_pack(disk_repository):
+    """Test that the objects of a disk pack are opened concurrently, each
+       thread reads the pack with its own file.
+    """
+    object_store = disk_repository.object_store
+    blobs = [
+        dulwich.objects.Blob.from_string(
+            b'content %d ' % (n % 10) * 200 + b'%d' % n
+        )
+        for n in range(400)
+    ]
+
+    f, commit, abort = object_store.add_pack()
+    dulwich.pack.write_pack_objects(
+        f.write, [(blob, None) for blob in blobs], deltify=True
+    )
+    commit()
+
+    for _ in range(3):
+        contents = {
+            sha: content.read()
+            for sha, content in git_aws.stream.open_object_streams(
+                object_store, [blob.id for blob in blobs], max_workers=16,
+                chunk_size=64
+            )
+        }
+
+        assert contents == {blob.id: blob.data for blob in blobs}
+
+
+def test_load_objects(aws_s3_bucket, aws_s3_pack):
+    """Test that the objects are loaded together, loose or packed"""
+    object_store = git_aws.object_store.AwsS3ObjectStore(
+        aws_s3_bucket, block_size=1024
+    )
+    loose_blob = dulwich.objects.Blob.from_string(b'loose content')
+    object_store.add_object(loose_blob)
+    blobs = aws_s3_pack['blobs'] + [loose_blob]
+
+    objects = list(git_aws.stream.load_objects(
+        object_store, [blob.id for blob in blobs], max_workers=4
+    ))
+
+    assert sorted(objects) == sorted(blobs)
+
+
+def test_pack_writer(aws_s3_bucket, unique_filename):
+    """Test that the objects collected by a pack writer are readable and
+       added to the object store as a single pack.
+    """
+    object_store = git_aws.object_store.AwsS3ObjectStore(
+        aws_s3_bucket, path=unique_filename
+    )
+    writer = git_aws.stream.PackWriter(object_store)
+
+    blob = dulwich.objects.Blob.from_string(b'packed content')
+    writer.add_object(blob)
+    writer.add_object(blob)
+    sha = git_aws.stream.add_blob_stream(
+        writer, io.BytesIO(b'streamed content'), chunk_size=4
+    )
+
+    assert len(writer) == 2
+    assert writer[sha].data == b'streamed content'
+    assert sha not in object_store
+
+    pack = writer.commit()
+
+    assert isinstance(pack, git_aws.pack.AwsS3Pack)
+    assert len(writer) == 0
+    assert list(object_store._iter_loose_objects()) == []
+    assert object_store[blob.id].data == b'packed content'
+    assert object_store[sha].data == b'streamed content'
+    assert writer.commit() is None